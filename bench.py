@@ -0,0 +1,234 @@
+"""
+Benchmarks for the bot's hot paths on synthetic data.
+
+    python bench.py                          # default sizes, JSON to stdout
+    python bench.py --users 5000 --out run.json
+    python bench.py --compare baseline.json  # also print ratios against an earlier run
+
+Everything runs in a throwaway directory with BOT_TRANSPORT=fake, so no
+token or network is needed and sends are recorded by fakevk instead of
+going to VK. Each benchmark reports min/median/mean/max milliseconds over
+--repeat runs; compare medians between runs to spot regressions.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def parse_args():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--users", type=int, default=2000, help="synthetic users in states.json")
+    ap.add_argument("--plan-lines", type=int, default=100, help="plan.txt lines per ordinary user")
+    ap.add_argument("--heavy-plan-lines", type=int, default=5000, help="plan.txt lines of the heavy user")
+    ap.add_argument("--years", type=int, default=3, help="ledger history of the heavy user, in years")
+    ap.add_argument("--per-month", type=int, default=300, help="expenses per month for the heavy user")
+    ap.add_argument("--custom-reminders", type=int, default=2000, help="custom reminder keys in sent_reminders")
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--out", help="also write the JSON result here")
+    ap.add_argument("--compare", help="earlier result file to compare medians against")
+    return ap.parse_args()
+
+
+def load_bot(workdir):
+    """Import the bot's modules with workdir as the data directory and run init()."""
+    global config, storage, planner, ledger, reminders, handlers
+    os.chdir(workdir)
+    os.environ["BOT_TRANSPORT"] = "fake"
+    os.environ.pop("FAKEVK_SCRIPT", None)
+    sys.path.insert(0, HERE)
+    import logging
+    import bot, config, storage, planner, ledger, reminders, handlers
+    config.log.setLevel(logging.WARNING)
+    bot.init()
+
+
+def cold_start(workdir, repeat):
+    """Wall time of a fresh interpreter importing the bot, and of importing plus init() on the built dataset."""
+    env = dict(os.environ, BOT_TRANSPORT="fake", PYTHONPATH=HERE + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    results = {}
+    for name, code in (("python_startup", "pass"),
+                       ("import_bot", "import bot"),
+                       ("import_and_init", "import bot; bot.init()")):
+        results[name] = measure(lambda: subprocess.run([sys.executable, "-c", code], cwd=workdir, env=env, check=True),
+                                repeat)
+    return results
+
+
+# ----- synthetic data -----
+CATS = ["food", "transport", "fun", "shop", "bills", "health", "notmy", "other"]
+TAGS = ["#work", "#home", "#event", "#pers", "#control", "#gym"]
+
+
+def plan_lines(rng, count, now, first_uid=1):
+    lines = []
+    for i in range(count):
+        dt = now + timedelta(minutes=rng.randint(-30 * 24 * 60, 30 * 24 * 60))
+        lines.append(f"{dt.strftime('%Y-%m-%dT%H:%M')} Task {i} {rng.choice(TAGS)} uid{first_uid + i}")
+    lines.sort()
+    return lines
+
+
+def build_dataset(args, now):
+    rng = random.Random(args.seed)
+    uids = [str(100000 + i) for i in range(args.users)]
+    heavy = uids[0]
+    with storage.state_lock:
+        for uid in uids:
+            storage.states[uid] = {"state": config.STATE_START, "data": {}, "next_uid": args.plan_lines + 1}
+    for uid in uids:
+        count = args.heavy_plan_lines if uid == heavy else args.plan_lines
+        planner.write_events(uid, plan_lines(rng, count, now))
+
+    # heavy user: multi-year ledger, older months archived, recent ones live
+    entries, n = [], 0
+    for back in range(args.years * 12, -1, -1):
+        month_start = (now.replace(day=1) - timedelta(days=31 * back)).replace(day=1)
+        for _ in range(args.per_month):
+            n += 1
+            dt = month_start + timedelta(minutes=rng.randint(0, 27 * 24 * 60))
+            entries.append({"id": f"e{n}", "dt": dt.strftime("%Y-%m-%dT%H:%M"),
+                            "amount": rng.choice([rng.randint(50, 900), rng.randint(1000, 9000)]),
+                            "category": rng.choice(CATS), "desc": f"item {n}",
+                            "tool": rng.choice(config.KNOWN_TOOLS)})
+    entries.sort(key=lambda e: e["dt"])
+    ledger.write_expenses(heavy, entries)
+    storage.states[heavy]["next_exp_id"] = n + 1
+    ledger.archive_user_expenses(heavy, ledger.archive_cutoff(now.date()))
+    ledger.recalc_all_totals(heavy)
+
+    # custom reminders spread over users, a few due right now
+    with storage.reminder_lock:
+        for i in range(args.custom_reminders):
+            uid = uids[i % len(uids)]
+            event_dt = now + timedelta(minutes=rng.choice([15, 30, 600, 2000]))
+            key = f"{uid}|uid{i}|{event_dt.isoformat()}|custom_15m"
+            reminders.sent_reminders[key] = {"minutes_before": 15, "event_desc": f"Task {i}", "notified": False}
+    storage.save_states()
+    return uids, heavy
+
+
+# ----- measurement -----
+def measure(fn, repeat, setup=None):
+    times = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        t0 = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - t0) * 1000)
+    return {
+        "n": repeat,
+        "min_ms": round(min(times), 3),
+        "median_ms": round(statistics.median(times), 3),
+        "mean_ms": round(statistics.mean(times), 3),
+        "max_ms": round(max(times), 3),
+    }
+
+
+def run_benchmarks(args, uids, heavy, now):
+    import fakevk
+    results = {}
+    reminders0 = json.loads(json.dumps(reminders.sent_reminders))
+
+    def reset_reminders():
+        with storage.reminder_lock:
+            reminders.sent_reminders.clear()
+            reminders.sent_reminders.update(json.loads(json.dumps(reminders0)))
+
+    counter = iter(range(10**9))
+    results["set_data"] = measure(lambda: storage.set_data(uids[1], "bench", next(counter)), args.repeat)
+    results["save_states"] = measure(storage.save_states, args.repeat)
+    results["save_expense"] = measure(
+        lambda: ledger.save_expense(heavy, 450, "food", "bench", dt=now, tool="gp"), args.repeat)
+
+    def this_month():
+        handlers.handle_message(fakevk.FakeEvent(int(heavy), "📊 This month", 1))
+    results["this_month_report"] = measure(
+        this_month, args.repeat, setup=lambda: storage.set_state(heavy, config.STATE_EXP_MENU))
+
+    def day_groups_format():
+        # a page of an uncached list: group the whole plan, format one page of days
+        today = now.date()
+        groups = planner.day_groups(planner.read_events(heavy))
+        return [planner.format_day_group(day, items, today) for day, items in groups[:config.DAYS_PER_BATCH]]
+    results["day_groups_format"] = measure(day_groups_format, args.repeat)
+
+    def paginate():
+        handlers.open_cursor(heavy, "events")
+        handlers.send_batch(heavy)
+        handlers.send_batch(heavy)
+    results["pagination_two_pages"] = measure(paginate, args.repeat)
+
+    results["events_for_date"] = measure(lambda: planner.events_for_date(heavy, now.date()), args.repeat)
+    results["hourly_reminder_tick"] = measure(
+        lambda: reminders.hourly_reminder_tick(now), args.repeat, setup=reset_reminders)
+    results["custom_reminder_tick"] = measure(
+        lambda: reminders.custom_reminder_tick(now), args.repeat, setup=reset_reminders)
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=HERE,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    args = parse_args()
+    out = os.path.abspath(args.out) if args.out else None
+    baseline = os.path.abspath(args.compare) if args.compare else None
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="vkbot-bench-") as workdir:
+        try:
+            load_bot(workdir)
+            now = datetime.now().replace(second=0, microsecond=0)
+
+            t0 = time.perf_counter()
+            uids, heavy = build_dataset(args, now)
+            setup_s = time.perf_counter() - t0
+
+            result = {
+                "meta": {
+                    "timestamp": datetime.now().isoformat(timespec="seconds"),
+                    "revision": git_revision(),
+                    "python": platform.python_version(),
+                    "platform": platform.platform(),
+                    "args": {k: v for k, v in vars(args).items() if k not in ("out", "compare")},
+                    "dataset_setup_s": round(setup_s, 2),
+                },
+                "results": run_benchmarks(args, uids, heavy, now),
+            }
+            result["results"].update(cold_start(workdir, args.repeat))
+        finally:
+            os.chdir(cwd)       # out of the directory before it is removed
+    text = json.dumps(result, indent=2)
+    print(text)
+    if out:
+        with open(out, "w") as f:
+            f.write(text + "\n")
+    if baseline:
+        with open(baseline) as f:
+            base = json.load(f)["results"]
+        print("\nmedian vs baseline:", file=sys.stderr)
+        for name, r in result["results"].items():
+            if name in base and base[name]["median_ms"]:
+                ratio = r["median_ms"] / base[name]["median_ms"]
+                print(f"  {name:24s} {r['median_ms']:10.3f} ms  x{ratio:.2f}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,118 @@
+"""
+JSON encoding for every store the bot writes.
+
+Files are written compactly: no indentation, and UTF-8 text instead of
+\\u escapes. orjson is used when it is installed, the stdlib json module
+otherwise. Both produce plain JSON, and both read the pretty-printed
+files written by older versions, so no store needs converting before the
+bot can start.
+
+Environment:
+    BOT_JSON_CODEC   "json" forces the stdlib codec even if orjson is installed
+    BOT_JSON_PRETTY  "1" writes indented files, for reading by hand
+
+iter_array() decodes a top-level JSON array one element at a time, so a
+scan over a large ledger holds one chunk of text and the current element
+instead of the whole list.
+"""
+import json
+import os
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if os.environ.get("BOT_JSON_CODEC") == "json":
+    orjson = None
+
+PRETTY = os.environ.get("BOT_JSON_PRETTY") == "1"
+NAME = "orjson" if orjson is not None else "json"
+CHUNK_SIZE = 1 << 16            # characters read per step by iter_array
+
+_STDLIB_ARGS = {"indent": 2} if PRETTY else {"separators": (",", ":")}
+
+
+def _std_dumps(obj):
+    return json.dumps(obj, ensure_ascii=False, **_STDLIB_ARGS)
+
+
+if orjson is not None:
+    _OPTIONS = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if PRETTY else 0)
+
+    def dumpb(obj):
+        """obj as UTF-8 JSON bytes."""
+        try:
+            return orjson.dumps(obj, option=_OPTIONS)
+        except TypeError:
+            # ints beyond 64 bits and other values orjson refuses
+            return _std_dumps(obj).encode("utf-8")
+
+    def dumps(obj):
+        return dumpb(obj).decode("utf-8")
+
+    def loads(data):
+        """Decode str or bytes."""
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # NaN / Infinity from the old stdlib encoder; json raises for real garbage
+            return json.loads(data)
+else:
+    def dumpb(obj):
+        """obj as UTF-8 JSON bytes."""
+        return _std_dumps(obj).encode("utf-8")
+
+    dumps = _std_dumps
+
+    def loads(data):
+        """Decode str or bytes."""
+        return json.loads(data)
+
+
+def read(path):
+    with open(path, "rb") as f:
+        return loads(f.read())
+
+
+def is_pretty(path):
+    """True for a file written with indentation, i.e. by an older version."""
+    with open(path, "rb") as f:
+        head = f.read(2)
+    return head in (b"{\n", b"[\n")
+
+
+def iter_array(f):
+    """Yield the elements of the JSON array in text file `f`, one at a time."""
+    decode = json.JSONDecoder().raw_decode
+    buf = f.read(CHUNK_SIZE).lstrip()
+    if not buf.startswith("["):
+        raise ValueError("not a JSON array")
+    pos, eof = 1, False
+    while True:
+        while True:
+            while pos < len(buf) and buf[pos] in " \t\r\n,":
+                pos += 1
+            if pos < len(buf) or eof:
+                break
+            chunk = f.read(CHUNK_SIZE)
+            buf, pos, eof = buf[pos:] + chunk, 0, not chunk
+        if pos >= len(buf):
+            raise ValueError("unterminated JSON array")
+        if buf[pos] == "]":
+            return
+        while True:
+            try:
+                value, end = decode(buf, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                end = None
+            # an element cut by the chunk boundary needs more text; so does one not
+            # followed by a delimiter yet: "0." decodes as 0 when ".5" is still unread
+            if end is not None and (eof or (end < len(buf) and buf[end] in " \t\r\n,]")):
+                break
+            chunk = f.read(CHUNK_SIZE)
+            buf, pos, eof = buf[pos:] + chunk, 0, not chunk
+        yield value
+        pos = end
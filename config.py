@@ -0,0 +1,119 @@
+"""Settings, user-state names and logging shared by every module."""
+import io
+import logging
+import os
+import sys
+from logging.handlers import RotatingFileHandler
+
+# ================= LOGGING (Enhancement 4: Rotation) =================
+log = logging.getLogger("vkbot")
+log.setLevel(logging.INFO)
+
+def setup_logging(path="bot.log"):
+    """Attach the rotating file and stdout handlers; main() calls this once."""
+    if log.handlers:
+        return
+    formatter = logging.Formatter("%(asctime)s [%(levelname)s] %(message)s")
+    handler = RotatingFileHandler(path, maxBytes=5*1024*1024, backupCount=3, encoding="utf-8")
+    handler.setFormatter(formatter)
+    log.addHandler(handler)
+    stream_handler = logging.StreamHandler(
+        stream=io.TextIOWrapper(
+            sys.stdout.buffer,
+            encoding='utf-8',
+            line_buffering=True
+        ) if hasattr(sys.stdout, 'buffer') else sys.stdout
+    )
+    stream_handler.setFormatter(formatter)
+    log.addHandler(stream_handler)
+
+REMINDER_FILE = "sent_reminders.json"
+
+# ================= CONFIG =================
+TOKEN_FILE = "token.txt"
+BOT_TRANSPORT = os.environ.get("BOT_TRANSPORT", "vk")   # "fake" → fakevk.py, for offline load tests
+STATE_FILE = "states.json"
+PLANNER_DIR = "planners"
+DAYS_PER_BATCH = 4
+RECENT_ENTRIES_PER_PAGE = 7      # ← NEW  ← you can change to 8/12/15 etc
+LARGE_EXPENSE_LIMIT = 2999      # default "large" cutoff until a user picks one via /largesumsrevisit
+KNOWN_TOOLS = ["gp", "hal", "sb", "ren", "oz", "ya", "cert", "cash", "other"]
+SNAPSHOT_DIR = "snapshots"
+MAX_SNAPSHOTS_PER_USER = 30   # snapshots share unchanged blobs, so deep retention is cheap
+PROFILE_DIR = "profiles"
+PROFILE_SECONDS = 30          # default /profile and SIGUSR1 run length
+FSYNC_WRITES = os.environ.get("BOT_FSYNC", "1") != "0"   # "0" skips fsync on data files (tests, tmpfs)
+ADMIN_IDS = {int(x) for x in os.environ.get("BOT_ADMIN_IDS", "").split(",") if x.strip()}   # may use /status
+
+# ================= STATES =================
+STATE_START = "start"
+STATE_SUGGEST_YEAR = "suggest_year"
+STATE_SUGGEST_MONTH = "suggest_month"
+STATE_SUGGEST_DAY = "suggest_day"
+STATE_SUGGEST_HOUR = "suggest_hour"
+STATE_SUGGEST_MINUTE = "suggest_minute"
+STATE_SUGGEST_DESC = "suggest_desc"
+STATE_SUGGEST_HASHTAG = "suggest_hashtag"
+STATE_SUGGEST_RECURRENCE = "suggest_recurrence"
+STATE_SUGGEST_COUNT = "suggest_count"
+STATE_SUGGEST_DURATION = "suggest_duration"
+STATE_SUGGEST_PLACE = "suggest_place"
+STATE_LIST_MENU = "list_menu"
+STATE_LIST_VIEW = "list_view"
+STATE_FILTER = "filter"
+STATE_DELETE_HASHTAG = "delete_hashtag"
+STATE_DELETE_UID = "delete_uid"
+STATE_EDIT_SELECT = "edit_select"
+STATE_EDIT_INPUT = "edit_input"
+STATE_COMPLETE = "complete"
+STATE_EDIT_DONE_SELECT = "edit_done_select"
+STATE_EDIT_DONE_INPUT = "edit_done_input"
+STATE_DELETE_DONE = "delete_done"
+STATE_DELETE_ARRAY = "delete_array"
+STATE_QUICK_ADD = "quick_add"
+STATE_DELETE_PHOTOS = "delete_photos"
+STATE_DATE_QUERY = "date_query"
+STATE_NUMBER_QUERY = "number_query"
+STATE_EXTEND_SELECT = "extend_select"
+STATE_EXTEND_PERIOD = "extend_period"
+STATE_DELETE_MENU = "delete_menu"
+STATE_LIST_MAIN_MENU = "list_main_menu"
+STATE_EDIT_MENU = "edit_menu"
+STATE_QUICK_COMMANDS = "quick_commands"
+STATE_REMIND_SELECT = "remind_select"
+STATE_REMIND_COUNT = "remind_count"
+STATE_REMIND_MINUTES = "remind_minutes"
+STATE_REMIND_INDEX = "remind_index"
+STATE_BUDGET_MENU    = "budget_menu"
+STATE_EXP_MENU       = "exp_menu"
+# New states for expense date selection
+STATE_EXP_DATE_CHOICE   = "exp_date_choice"     # "Today", "Yesterday", "Specific day"
+STATE_EXP_YEAR          = "exp_year"            # this year / prev year / specific year
+STATE_EXP_MONTH         = "exp_month"           # this month / prev month / specific month
+STATE_EXP_DAY           = "exp_day"             # text input for day 1–31
+STATE_EXP_AMOUNT     = "exp_amount"
+STATE_EXP_CATEGORY   = "exp_category"
+STATE_EXP_DESC       = "exp_desc"
+STATE_EXP_LIST       = "exp_list"
+STATE_EXP_DELETE     = "exp_delete"
+STATE_EXP_STATS      = "exp_stats"
+STATE_EXP_MONTH_PICK = "exp_month_pick"
+STATE_EXP_TOOL = "exp_tool"
+# Income states (parallel to expenses)
+STATE_NEWTOOLSBREAKDOWN = "newtoolsbreakdown"
+STATE_INC_MENU        = "inc_menu"
+STATE_INC_DATE_CHOICE = "inc_date_choice"
+STATE_INC_YEAR        = "inc_year"
+STATE_INC_MONTH       = "inc_month"
+STATE_INC_DAY         = "inc_day"
+STATE_INC_AMOUNT      = "inc_amount"
+STATE_INC_DESC        = "inc_desc"
+STATE_INC_MONTH_PICK  = "inc_month_pick"
+STATE_INC_DELETE      = "inc_delete"
+STATE_LSR_THRESHOLD = "lsr_threshold"
+STATE_IMPORT_WAIT = "import_wait"
+
+# ================= TOKEN =================
+def read_token():
+    with open(TOKEN_FILE, "r", encoding="utf-8") as f:
+        return f.read().strip()
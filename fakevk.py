@@ -0,0 +1,184 @@
+"""
+Local stand-in for the VK API, used with BOT_TRANSPORT=fake.
+
+It replays scripted MESSAGE_NEW events into the bot's long-poll loop and
+records every messages.send call. Latency and flood-control errors can be
+injected, so throughput, per-message latency and reminder fan-out can be
+measured offline.
+
+Environment:
+    FAKEVK_SCRIPT      JSONL file, one event per line:
+                       {"uid": 1, "text": "Budget", "delay": 0.0, "attachments": null}
+                       (delay = seconds to wait before delivering the event)
+    FAKEVK_LATENCY     seconds every messages.send takes (default 0)
+    FAKEVK_JITTER      extra random latency, 0..JITTER seconds (default 0)
+    FAKEVK_FLOOD_EVERY raise a flood-control error (code 9) on every Nth send (default 0 = never)
+    FAKEVK_LINGER      seconds to keep the loop alive after the script ends,
+                       so background workers can be observed (default 0)
+    FAKEVK_REPORT      write a JSON report here when the script ends
+"""
+import json
+import os
+import random
+import threading
+import time
+
+from vk_api.exceptions import ApiError
+from vk_api.longpoll import VkEventType
+
+FLOOD_CONTROL = 9
+
+
+class FakeEvent:
+    """Just the attributes the bot reads from a vk_api long-poll event."""
+
+    def __init__(self, uid, text, message_id, attachments=None):
+        self.type = VkEventType.MESSAGE_NEW
+        self.to_me = True
+        self.user_id = uid
+        self.peer_id = uid
+        self.text = text
+        self.message_id = message_id
+        self.attachments = attachments or {}
+
+
+class _Messages:
+    def __init__(self, server):
+        self._server = server
+
+    def send(self, **kw):
+        return self._server.record_send(kw)
+
+    def getById(self, message_ids=None, **kw):
+        msg = self._server.messages.get(message_ids, {})
+        return {"count": 1 if msg else 0, "items": [msg] if msg else [{}]}
+
+
+class _Api:
+    def __init__(self, server):
+        self.messages = _Messages(server)
+
+
+class FakeVkServer:
+    """Holds the script and everything the bot sent back."""
+
+    def __init__(self, script=(), latency=0.0, jitter=0.0, flood_every=0, linger=0.0, report_path=None):
+        self.script = list(script)
+        self.latency = latency
+        self.jitter = jitter
+        self.flood_every = flood_every
+        self.linger = linger
+        self.report_path = report_path
+        self.sent = []              # (monotonic time, thread name, kwargs)
+        self.messages = {}          # message_id -> {"text", "attachments"} for getById
+        self.uploads = []           # (peer_id, title, size) of every uploaded document
+        self.handle_times = []      # seconds the bot spent on each delivered event
+        self.flood_errors = 0
+        self._calls = 0
+        self._lock = threading.Lock()
+        self.started = None
+        self.finished = None
+
+    @classmethod
+    def from_env(cls):
+        script = []
+        path = os.environ.get("FAKEVK_SCRIPT")
+        if path:
+            with open(path, "r", encoding="utf-8") as f:
+                script = [json.loads(line) for line in f if line.strip()]
+        return cls(
+            script=script,
+            latency=float(os.environ.get("FAKEVK_LATENCY", 0)),
+            jitter=float(os.environ.get("FAKEVK_JITTER", 0)),
+            flood_every=int(os.environ.get("FAKEVK_FLOOD_EVERY", 0)),
+            linger=float(os.environ.get("FAKEVK_LINGER", 0)),
+            report_path=os.environ.get("FAKEVK_REPORT"),
+        )
+
+    # ----- VK side -----
+    def record_send(self, kw):
+        with self._lock:
+            self._calls += 1
+            flood = self.flood_every and self._calls % self.flood_every == 0
+            if flood:
+                self.flood_errors += 1
+        if flood:
+            raise ApiError(None, "messages.send", kw, {},
+                           {"error_code": FLOOD_CONTROL, "error_msg": "Flood control"})
+        delay = self.latency + (random.uniform(0, self.jitter) if self.jitter else 0)
+        if delay:
+            time.sleep(delay)
+        with self._lock:
+            self.sent.append((time.monotonic(), threading.current_thread().name, dict(kw)))
+        return self._calls
+
+    def record_upload(self, path, peer_id, title):
+        with self._lock:
+            self.uploads.append((peer_id, title, os.path.getsize(path)))
+            return {"owner_id": -1, "id": len(self.uploads)}
+
+    def listen(self):
+        """Yield scripted events; the time until the next pull is the bot's handling time."""
+        self.started = time.monotonic()
+        for n, item in enumerate(self.script, 1):
+            if item.get("delay"):
+                time.sleep(item["delay"])
+            self.messages[n] = {"text": item.get("text", ""), "attachments": item.get("attachments") or []}
+            t0 = time.monotonic()
+            yield FakeEvent(int(item["uid"]), item.get("text", ""), n, item.get("attachments"))
+            self.handle_times.append(time.monotonic() - t0)
+        self.finished = time.monotonic()
+        if self.linger:
+            time.sleep(self.linger)
+        if self.report_path:
+            with open(self.report_path, "w", encoding="utf-8") as f:
+                json.dump(self.report(), f, indent=2)
+
+    # ----- results -----
+    def report(self):
+        times = sorted(self.handle_times)
+        elapsed = (self.finished or time.monotonic()) - (self.started or time.monotonic())
+
+        def pct(p):
+            return round(times[min(len(times) - 1, int(p * len(times)))] * 1000, 3) if times else None
+
+        per_uid, per_thread = {}, {}
+        for _, thread, kw in self.sent:
+            uid = str(kw.get("user_id"))
+            per_uid[uid] = per_uid.get(uid, 0) + 1
+            per_thread[thread] = per_thread.get(thread, 0) + 1
+        return {
+            "events": len(times),
+            "elapsed_s": round(elapsed, 3),
+            "events_per_s": round(len(times) / elapsed, 1) if elapsed > 0 else None,
+            "handle_ms": {"p50": pct(0.5), "p95": pct(0.95), "p99": pct(0.99), "max": pct(1.0)},
+            "sends": len(self.sent),
+            "flood_errors": self.flood_errors,
+            "uploads": len(self.uploads),
+            "sends_per_uid": per_uid,
+            "sends_per_thread": per_thread,
+        }
+
+
+class FakeVkSession:
+    """Drop-in for vk_api.VkApi as far as the bot is concerned."""
+
+    def __init__(self, server=None):
+        self.server = server or FakeVkServer.from_env()
+
+    def get_api(self):
+        return _Api(self.server)
+
+    def upload_document(self, path, peer_id, title=None):
+        """Stands in for VkUpload.document_message; returns the doc dict."""
+        return self.server.record_upload(path, peer_id, title)
+
+
+class FakeLongPoll:
+    """Drop-in for VkLongPoll."""
+
+    def __init__(self, session, **kw):
+        self.server = session.server
+
+    def listen(self):
+        return self.server.listen()
@@ -0,0 +1,2124 @@
+"""The per-user state machine: one call to handle_message() per long-poll event."""
+import calendar
+import os
+import re
+import threading
+import zlib
+from datetime import datetime, timedelta
+
+from vk_api.keyboard import VkKeyboard, VkKeyboardColor
+from vk_api.longpoll import VkEventType
+
+import metrics
+import profiler
+from config import (
+    ADMIN_IDS, DAYS_PER_BATCH, log, MAX_SNAPSHOTS_PER_USER, PROFILE_DIR, PROFILE_SECONDS,
+    RECENT_ENTRIES_PER_PAGE, STATE_BUDGET_MENU, STATE_COMPLETE, STATE_DATE_QUERY, STATE_DELETE_ARRAY,
+    STATE_DELETE_DONE, STATE_DELETE_HASHTAG, STATE_DELETE_MENU, STATE_DELETE_PHOTOS, STATE_DELETE_UID,
+    STATE_EDIT_DONE_INPUT, STATE_EDIT_DONE_SELECT, STATE_EDIT_INPUT, STATE_EDIT_MENU, STATE_EDIT_SELECT,
+    STATE_EXP_AMOUNT, STATE_EXP_CATEGORY, STATE_EXP_DATE_CHOICE, STATE_EXP_DAY, STATE_EXP_DELETE,
+    STATE_EXP_DESC, STATE_EXP_MENU, STATE_EXP_MONTH, STATE_EXP_MONTH_PICK, STATE_EXP_TOOL,
+    STATE_EXP_YEAR, STATE_EXTEND_PERIOD, STATE_EXTEND_SELECT, STATE_FILTER, STATE_IMPORT_WAIT,
+    STATE_INC_AMOUNT, STATE_INC_DATE_CHOICE, STATE_INC_DAY, STATE_INC_DELETE, STATE_INC_DESC,
+    STATE_INC_MENU, STATE_INC_MONTH, STATE_INC_MONTH_PICK, STATE_INC_YEAR, STATE_LIST_MAIN_MENU,
+    STATE_LIST_MENU, STATE_LIST_VIEW, STATE_LSR_THRESHOLD, STATE_NUMBER_QUERY, STATE_QUICK_ADD,
+    STATE_QUICK_COMMANDS, STATE_REMIND_COUNT, STATE_REMIND_MINUTES, STATE_REMIND_SELECT, STATE_START,
+    STATE_SUGGEST_COUNT, STATE_SUGGEST_DAY, STATE_SUGGEST_DESC, STATE_SUGGEST_DURATION,
+    STATE_SUGGEST_HASHTAG, STATE_SUGGEST_HOUR, STATE_SUGGEST_MINUTE, STATE_SUGGEST_MONTH,
+    STATE_SUGGEST_PLACE, STATE_SUGGEST_RECURRENCE, STATE_SUGGEST_YEAR,
+)
+from storage import (
+    clear_data, file_lock, get_data, next_uid, reminder_lock, set_data, set_state, user, _file_version,
+    _read_json_list, _read_lines, _write_lines,
+)
+from health import format_status
+from transport import send
+from keyboards import (
+    budget_menu_kb, day_kb, delete_menu_kb, duration_kb, edit_menu_kb, exp_category_kb,
+    exp_date_choice_kb, exp_desc_kb, exp_menu_kb, exp_month_choice_kb, exp_month_kb, exp_tool_kb,
+    exp_year_choice_kb, extend_kb, hashtag_kb, hour_kb, inc_menu_kb, list_menu_main_kb, main_menu_kb,
+    minute_kb, month_kb, nav_kb, place_kb, quick_commands_kb, recurrence_kb, remind_minutes_kb, year_kb,
+)
+from planner import (
+    append_done, append_event, day_groups, days_per_month_message, done_file, events_for_date,
+    format_day_group, get_line_by_key, line_has_uid, line_key, parse_event_line, planner, read_done,
+    read_events, rearrange, remove_lines_by_keys, replace_line_by_key, safe_add_months, safe_add_years,
+    save_photos, send_photos, send_today_with_weekday, two_month_calendar_message, write_events,
+)
+from ledger import (
+    CAT_LABEL_MAP, delete_expenses_by_ids, delete_income_by_ids, EXPORT_FORMATS,
+    format_all_inc_month_totals, format_all_month_totals, format_cashflow_report, format_entry,
+    format_inc_entry, format_inc_month_stats, format_large_expenses_for_month,
+    format_month_stats, format_notmy_for_month, format_tool_breakdown_for_month,
+    format_tool_breakdown_from_date, import_doc, inc_file, large_expenses, ledger_index,
+    parse_quick_entry, read_inc_totals, read_newtoolsbreakdown_start, read_totals, save_expense_with_transfer,
+    save_income, save_quick_entry, set_large_threshold, write_newtoolsbreakdown_start,
+    _cat_emoji, _export_in_background, _import_in_background,
+)
+from snapshots import (
+    create_snapshot, format_snapshot_diff, list_snapshots, prune_snapshots, _restore_in_background,
+)
+from reminders import ensure_sent_reminders, save_sent_reminders, sent_reminders
+
+def _entry_formatter(query):
+    return format_inc_entry if query.startswith("inc_") else format_entry
+
+
+def send_paginated_recent(uid, menu_kb_func, empty_msg: str = "No records."):
+    cur = get_data(uid, "cursor") or {}
+    rows, _ = _cursor_rows(uid, cur)
+
+    if not rows:
+        send(uid, empty_msg, menu_kb_func())
+        clear_data(uid)
+        # ── FIX: restore state so the menu works ──
+        if menu_kb_func == exp_menu_kb:
+            set_state(uid, STATE_EXP_MENU)
+        else:
+            set_state(uid, STATE_INC_MENU)
+        return
+
+    offset = cur.get("offset", 0)
+
+    if offset >= len(rows):
+        if menu_kb_func == exp_menu_kb:
+            prefix = "Expense history"
+            final_kb = exp_menu_kb()
+            set_state(uid, STATE_EXP_MENU)   # ── FIX
+        else:
+            prefix = "Income history"
+            final_kb = inc_menu_kb()
+            set_state(uid, STATE_INC_MENU)   # ── FIX
+
+        send(uid, f"—— End of {prefix} ——", final_kb)
+        clear_data(uid)
+        return
+
+    fmt = _entry_formatter(cur["q"])
+    chunk = rows[offset:offset + RECENT_ENTRIES_PER_PAGE]
+    text = "\n".join(f"{offset + i + 1}. {fmt(e, None)}" for i, e in enumerate(chunk))
+    if offset == 0:
+        text = "📋 Recent (newest first):\n\n" + text
+
+    has_next = offset + RECENT_ENTRIES_PER_PAGE < len(rows)
+    kb = VkKeyboard(one_time=True)
+    if has_next:
+        kb.add_button("Next →", VkKeyboardColor.PRIMARY)
+    kb.add_button("Back to menu", VkKeyboardColor.SECONDARY)
+
+    send(uid, text, kb.get_keyboard())
+    cur["offset"] = offset + RECENT_ENTRIES_PER_PAGE
+    set_data(uid, "cursor", cur)
+
+def _send_delete_page(uid, kind="expense"):
+    cur = get_data(uid, "cursor") or {}
+    rows, changed = _cursor_rows(uid, cur)
+    offset = cur.get("offset", 0)
+
+    # ── FIX: guard against out-of-bounds
+    if offset >= len(rows):
+        kb = VkKeyboard(one_time=True)
+        kb.add_button("Back to menu", VkKeyboardColor.SECONDARY)
+        send(uid, f"—— End of {kind} list ——", kb.get_keyboard())
+        return
+
+    fmt = _entry_formatter(cur["q"])
+    chunk = rows[offset:offset + RECENT_ENTRIES_PER_PAGE]
+    text = "\n".join(fmt(e, offset + i) for i, e in enumerate(chunk))
+    if offset == 0:
+        text = f"🗑 Recent {kind}s (newest first):\n\n" + text
+        if changed:
+            text = "ℹ️ The list changed since it was shown, starting over.\n\n" + text
+    text += "\n\nSend number(s) to delete (e.g. 1 or 1 3 5):"
+    has_next = offset + RECENT_ENTRIES_PER_PAGE < len(rows)
+    kb = VkKeyboard(one_time=True)
+    if has_next:
+        kb.add_button("Next →", VkKeyboardColor.PRIMARY)
+    kb.add_button("Back to menu", VkKeyboardColor.SECONDARY)
+    send(uid, text, kb.get_keyboard())
+    _remember_ids(cur, ((offset + i + 1, e["id"]) for i, e in enumerate(chunk)))
+    cur["offset"] = offset + RECENT_ENTRIES_PER_PAGE
+    set_data(uid, "cursor", cur)
+
+
+# ================= PROFILING =================
+def _profile_done(uid):
+    def done(path, prof):
+        log.info(f"Profile written to {path}\n{prof.summary()}")
+        if uid is not None:
+            try:
+                send(uid, f"🔬 Profile saved to {path}\n{prof.summary()}")
+            except Exception as e:
+                log.error(f"Profile report send failed for {uid}: {e}")
+    return done
+
+def start_profile(seconds=PROFILE_SECONDS, uid=None):
+    """Sample every thread for `seconds`; reports to `uid` (and the log) when done."""
+    path = profiler.start(seconds, PROFILE_DIR, on_done=_profile_done(uid))
+    if path:
+        log.info(f"Profiling all threads for {seconds}s → {path}")
+    return path
+
+# ================= PAGINATION =================
+# A paginated view keeps only a cursor in user data:
+#   {"q": query, "arg": query argument, "offset": rows already shown,
+#    "ver": version of the source file(s), "pick": True for selection lists}
+# Each page is rendered on demand from cached indexes, so state size does
+# not grow with history length.
+_list_cache = {}         # path -> (version, parsed JSON list)
+_day_groups_cache = {}   # (path, tag) -> (version, day groups)
+
+def _cached_json_list(path):
+    version = _file_version(path)
+    hit = _list_cache.get(path)
+    if hit is None or hit[0] != version:
+        hit = (version, _read_json_list(path))
+        _list_cache[path] = hit
+    return hit
+
+def _cached_day_groups(path, tag=None):
+    version = _file_version(path)
+    hit = _day_groups_cache.get((path, tag))
+    if hit is None or hit[0] != version:
+        lines = _read_lines(path)
+        if tag:
+            lines = [l for l in lines if tag in l.lower()]
+        hit = (version, day_groups(lines))
+        _day_groups_cache[(path, tag)] = hit
+    return hit
+
+def _cursor_source(uid, q, arg=None):
+    """Return (version, rows) for a pagination query."""
+    uid = str(uid)
+    if q in ("exp_recent", "exp_delete"):
+        index = ledger_index(uid)
+        if q == "exp_recent" and arg:
+            rows = index.month(arg)
+        else:
+            rows = index.live       # recent expenses list the live ledger only, as before archiving
+        return f"{zlib.crc32(repr(index.signature).encode('utf-8')):x}", rows[::-1]
+    if q in ("inc_recent", "inc_delete"):
+        version, rows = _cached_json_list(inc_file(uid))
+        if arg:
+            rows = [e for e in rows if e["dt"][:7] == arg]
+        return version, rows[::-1]
+    if q == "done":
+        return _cached_day_groups(done_file(uid))
+    if q == "filter":
+        return _cached_day_groups(planner(uid), arg)
+    return _cached_day_groups(planner(uid))
+
+def open_cursor(uid, q, arg=None, pick=False):
+    version, _ = _cursor_source(uid, q, arg)
+    cur = {"q": q, "arg": arg, "offset": 0, "ver": version}
+    if pick:
+        cur["pick"] = True
+    set_data(uid, "cursor", cur)
+
+def _cursor_rows(uid, cur):
+    """
+    Return (rows, changed) for a cursor. When the source changed since the
+    cursor was opened, selection cursors restart from the top so numbers
+    the user sees always match the current rows.
+    """
+    version, rows = _cursor_source(uid, cur.get("q"), cur.get("arg"))
+    changed = cur.get("ver") != version
+    if changed:
+        cur["ver"] = version
+        if cur.get("pick"):
+            cur["offset"] = 0
+            cur["ids"] = {}
+    return rows, changed
+
+def _remember_ids(cur, pairs):
+    """Bind display numbers shown on a page to stable entry ids / line keys."""
+    if cur.get("pick"):
+        ids = cur.setdefault("ids", {})
+        for number, stable_id in pairs:
+            ids[str(number)] = stable_id
+
+def picked_ids(uid, text):
+    """Map the numbers a user typed to the stable ids they saw; unknown numbers map to None."""
+    ids = (get_data(uid, "cursor") or {}).get("ids", {})
+    return {int(x): ids.get(x) for x in text.split() if x.isdigit()}
+
+def send_batch(uid):
+    cur = get_data(uid, "cursor") or {}
+    groups, _ = _cursor_rows(uid, cur)
+    offset = cur.get("offset", 0)
+    batch = groups[offset:offset + DAYS_PER_BATCH]
+    if not batch:
+        send(uid, "— End —", main_menu_kb())
+        clear_data(uid)
+        set_state(uid, STATE_START)
+        return
+    today = datetime.now().date()
+    send(uid, f"📅 Today: {today.isoformat()}")
+    for day, items in batch:
+        send(uid, format_day_group(day, items, today))
+        _remember_ids(cur, ((i + 1, line_key(l)) for i, l in items))
+    cur["offset"] = offset + DAYS_PER_BATCH
+    set_data(uid, "cursor", cur)
+    kb = nav_kb(cur["offset"] < len(groups))
+    send(uid, "Navigation:", kb)
+
+
+
+# ================= MESSAGE HANDLER =================
+METRIC_COMMANDS = {
+    "/", "/reset", "/date", "/number", "/pics", "/rearrange", "/today", "/tomorrow", "/extend",
+    "/largesumsrevisit", "/remind", "/snapshot", "/restore", "/snapdiff", "/ntb", "/mntb",
+    "/cashflow", "/export", "/import", "/status", "/profile",
+}
+
+def metrics_label(state, text):
+    """Known slash commands are counted on their own; everything else under the user's state."""
+    word = text.split(maxsplit=1)[0].lower() if text else ""
+    return word if word in METRIC_COMMANDS else state
+
+def handle_message(ev):
+    """Handle one long-poll event: the whole per-user state machine."""
+    if ev.type != VkEventType.MESSAGE_NEW or not ev.to_me:
+        return
+    uid = ev.user_id
+    text = ev.text.strip()
+    state = user(uid)["state"]
+    log.info(f"{uid} | {state} | {text}")
+    with metrics.track(metrics_label(state, text)):
+        dispatch_message(ev, uid, text, state)
+
+def dispatch_message(ev, uid, text, state):
+
+    # ===== PHOTO HANDLING =====
+    if getattr(ev, "attachments", None) and state != STATE_IMPORT_WAIT:
+        save_photos(uid, ev.message_id, ev.peer_id)
+
+    # ===== GLOBAL COMMANDS =====
+    if text.strip() == "/":
+        commands = [
+            ("/reset", "Reset bot state"),
+            ("/date", "Query events by date"),
+            ("/number", "Search events by text"),
+            ("/pics", "Show saved photos"),
+            ("/rearrange", "Rearrange your planner events"),
+            ("/today", "Show today's events"),
+            ("/tomorrow", "Show next day's events"),
+            ("/extend", "Extend existing event"),
+            ("/largesumsrevisit", "Set large expense threshold"),
+            ("/remind", "Set custom reminders"),
+            ("/snapshot", "Save a manual snapshot"),
+            ("/restore", "List snapshots or restore one (/restore <snapshot>)"),
+            ("/snapdiff", "Compare a snapshot with now or another snapshot"),
+            ("/ntb", "Reset secondary tool breakdown counter from now"),
+            ("/cashflow", "Income vs expense by month"),
+            ("-450 food coffee gp yesterday", "Quick expense from a menu (+12000 salary for income)"),
+            ("/export", "Export ledgers and planner (/export csv, jsonl or ics)"),
+            ("/import", "Import expenses from a CSV / bank export (/import signed for debit-negative statements)"),
+            ("/mntb", "Manually set secondary tool breakdown start time"),
+        ]
+        send(uid, "📖 Available commands:")
+        for cmd, desc in commands:
+            send(uid, cmd)
+            send(uid, desc)
+        return
+
+    if text.lower().split()[:1] == ["/export"]:
+        parts = text.lower().split()
+        fmt = parts[1] if len(parts) > 1 else "csv"
+        if fmt not in EXPORT_FORMATS:
+            send(uid, f"Formats: {', '.join(EXPORT_FORMATS)}")
+            return
+        send(uid, "📤 Exporting…")
+        # building and uploading a long history takes a while; keep the long-poll loop free
+        threading.Thread(target=_export_in_background, args=(str(uid), fmt), daemon=True).start()
+        return
+
+    if text.lower() in ("/import", "/import signed"):
+        clear_data(uid)
+        set_data(uid, "import_signed", text.lower().endswith("signed"))
+        set_state(uid, STATE_IMPORT_WAIT)
+        kb = VkKeyboard(one_time=True)
+        kb.add_button("Back to menu", VkKeyboardColor.SECONDARY)
+        send(uid, "📥 Send the CSV file as a document (columns: date, amount, description; "
+                  "category and tool are optional).", kb.get_keyboard())
+        return
+
+    if text.lower() == "/reset":
+        clear_data(uid)
+        set_state(uid, STATE_START)
+        send(uid, "Reset.", main_menu_kb())
+        return
+
+
+
+    if text.lower() == "/snapshot":
+        ts, snap_dir, count = create_snapshot(str(uid))
+        prune_snapshots(str(uid))
+        snaps = list_snapshots(str(uid))
+        send(uid,
+            f"📸 Snapshot saved: {ts}\n"
+            f"Files: {count}\n"
+            f"Snapshots kept: {len(snaps)}/{MAX_SNAPSHOTS_PER_USER}",
+            main_menu_kb()
+        )
+        return
+
+
+    if text.lower().split()[:1] == ["/restore"]:
+        parts = text.split()
+        snaps = list_snapshots(str(uid))
+        if len(parts) < 2:
+            if not snaps:
+                send(uid, "No snapshots yet.")
+            else:
+                send(uid, "📸 Snapshots (newest last):\n" + "\n".join(snaps[-10:]) +
+                     "\n\nSend /restore <snapshot> to restore, /snapdiff <snapshot> to compare with now.")
+            return
+        if parts[1] not in snaps:
+            send(uid, f"No snapshot {parts[1]}.")
+            return
+        clear_data(uid)
+        set_state(uid, STATE_START)
+        send(uid, f"♻️ Restoring {parts[1]}…")
+        threading.Thread(target=_restore_in_background, args=(str(uid), parts[1]), daemon=True).start()
+        return
+
+    if text.lower().split()[:1] == ["/snapdiff"]:
+        parts = text.split()
+        snaps = list_snapshots(str(uid))
+        if not snaps:
+            send(uid, "No snapshots yet.")
+            return
+        old_ts = parts[1] if len(parts) > 1 else snaps[-1]
+        new_ts = parts[2] if len(parts) > 2 else None
+        if old_ts not in snaps or (new_ts is not None and new_ts not in snaps):
+            send(uid, "Unknown snapshot. Send /restore to list them.")
+            return
+        send(uid, format_snapshot_diff(str(uid), old_ts, new_ts))
+        return
+
+    if text.lower() == "/cashflow":
+        send(uid, format_cashflow_report(uid))
+        return
+
+    if text.lower() == "/status":
+        if uid not in ADMIN_IDS:
+            send(uid, "⛔ /status is for bot admins.")
+            return
+        send(uid, format_status())
+        return
+
+    if text.lower().split()[:1] == ["/profile"]:
+        if uid not in ADMIN_IDS:
+            send(uid, "⛔ /profile is for bot admins.")
+            return
+        arg = text.lower().split()[1:2]
+        if arg == ["stop"]:
+            send(uid, "⏹ Stopping, the report follows." if profiler.stop() else "No profile is running.")
+            return
+        seconds = int(arg[0]) if arg and arg[0].isdigit() else PROFILE_SECONDS
+        if start_profile(seconds, uid):
+            send(uid, f"🔬 Profiling all threads for {min(seconds, profiler.MAX_DURATION)}s (/profile stop to end early).")
+        else:
+            send(uid, "A profile is already running.")
+        return
+
+
+    if text.lower() == "/ntb":
+        now_iso = datetime.now().strftime("%Y-%m-%dT%H:%M")
+        write_newtoolsbreakdown_start(str(uid), now_iso)
+        send(uid,
+            f"✅ Secondary tool breakdown reset.\n"
+            f"Counting from: {now_iso}",
+            main_menu_kb()
+        )
+        return
+
+
+    if text.lower().startswith("/mntb"):
+        parts = text.strip().split(maxsplit=1)
+        if len(parts) < 2:
+            send(uid, "Usage: /mntb YYYY-MM-DDTHH:MM")
+            send(uid, "/mntb 2026-03-14T20:00", main_menu_kb())
+            return
+        try:
+            dt_iso = parts[1].strip()
+            datetime.fromisoformat(dt_iso)  # validate
+            write_newtoolsbreakdown_start(str(uid), dt_iso)
+            send(uid,
+                f"✅ Secondary tool breakdown manually set.\n"
+                f"Counting from: {dt_iso}",
+                main_menu_kb()
+            )
+        except ValueError:
+            send(uid, "❌ Invalid format. Use YYYY-MM-DDTHH:MM")
+            send(uid, "/mntb 2026-03-14T20:00", main_menu_kb())
+        return
+
+
+
+    if text.lower() == "/date":
+        clear_data(uid)
+        set_state(uid, STATE_DATE_QUERY)
+        # ── PATCH 2: send two-month calendar with highlighted current date ──
+        send(uid, two_month_calendar_message())
+        # ────────────────────────────────────────────────────────────────────
+        send(uid, "📅 Enter date in format YYYY-MM-DD:")
+        return
+
+    if text.lower() == "/number":
+        clear_data(uid)
+        set_state(uid, STATE_NUMBER_QUERY)
+        send(uid, "Enter a text to search for in your planner:")
+        return
+
+    if text.lower() == "/extend":
+        events = read_events(uid)
+        if not events:
+            send(uid, "No events to extend.", main_menu_kb())
+        else:
+            clear_data(uid)
+            open_cursor(uid, "events", pick=True)
+            set_state(uid, STATE_EXTEND_SELECT)
+            send(uid, "Select event number to extend:")
+            send_batch(uid)
+        return
+
+    if text.lower() == "/remind":
+        events = read_events(uid)
+        if not events:
+            send(uid, "No events to set reminders for.", main_menu_kb())
+        else:
+            clear_data(uid)
+            open_cursor(uid, "events", pick=True)
+            set_state(uid, STATE_REMIND_SELECT)
+            send(uid, "Select event number to set reminder for:")
+            send_batch(uid)
+        return
+
+
+    if text.lower() == "/largesumsrevisit":
+        clear_data(uid)
+        set_state(uid, STATE_LSR_THRESHOLD)
+        kb = VkKeyboard(one_time=True)
+        kb.add_button("3000", VkKeyboardColor.PRIMARY)
+        kb.add_button("5000", VkKeyboardColor.PRIMARY)
+        kb.add_button("10000", VkKeyboardColor.PRIMARY)
+        kb.add_line()
+        kb.add_button("15000", VkKeyboardColor.PRIMARY)
+        kb.add_button("Use default (3000)", VkKeyboardColor.SECONDARY)
+        send(uid,
+            "🔧 Large expenses threshold\n\n"
+            "Enter custom threshold (integer) or choose one of the buttons below.\n"
+            "Empty input / Enter → uses 3000.",
+            kb.get_keyboard()
+        )
+        return
+
+
+    if text.lower() == "/today":
+        today = datetime.now().date()
+        weekday = datetime.now().strftime("%A")
+        send(uid, f"📅 Today: {today} ({weekday})")
+        matches = events_for_date(uid, today)
+        if not matches:
+            send(uid, "No events for today.")
+        else:
+            send(uid, "Today's events:")
+            for line in matches:
+                send(uid, line)
+        clear_data(uid)
+        set_state(uid, STATE_START)
+        send(uid, "Menu:", main_menu_kb())
+        return
+
+    if text.lower() == "/tomorrow":
+        tomorrow = (datetime.now() + timedelta(days=1)).date()
+        weekday = (datetime.now() + timedelta(days=1)).strftime("%A")
+        send(uid, f"📅 Tomorrow: {tomorrow} ({weekday})")
+        matches = events_for_date(uid, tomorrow)
+        if not matches:
+            send(uid, "No events for tomorrow.")
+        else:
+            send(uid, "Tomorrow's events:")
+            for line in matches:
+                send(uid, line)
+        clear_data(uid)
+        set_state(uid, STATE_START)
+        send(uid, "Menu:", main_menu_kb())
+        return
+
+
+    if text.lower() == "/pics":
+        send_photos(uid)
+        clear_data(uid)
+        set_state(uid, STATE_START)
+        return
+
+    if text.lower() == "/rearrange":
+        rearrange(uid)
+        send(uid, "Rearranged.", main_menu_kb())
+        return
+
+    # ===== IMPORT (after the global commands, so /reset etc. still work) =====
+    if state == STATE_IMPORT_WAIT:
+        if text == "Back to menu":
+            clear_data(uid)
+            set_state(uid, STATE_START)
+            send(uid, "Menu:", main_menu_kb())
+            return
+        try:
+            doc = import_doc(ev.message_id)
+        except Exception as e:
+            log.error(f"Import failed for {uid}: {e}")
+            send(uid, f"❌ Import failed: {e}")
+            return
+        if doc is None:
+            send(uid, "Attach a .csv document, or press Back to menu.")
+            return
+        signed = get_data(uid, "import_signed", False)
+        clear_data(uid)
+        set_state(uid, STATE_START)
+        send(uid, "📥 Importing…")
+        # the download and the import can take a while; keep the long-poll loop free
+        threading.Thread(target=_import_in_background, args=(str(uid), doc, signed), daemon=True).start()
+        return
+
+    # ===== QUICK ENTRY ("-450 food coffee", "+12000 salary") =====
+    if state in (STATE_START, STATE_BUDGET_MENU, STATE_EXP_MENU, STATE_INC_MENU):
+        quick = parse_quick_entry(text)
+        if quick:
+            menu_kb = {STATE_START: main_menu_kb, STATE_BUDGET_MENU: budget_menu_kb,
+                       STATE_EXP_MENU: exp_menu_kb, STATE_INC_MENU: inc_menu_kb}[state]
+            send(uid, save_quick_entry(str(uid), quick), menu_kb())
+            return
+
+    # ===== BACK TO MENU (GLOBAL) =====
+# =====    if text == "Back to menu":
+# =====        clear_data(uid)
+# =====        set_state(uid, STATE_START)
+# =====        send(uid, "Menu:", main_menu_kb())
+# =====        continue
+
+    # ===== START MENU =====
+    if state == STATE_START:
+        if text == "Suggest":
+            clear_data(uid)
+            send_today_with_weekday(uid)
+            send(uid, two_month_calendar_message())
+            set_state(uid, STATE_SUGGEST_YEAR)
+            send(uid, "Enter year (YYYY):", year_kb())
+        elif text == "Quick note":
+            clear_data(uid)
+            set_state(uid, STATE_QUICK_ADD)
+            send(uid, "Send text to save:")
+        elif text == "Complete":
+            events = read_events(uid)
+            if not events:
+                send(uid, "No events to complete.", main_menu_kb())
+            else:
+                clear_data(uid)
+                open_cursor(uid, "events", pick=True)
+                set_state(uid, STATE_COMPLETE)
+                send_batch(uid)
+        elif text == "List":
+            set_state(uid, STATE_LIST_MAIN_MENU)
+            send(uid, "Choose list type:", list_menu_main_kb())
+        elif text == "Delete":
+            set_state(uid, STATE_DELETE_MENU)
+            send(uid, "Choose deletion type:", delete_menu_kb())
+        elif text == "Edit":
+            set_state(uid, STATE_EDIT_MENU)
+            send(uid, "Choose edit type:", edit_menu_kb())
+        elif text == "Quick Commands":
+            set_state(uid, STATE_QUICK_COMMANDS)
+            send(uid, "Choose quick command:", quick_commands_kb())
+        elif text == "Budget":
+            clear_data(uid)
+            set_state(uid, STATE_BUDGET_MENU)
+            send(uid, "💼 Budget:", budget_menu_kb())
+        else:
+            send(uid, "Menu:", main_menu_kb())
+        return
+
+
+
+    # ===== QUICK COMMANDS MENU =====
+    if state == STATE_QUICK_COMMANDS:
+        if text == "Back to menu":
+            clear_data(uid)
+            set_state(uid, STATE_START)
+            send(uid, "Menu:", main_menu_kb())
+        elif text == "/today":
+            today = datetime.now().date()
+            weekday = datetime.now().strftime("%A")
+            send(uid, f"📅 Today: {today} ({weekday})")
+            matches = events_for_date(uid, today)
+            if not matches:
+                send(uid, "No events for today.")
+            else:
+                send(uid, "Today's events:")
+                for line in matches:
+                    send(uid, line)
+            clear_data(uid)
+            set_state(uid, STATE_START)
+            send(uid, "Menu:", main_menu_kb())
+            return   # ← MISSING, must be added            
+
+        elif text == "/date":
+            clear_data(uid)
+            set_state(uid, STATE_DATE_QUERY)
+            send(uid, two_month_calendar_message())
+            send(uid, "📅 Enter date in format YYYY-MM-DD:")
+            return   # ← MISSING, must be added
+
+
+        elif text == "/largesumsrevisit":
+            clear_data(uid)
+            set_data(uid, "came_from_quick", True)
+            set_state(uid, STATE_LSR_THRESHOLD)
+            kb = VkKeyboard(one_time=True)
+            kb.add_button("3000", VkKeyboardColor.PRIMARY)
+            kb.add_button("5000", VkKeyboardColor.PRIMARY)
+            kb.add_button("10000", VkKeyboardColor.PRIMARY)
+            kb.add_line()
+            kb.add_button("15000", VkKeyboardColor.PRIMARY)
+            kb.add_button("Use default (3000)", VkKeyboardColor.SECONDARY)
+            send(uid,
+                "🔧 Large expenses threshold\n\n"
+                "Enter custom threshold (integer) or choose one of the buttons below.\n"
+                "Empty input / Enter → uses 3000.",
+                kb.get_keyboard()
+            )
+            return   # ← MISSING, must be added            
+            
+        elif text == "/ntb":
+            now_iso = datetime.now().strftime("%Y-%m-%dT%H:%M")
+            write_newtoolsbreakdown_start(str(uid), now_iso)
+            send(uid,
+                f"✅ Secondary tool breakdown reset.\n"
+                f"Counting from: {now_iso}",
+                quick_commands_kb()
+            )
+
+
+        elif text == "/tomorrow":
+            tomorrow = (datetime.now() + timedelta(days=1)).date()
+            weekday = (datetime.now() + timedelta(days=1)).strftime("%A")
+            send(uid, f"📅 Tomorrow: {tomorrow} ({weekday})")
+            matches = events_for_date(uid, tomorrow)
+            if not matches:
+                send(uid, "No events for tomorrow.")
+            else:
+                send(uid, "Tomorrow's events:")
+                for line in matches:
+                    send(uid, line)
+            clear_data(uid)
+            set_state(uid, STATE_START)
+            send(uid, "Menu:", main_menu_kb())
+            return
+
+        elif text == "/number":
+            clear_data(uid)
+            set_state(uid, STATE_NUMBER_QUERY)
+            send(uid, "Enter a text to search for in your planner:")
+            return
+
+        elif text == "/extend":
+            events = read_events(uid)
+            if not events:
+                send(uid, "No events to extend.", main_menu_kb())
+                set_state(uid, STATE_START)
+            else:
+                clear_data(uid)
+                open_cursor(uid, "events", pick=True)
+                set_state(uid, STATE_EXTEND_SELECT)
+                send(uid, "Select event number to extend:")
+                send_batch(uid)
+        else:
+            send(uid, "Choose quick command:", quick_commands_kb())
+        return
+
+
+    # ===== DELETE MENU SUBMENU =====
+    if state == STATE_DELETE_MENU:
+        if text == "Back to menu":
+            clear_data(uid)
+            set_state(uid, STATE_START)
+            send(uid, "Menu:", main_menu_kb())
+        elif text == "Del P":
+            photo_file = os.path.join("user_photos", f"{uid}photo.txt")
+            if not os.path.exists(photo_file):
+                send(uid, "No saved photo entries.", main_menu_kb())
+                set_state(uid, STATE_START)
+            else:
+                with open(photo_file, "r", encoding="utf-8") as f:
+                    entries = [l.rstrip() for l in f if l.strip()]
+                if not entries:
+                    send(uid, "No saved photo entries.", main_menu_kb())
+                    set_state(uid, STATE_START)
+                else:
+                    clear_data(uid)
+                    set_data(uid, "photo_entries", entries)
+                    set_state(uid, STATE_DELETE_PHOTOS)
+                    send(uid, "Saved photo entries:")
+                    for i, line in enumerate(entries, start=1):
+                        desc = line.split("||", 1)[1] if "||" in line else ""
+                        send(uid, f"{i}. {desc or '[no description]'}")
+                    send(uid, "Send numbers separated by spaces (e.g. 1 3 5):")
+        elif text == "Del Hash":
+            events = read_events(uid)
+            if not events:
+                send(uid, "No events to delete.", main_menu_kb())
+                set_state(uid, STATE_START)
+            else:
+                clear_data(uid)
+                set_state(uid, STATE_DELETE_HASHTAG)
+                send(uid, "Enter hashtag to delete:")
+        elif text == "Del ID":
+            events = read_events(uid)
+            if not events:
+                send(uid, "No events to delete.", main_menu_kb())
+                set_state(uid, STATE_START)
+            else:
+                clear_data(uid)
+                set_state(uid, STATE_DELETE_UID)
+                send(uid, "Send UID to delete:")
+        elif text == "Del Ar":
+            events = read_events(uid)
+            if not events:
+                send(uid, "No events to delete.", main_menu_kb())
+                set_state(uid, STATE_START)
+            else:
+                clear_data(uid)
+                open_cursor(uid, "events", pick=True)
+                set_state(uid, STATE_DELETE_ARRAY)
+                send(uid, "Send numbers separated by spaces (e.g. 1 3 5):")
+                send_batch(uid)
+        elif text == "Del C":
+            events = read_done(uid)
+            if not events:
+                send(uid, "No completed events to delete.", main_menu_kb())
+                set_state(uid, STATE_START)
+            else:
+                clear_data(uid)
+                open_cursor(uid, "done", pick=True)
+                set_state(uid, STATE_DELETE_DONE)
+                send_batch(uid)
+        else:
+            send(uid, "Choose deletion type:", delete_menu_kb())
+        return
+
+    # ===== LIST MENU SUBMENU =====
+    if state == STATE_LIST_MAIN_MENU:
+        if text == "Back to menu":
+            clear_data(uid)
+            set_state(uid, STATE_START)
+            send(uid, "Menu:", main_menu_kb())
+        elif text == "List events":
+            events = read_events(uid)
+            if not events:
+                send(uid, "No events.", main_menu_kb())
+                set_state(uid, STATE_START)
+            else:
+                clear_data(uid)
+                open_cursor(uid, "events")
+                set_state(uid, STATE_LIST_VIEW)
+                send_batch(uid)
+        elif text == "List completed":
+            events = read_done(uid)
+            if not events:
+                send(uid, "No completed events.", main_menu_kb())
+                set_state(uid, STATE_START)
+            else:
+                clear_data(uid)
+                open_cursor(uid, "done")
+                set_state(uid, STATE_LIST_VIEW)
+                send_batch(uid)
+        elif text == "Filter by hashtag":
+            events = read_events(uid)
+            if not events:
+                send(uid, "No events to filter.", main_menu_kb())
+                set_state(uid, STATE_START)
+            else:
+                clear_data(uid)
+                set_state(uid, STATE_FILTER)
+                send(uid, "Enter hashtag to filter (e.g., event, pers, control):")
+        else:
+            send(uid, "Choose list type:", list_menu_main_kb())
+        return
+
+    # ===== EDIT MENU SUBMENU =====
+# ===== BUDGET MENU =====
+    if state == STATE_BUDGET_MENU:
+        if text == "Back to menu":
+            clear_data(uid)
+            set_state(uid, STATE_START)
+            send(uid, "Menu:", main_menu_kb())
+        elif text == "Expenses":
+            clear_data(uid)
+            set_state(uid, STATE_EXP_MENU)
+            send(uid, "💰 Expense tracker:", exp_menu_kb())
+        elif text == "Income":
+            clear_data(uid)
+            set_state(uid, STATE_INC_MENU)
+            send(uid, "💵 Income tracker:", inc_menu_kb())
+        elif text == "💹 Cashflow":
+            send(uid, format_cashflow_report(uid), budget_menu_kb())
+        else:
+            send(uid, "💼 Budget:", budget_menu_kb())
+        return
+
+
+
+    # ===== INCOME MENU =====
+    if state == STATE_INC_MENU:
+        if text == "Back to menu":
+            clear_data(uid)
+            set_state(uid, STATE_BUDGET_MENU)
+            send(uid, "💼 Budget:", budget_menu_kb())
+        elif text == "Next →":
+            send_paginated_recent(uid, inc_menu_kb)
+        elif text == "➕ Add income":
+            clear_data(uid)
+            set_state(uid, STATE_INC_DATE_CHOICE)
+            send(uid, "For which day do you want to add the income?", exp_date_choice_kb())
+
+
+        elif text == "📊 This month":
+            mk = datetime.now().strftime("%Y-%m")
+            send(uid, format_inc_month_stats(str(uid), mk))
+            # ── NEW: show notmy expenses for this month ──────────────────────
+            notmy_msg = format_notmy_for_month(str(uid), mk)
+            if notmy_msg:
+                send(uid, notmy_msg)
+            # ─────────────────────────────────────────────────────────────────
+            if not _cursor_source(uid, "inc_recent", mk)[1]:
+                send(uid, "No income recorded yet.", inc_menu_kb())
+            else:
+                clear_data(uid)
+                open_cursor(uid, "inc_recent", mk)
+                send_paginated_recent(uid, inc_menu_kb)
+
+
+
+
+        elif text == "📅 By month":
+            send(uid, format_all_inc_month_totals(str(uid)))
+            set_state(uid, STATE_INC_MONTH_PICK)
+            send(uid, "Pick a month:", exp_month_kb())
+
+
+
+        elif text == "🗑 Delete income":
+            if not _cursor_source(uid, "inc_delete")[1]:
+                send(uid, "No income to delete.", inc_menu_kb())
+            else:
+                clear_data(uid)
+                open_cursor(uid, "inc_delete", pick=True)
+                set_state(uid, STATE_INC_DELETE)
+                _send_delete_page(uid, "income")
+
+
+
+
+
+        else:
+            send(uid, "💵 Income tracker:", inc_menu_kb())
+        return
+
+
+    # ===== EXPENSE MENU =====
+    if state == STATE_EXP_MENU:
+        if text == "Back to menu":
+            clear_data(uid)
+            set_state(uid, STATE_BUDGET_MENU)
+            send(uid, "💼 Budget:", budget_menu_kb())
+        elif text == "Next →":
+            send_paginated_recent(uid, exp_menu_kb)
+        elif text == "➕ Add expense":
+            clear_data(uid)
+            set_state(uid, STATE_EXP_DATE_CHOICE)
+            send(uid, "For which day do you want to add the expense?", exp_date_choice_kb())
+
+
+        elif text == "📊 This month":
+            mk = datetime.now().strftime("%Y-%m")
+            send(uid, format_month_stats(str(uid), mk))
+
+            # ── tool breakdown ───────────────────────────────────────────────
+            tool_msg = format_tool_breakdown_for_month(str(uid), mk)
+            if tool_msg:
+                send(uid, tool_msg)
+            # ── secondary breakdown (since /newtoolsbreakdown) ───────────────
+            ntb_start = read_newtoolsbreakdown_start(str(uid))
+            if ntb_start:
+                ntb_msg = format_tool_breakdown_from_date(str(uid), ntb_start)
+                if ntb_msg:
+                    send(uid, ntb_msg)
+            # ─────────────────────────────────────────────────────────────────
+
+            large_msg = format_large_expenses_for_month(str(uid), mk)
+            if large_msg:
+                send(uid, large_msg)
+
+# ── notmy breakdown ──────────────────────────────────────────────
+            notmy_msg = format_notmy_for_month(str(uid), mk)
+            if notmy_msg:
+                send(uid, notmy_msg)
+            # ────────────────────────────────────────────────────────────────
+
+            if not _cursor_source(uid, "exp_recent", mk)[1]:
+                send(uid, "No expenses recorded yet.", exp_menu_kb())
+            else:
+                clear_data(uid)
+                open_cursor(uid, "exp_recent", mk)
+                send_paginated_recent(uid, exp_menu_kb)
+
+
+        elif text == "📅 By month":
+            send(uid, format_all_month_totals(str(uid)))
+            set_state(uid, STATE_EXP_MONTH_PICK)
+            send(uid, "Pick a month:", exp_month_kb())
+        elif text == "🗑 Delete expense":
+            if not _cursor_source(uid, "exp_delete")[1]:
+                send(uid, "No expenses to delete.", exp_menu_kb())
+            else:
+                clear_data(uid)
+                open_cursor(uid, "exp_delete", pick=True)
+                set_state(uid, STATE_EXP_DELETE)
+                _send_delete_page(uid, "expense")
+
+        else:
+            send(uid, "💰 Expense tracker:", exp_menu_kb())
+        return
+
+    # ===== EXPENSE: AMOUNT =====
+
+    # ===== EXPENSE: PAYMENT TOOL =====
+    if state == STATE_EXP_TOOL:
+        tool = text.strip()
+        valid_tools = {"gp", "hal", "sb", "ren", "oz", "ya", "cert", "cash", "other", "— skip —"}
+        
+        if tool.lower() in valid_tools or tool == "— skip —":
+            amount    = get_data(uid, "exp_amount")
+            category  = get_data(uid, "exp_category")
+            desc      = get_data(uid, "exp_desc", "")
+            exp_date_str = get_data(uid, "exp_date")
+            
+            if exp_date_str is None:
+                exp_date_str = datetime.now().strftime("%Y-%m-%d")
+                
+            selected_date = datetime.strptime(exp_date_str, "%Y-%m-%d").date()
+            now = datetime.now()
+            if selected_date == now.date():
+                dt_for_expense = now.replace(second=0, microsecond=0)
+            else:
+                dt_for_expense = datetime.combine(selected_date, datetime.min.time())
+            
+            # Save with tool (a transfer is mirrored into income)
+            save_expense_with_transfer(str(uid), amount, category, desc, dt=dt_for_expense, tool=tool)
+
+            
+            em    = _cat_emoji(category)
+            tool_str = f"  → {tool.upper()}" if tool != "— skip —" else ""
+            mk    = selected_date.strftime("%Y-%m")
+            month_tot = read_totals(str(uid)).get(mk, {}).get("total", 0)
+            note_line = f" 📝 {desc}" if desc else ""
+            inc_note = "\n📈 Auto-added to income" if category == "transfer" else ""
+            
+            send(uid,
+                f"✅ {em} {amount:,.0f}{note_line}{tool_str}\n"
+                f"📊 {mk} total: {month_tot:,.0f}{inc_note}",
+                exp_menu_kb()
+            )
+            clear_data(uid)
+            set_state(uid, STATE_EXP_MENU)
+        else:
+            send(uid, "Choose payment method or skip:", exp_tool_kb())
+        return
+
+
+# ────────────────────────────────────────────────
+#  New date selection flow
+# ────────────────────────────────────────────────
+
+
+    # ────────────────────────────────────────────────
+    # Income date selection flow
+    # ────────────────────────────────────────────────
+    if state == STATE_INC_DATE_CHOICE:
+        if text == "For today":
+            set_data(uid, "inc_date", datetime.now().strftime("%Y-%m-%d"))
+            set_state(uid, STATE_INC_AMOUNT)
+            send(uid, "💵 Enter amount:")
+        elif text == "For yesterday":
+            yesterday_str = (datetime.now().date() - timedelta(days=1)).strftime("%Y-%m-%d")
+            set_data(uid, "inc_date", yesterday_str)
+            set_state(uid, STATE_INC_AMOUNT)
+            send(uid, f"Adding income for yesterday ({yesterday_str}):")
+            send(uid, "💵 Enter amount:")
+        elif text == "For specific day":
+            set_state(uid, STATE_INC_YEAR)
+            send(uid, "Choose year:", exp_year_choice_kb())
+        elif text == "Back":
+            clear_data(uid)
+            set_state(uid, STATE_INC_MENU)
+            send(uid, "Income menu:", inc_menu_kb())
+        else:
+            send(uid, "Choose option:", exp_date_choice_kb())
+        return
+
+    if state == STATE_INC_YEAR:
+        now = datetime.now()
+        if text.startswith("This year"):
+            set_data(uid, "inc_year", now.year)
+            set_state(uid, STATE_INC_MONTH)
+            send(uid, "Choose month:", exp_month_choice_kb())
+        elif text.startswith("Previous year"):
+            set_data(uid, "inc_year", now.year - 1)
+            set_state(uid, STATE_INC_MONTH)
+            send(uid, "Choose month:", exp_month_choice_kb())
+        elif text == "Specific year":
+            set_data(uid, "inc_asking_year", True)
+            send(uid, "Enter year (YYYY):")
+        elif text == "Back":
+            set_state(uid, STATE_INC_DATE_CHOICE)
+            send(uid, "For which day?", exp_date_choice_kb())
+        elif get_data(uid, "inc_asking_year"):
+            try:
+                y = int(text)
+                if 2000 <= y <= now.year + 1:
+                    set_data(uid, "inc_year", y)
+                    del user(uid)["data"]["inc_asking_year"]
+                    set_state(uid, STATE_INC_MONTH)
+                    send(uid, "Choose month:", exp_month_choice_kb())
+                else:
+                    send(uid, f"Enter reasonable year (2000–{now.year+1}):")
+            except:
+                send(uid, "Enter 4-digit year:")
+        else:
+            send(uid, "Choose year option:", exp_year_choice_kb())
+        return
+
+    if state == STATE_INC_MONTH:
+        now = datetime.now()
+        if text.startswith("This month"):
+            set_data(uid, "inc_month", now.month)
+            set_data(uid, "inc_year", now.year)
+            set_state(uid, STATE_INC_DAY)
+            send(uid, f"Enter day (1–{calendar.monthrange(now.year, now.month)[1]}):")
+        elif text.startswith("Previous month"):
+            prev = now - timedelta(days=now.day + 5)
+            set_data(uid, "inc_year", prev.year)
+            set_data(uid, "inc_month", prev.month)
+            set_state(uid, STATE_INC_DAY)
+            send(uid, f"Enter day (1–{calendar.monthrange(prev.year, prev.month)[1]}):")
+        elif text == "Specific month":
+            set_data(uid, "inc_asking_month", True)
+            send(uid, "Enter month number (1–12):")
+        elif text == "Back":
+            set_state(uid, STATE_INC_YEAR)
+            send(uid, "Choose year:", exp_year_choice_kb())
+        elif get_data(uid, "inc_asking_month"):
+            try:
+                m = int(text)
+                if 1 <= m <= 12:
+                    y = get_data(uid, "inc_year")
+                    set_data(uid, "inc_month", m)
+                    del user(uid)["data"]["inc_asking_month"]
+                    set_state(uid, STATE_INC_DAY)
+                    send(uid, f"Enter day (1–{calendar.monthrange(y, m)[1]}):")
+                else:
+                    send(uid, "Month must be 1–12:")
+            except:
+                send(uid, "Enter month number 1–12:")
+        else:
+            send(uid, "Choose month:", exp_month_choice_kb())
+        return
+
+    if state == STATE_INC_DAY:
+        try:
+            d = int(text)
+            y = get_data(uid, "inc_year")
+            m = get_data(uid, "inc_month")
+            maxd = calendar.monthrange(y, m)[1]
+            if 1 <= d <= maxd:
+                chosen_date = datetime(y, m, d)
+                set_data(uid, "inc_date", chosen_date.strftime("%Y-%m-%d"))
+                set_state(uid, STATE_INC_AMOUNT)
+                send(uid, f"Adding income for {chosen_date.strftime('%Y-%m-%d')}:")
+                send(uid, "💵 Enter amount:")
+            else:
+                send(uid, f"Day must be between 1 and {maxd}:")
+        except:
+            send(uid, "Enter valid day number:")
+        return
+
+
+    if state == STATE_INC_AMOUNT:
+        text_clean = text.replace(",", ".").replace(" ", "")
+        try:
+            amount = float(text_clean)
+            if amount <= 0:
+                raise ValueError
+            set_data(uid, "inc_amount", amount)
+            set_state(uid, STATE_INC_DESC)
+            send(uid, f"Amount: {amount:,.0f} — Add a note? (or tap skip):", exp_desc_kb())
+        except ValueError:
+            send(uid, "❌ Enter a positive number (e.g. 15000):")
+        return
+
+    if state == STATE_INC_DESC:
+        desc = "" if text == "— skip —" else text.strip()
+        amount = get_data(uid, "inc_amount")
+        inc_date_str = get_data(uid, "inc_date")
+        if inc_date_str is None:
+            inc_date_str = datetime.now().strftime("%Y-%m-%d")
+        selected_date = datetime.strptime(inc_date_str, "%Y-%m-%d").date()
+        now = datetime.now()
+        if selected_date == now.date():
+            dt_for_income = now.replace(second=0, microsecond=0)
+        else:
+            dt_for_income = datetime.combine(selected_date, datetime.min.time())
+        save_income(str(uid), amount, desc, dt=dt_for_income)
+        mk = selected_date.strftime("%Y-%m")
+        month_tot = read_inc_totals(str(uid)).get(mk, {}).get("total", 0)
+        note_line = f" 📝 {desc}" if desc else ""
+        send(uid, f"✅ +{amount:,.0f}{note_line}\n📈 {mk} total: {month_tot:,.0f}", inc_menu_kb())
+        clear_data(uid)
+        set_state(uid, STATE_INC_MENU)
+        return
+
+
+    if state == STATE_INC_MONTH_PICK:
+        if text == "Back to menu":
+            clear_data(uid)
+            set_state(uid, STATE_START)
+            send(uid, "Menu:", main_menu_kb())
+        elif re.match(r"^\d{4}-\d{2}$", text):
+            send(uid, format_inc_month_stats(str(uid), text))
+            notmy_msg = format_notmy_for_month(str(uid), text)  # ← NEW
+            if notmy_msg:                                        # ← NEW
+                send(uid, notmy_msg)                            # ← NEW
+            set_state(uid, STATE_INC_MENU)
+            send(uid, "Income menu:", inc_menu_kb())
+        else:
+            send(uid, "Pick a month:", exp_month_kb())
+        return
+
+    if state == STATE_INC_DELETE:
+        if text == "Next →":
+            _send_delete_page(uid, "income")
+            return
+        if text == "Back to menu":          # ← ADD THIS
+            clear_data(uid)
+            set_state(uid, STATE_INC_MENU)
+            send(uid, "💵 Income tracker:", inc_menu_kb())
+            return
+        # ... rest unchanged
+        picked = picked_ids(uid, text)
+        if not picked:
+            send(uid, "Enter one or more numbers from the list (e.g. 1 or 1 3 5):")
+            return
+        invalid = sorted(n for n, entry_id in picked.items() if entry_id is None)
+        if invalid:
+            send(uid, f"Invalid number(s): {', '.join(str(n) for n in invalid)}. Try again:")
+            return
+        removed_list = delete_income_by_ids(str(uid), picked.values())[::-1]   # newest first, as listed
+        if not removed_list:
+            send(uid, "Nothing deleted.")
+        else:
+            lines = []
+            for removed in removed_list:
+                desc_part = f" {removed['desc']}" if removed.get("desc") else ""
+                lines.append(f"+{removed['amount']:,.0f}{desc_part}")
+            affected_months = {r["dt"][:7] for r in removed_list}
+            totals = read_inc_totals(str(uid))
+            totals_lines = [f"📈 {mk}: {totals.get(mk, {}).get('total', 0):,.0f}" for mk in sorted(affected_months)]
+            send(uid, f"🗑 Deleted {len(removed_list)} entr{'y' if len(removed_list)==1 else 'ies'}:\n" + "\n".join(lines))
+            send(uid, "\n".join(totals_lines))
+        clear_data(uid)
+        set_state(uid, STATE_INC_MENU)
+        send(uid, "Income menu:", inc_menu_kb())
+        return
+
+
+
+    # ────────────────────────────────────────────────
+    #  Expense date selection flow
+    # ────────────────────────────────────────────────
+
+    if state == STATE_EXP_DATE_CHOICE:
+        if text == "For today":
+            set_data(uid, "exp_date", datetime.now().strftime("%Y-%m-%d"))
+            set_state(uid, STATE_EXP_AMOUNT)
+            send(uid, "💸 Enter amount:")
+
+        elif text == "For yesterday":
+            yesterday = datetime.now().date() - timedelta(days=1)
+            set_data(uid, "exp_date", yesterday.strftime("%Y-%m-%d")) # same result
+            set_state(uid, STATE_EXP_AMOUNT)
+            send(uid, f"Adding expense for yesterday ({yesterday}):")
+            send(uid, "💸 Enter amount:")
+
+        elif text == "For specific day":
+            set_state(uid, STATE_EXP_YEAR)
+            send(uid, "Choose year:", exp_year_choice_kb())
+
+        elif text == "Back":
+            clear_data(uid)
+            set_state(uid, STATE_EXP_MENU)
+            send(uid, "Expense menu:", exp_menu_kb())
+
+        else:
+            send(uid, "Choose option:", exp_date_choice_kb())
+        return
+
+
+    if state == STATE_EXP_YEAR:
+        now = datetime.now()
+        if text.startswith("This year"):
+            set_data(uid, "exp_year", now.year)
+            set_state(uid, STATE_EXP_MONTH)
+            send(uid, "Choose month:", exp_month_choice_kb())
+
+        elif text.startswith("Previous year"):
+            set_data(uid, "exp_year", now.year - 1)
+            set_state(uid, STATE_EXP_MONTH)
+            send(uid, "Choose month:", exp_month_choice_kb())
+
+        elif text == "Specific year":
+            set_data(uid, "exp_asking_year", True)
+            send(uid, "Enter year (YYYY):")
+
+        elif text == "Back":
+            set_state(uid, STATE_EXP_DATE_CHOICE)
+            send(uid, "For which day?", exp_date_choice_kb())
+
+        elif get_data(uid, "exp_asking_year"):  # user entered year manually
+            try:
+                y = int(text)
+                if 2000 <= y <= now.year + 1:
+                    set_data(uid, "exp_year", y)
+                    del user(uid)["data"]["exp_asking_year"]
+                    set_state(uid, STATE_EXP_MONTH)
+                    send(uid, "Choose month:", exp_month_choice_kb())
+                else:
+                    send(uid, f"Enter reasonable year (2000–{now.year+1}):")
+            except:
+                send(uid, "Enter 4-digit year:")
+        else:
+            send(uid, "Choose year option:", exp_year_choice_kb())
+        return
+
+
+    if state == STATE_EXP_MONTH:
+        now = datetime.now()
+        if text.startswith("This month"):
+            set_data(uid, "exp_month", now.month)
+            set_data(uid, "exp_year", now.year)  # just in case
+            set_state(uid, STATE_EXP_DAY)
+            send(uid, f"Enter day (1–{calendar.monthrange(now.year, now.month)[1]}):")
+
+        elif text.startswith("Previous month"):
+            prev = now - timedelta(days=now.day + 5)
+            set_data(uid, "exp_year", prev.year)
+            set_data(uid, "exp_month", prev.month)
+            set_state(uid, STATE_EXP_DAY)
+            send(uid, f"Enter day (1–{calendar.monthrange(prev.year, prev.month)[1]}):")
+
+        elif text == "Specific month":
+            set_data(uid, "exp_asking_month", True)
+            send(uid, "Enter month number (1–12):")
+
+        elif text == "Back":
+            set_state(uid, STATE_EXP_YEAR)
+            send(uid, "Choose year:", exp_year_choice_kb())
+
+        elif get_data(uid, "exp_asking_month"):
+            try:
+                m = int(text)
+                if 1 <= m <= 12:
+                    y = get_data(uid, "exp_year")
+                    set_data(uid, "exp_month", m)
+                    del user(uid)["data"]["exp_asking_month"]
+                    set_state(uid, STATE_EXP_DAY)
+                    send(uid, f"Enter day (1–{calendar.monthrange(y, m)[1]}):")
+                else:
+                    send(uid, "Month must be 1–12:")
+            except:
+                send(uid, "Enter month number 1–12:")
+        else:
+            send(uid, "Choose month:", exp_month_choice_kb())
+        return
+
+
+    if state == STATE_EXP_DAY:
+        try:
+            d = int(text)
+            y = get_data(uid, "exp_year")
+            m = get_data(uid, "exp_month")
+            maxd = calendar.monthrange(y, m)[1]
+            if 1 <= d <= maxd:
+                chosen_date = datetime(y, m, d)
+                # You can also let user choose time, but for expenses usually just date is enough
+                set_data(uid, "exp_date", chosen_date.strftime("%Y-%m-%d"))   # ← string!
+                set_state(uid, STATE_EXP_AMOUNT)
+                send(uid, f"Adding expense for {chosen_date.strftime('%Y-%m-%d')}:")
+                send(uid, "💸 Enter amount:")
+            else:
+                send(uid, f"Day must be between 1 and {maxd}:")
+        except:
+            send(uid, "Enter valid day number:")
+        return
+
+
+    if state == STATE_EXP_AMOUNT:
+        text_clean = text.replace(",", ".").replace(" ", "")
+        try:
+            amount = float(text_clean)
+            if amount <= 0:
+                raise ValueError
+            set_data(uid, "exp_amount", amount)
+            set_state(uid, STATE_EXP_CATEGORY)
+            send(uid, f"Amount: {amount:,.0f} — Pick category:", exp_category_kb())
+        except ValueError:
+            send(uid, "❌ Enter a positive number (e.g. 1500):")
+        return
+
+
+    # ===== EXPENSE: CATEGORY =====
+    if state == STATE_EXP_CATEGORY:
+        cat = CAT_LABEL_MAP.get(text)
+        if cat:
+            set_data(uid, "exp_category", cat)
+            set_state(uid, STATE_EXP_DESC)
+            send(uid, "Add a note? (or tap skip):", exp_desc_kb())
+        else:
+            send(uid, "Tap a category button:", exp_category_kb())
+        return
+
+    # ===== EXPENSE: DESC =====
+    if state == STATE_EXP_DESC:
+        desc = "" if text == "— skip —" else text.strip()
+        set_data(uid, "exp_desc", desc)
+        amount = get_data(uid, "exp_amount")
+        category = get_data(uid, "exp_category")
+        send(uid,
+            f"Amount: {amount:,.0f} • {category}\n"
+            f"Note: {desc or '—'}",
+            exp_tool_kb()
+        )
+        set_state(uid, STATE_EXP_TOOL)
+        return
+
+    # ===== EXPENSE: MONTH PICK =====
+    if state == STATE_EXP_MONTH_PICK:
+        if text == "Back to menu":
+            clear_data(uid)
+            set_state(uid, STATE_START)
+            send(uid, "Menu:", main_menu_kb())
+        elif re.match(r"^\d{4}-\d{2}$", text):
+            stats_msg = format_month_stats(str(uid), text)
+            send(uid, stats_msg)
+
+            # ── tool breakdown ───────────────────────────────────────────────
+            tool_msg = format_tool_breakdown_for_month(str(uid), text)
+            if tool_msg:
+                send(uid, tool_msg)
+            # ── secondary breakdown (since /newtoolsbreakdown) ───────────────
+            ntb_start = read_newtoolsbreakdown_start(str(uid))
+            if ntb_start:
+                ntb_msg = format_tool_breakdown_from_date(str(uid), ntb_start)
+                if ntb_msg:
+                    send(uid, ntb_msg)
+            # ─────────────────────────────────────────────────────────────────
+
+            large_msg = format_large_expenses_for_month(str(uid), text)
+            if large_msg:
+                send(uid, large_msg)
+
+            # ── NEW ──
+            notmy_msg = format_notmy_for_month(str(uid), text)
+            if notmy_msg:
+                send(uid, notmy_msg)
+            # ─────────
+
+
+            set_state(uid, STATE_EXP_MENU)
+            send(uid, "Expense menu:", exp_menu_kb())
+        else:
+            send(uid, "Pick a month:", exp_month_kb())
+        return
+
+
+    # ===== EXPENSE: DELETE =====
+    if state == STATE_EXP_DELETE:
+        if text == "Next →":
+            _send_delete_page(uid, "expense")
+            return
+        if text == "Back to menu":          # ← ADD THIS
+            clear_data(uid)
+            set_state(uid, STATE_EXP_MENU)
+            send(uid, "💰 Expense tracker:", exp_menu_kb())
+            return
+        picked = picked_ids(uid, text)
+        if not picked:
+            send(uid, "Enter one or more numbers from the list (e.g. 1 or 1 3 5):")
+            return
+        invalid = sorted(n for n, entry_id in picked.items() if entry_id is None)
+        if invalid:
+            send(uid, f"Invalid number(s): {', '.join(str(n) for n in invalid)}. Try again:")
+            return
+        removed_list = delete_expenses_by_ids(str(uid), picked.values())[::-1]   # newest first, as listed
+        if not removed_list:
+            send(uid, "Nothing deleted.")
+        else:
+            lines = []
+            for removed in removed_list:
+                em = _cat_emoji(removed["category"])
+                desc_part = f"  {removed['desc']}" if removed.get("desc") else ""
+                lines.append(f"{em} {removed['amount']:,.0f}{desc_part}")
+            affected_months = {r["dt"][:7] for r in removed_list}
+            totals = read_totals(str(uid))
+            totals_lines = [f"📊 {mk}: {totals.get(mk, {}).get('total', 0):,.0f}" for mk in sorted(affected_months)]
+            send(uid, f"🗑 Deleted {len(removed_list)} entr{'y' if len(removed_list)==1 else 'ies'}:\n" + "\n".join(lines))
+            send(uid, "\n".join(totals_lines))
+        clear_data(uid)
+        set_state(uid, STATE_EXP_MENU)
+        send(uid, "Expense menu:", exp_menu_kb())
+        return
+
+
+    if state == STATE_LSR_THRESHOLD:
+        if text == "Back to menu":
+            clear_data(uid)
+            set_state(uid, STATE_START)
+            send(uid, "Menu:", main_menu_kb())
+            return
+        if text.strip() == "" or text.lower() in ["use default (3000)", "default", "skip"]:
+            threshold = 3000
+        else:
+            try:
+                # clean typical user input variations
+                cleaned = text.replace(" ", "").replace(",", "").replace("₸", "").replace("тг", "")
+                threshold = int(cleaned)
+                if threshold < 100:
+                    send(uid, "Value too low — using 3000 instead.")
+                    threshold = 3000
+                elif threshold > 1000000:
+                    send(uid, "Very high value — using 3000 instead to be safe.")
+                    threshold = 3000
+            except ValueError:
+                send(uid, "Could not parse number — using default 3000.")
+                threshold = 3000
+
+        set_large_threshold(uid, threshold)
+        count = len(large_expenses(str(uid), threshold))
+
+        msg = (
+            f"✅ Large expenses threshold updated.\n"
+            f"Threshold: > {threshold:,}\n"
+            f"Found {count} matching expense entr"
+            f"{'y' if count == 1 else 'ies'}."
+        )
+
+        # If called from quick commands menu — return there, otherwise main menu
+        if get_data(uid, "came_from_quick", False):
+            send(uid, msg, quick_commands_kb())
+        else:
+            send(uid, msg, main_menu_kb())
+
+        clear_data(uid)
+        set_state(uid, STATE_START)
+        return
+
+
+    if state == STATE_EDIT_MENU:
+        if text == "Back to menu":
+            clear_data(uid)
+            set_state(uid, STATE_START)
+            send(uid, "Menu:", main_menu_kb())
+        elif text == "Edit event":
+            events = read_events(uid)
+            if not events:
+                send(uid, "No events.", main_menu_kb())
+                set_state(uid, STATE_START)
+            else:
+                clear_data(uid)
+                open_cursor(uid, "events", pick=True)
+                set_state(uid, STATE_EDIT_SELECT)
+                send_batch(uid)
+        elif text == "Edit completed":
+            events = read_done(uid)
+            if not events:
+                send(uid, "No completed events.", main_menu_kb())
+                set_state(uid, STATE_START)
+            else:
+                clear_data(uid)
+                open_cursor(uid, "done", pick=True)
+                set_state(uid, STATE_EDIT_DONE_SELECT)
+                send_batch(uid)
+        else:
+            send(uid, "Choose edit type:", edit_menu_kb())
+        return
+
+    # ===== SUGGEST EVENT FLOW =====
+    if state == STATE_SUGGEST_YEAR:
+        if text.isdigit() and len(text) == 4:
+            set_data(uid, "year", int(text))
+            set_state(uid, STATE_SUGGEST_MONTH)
+            send(uid, "📅Enter month (1-12):", month_kb())
+        else:
+            send(uid, "Invalid year. Enter YYYY:", year_kb())
+        return
+
+    if state == STATE_SUGGEST_MONTH:
+        if text.isdigit() and 1 <= int(text) <= 12:
+            set_data(uid, "month", int(text))
+            set_state(uid, STATE_SUGGEST_DAY)
+            year = get_data(uid, "year")
+            month = get_data(uid, "month")
+            send(uid, days_per_month_message(year, month))
+            send(uid, "🔢Enter day:", day_kb())
+        else:
+            send(uid, "📅Invalid month. Enter 1-12:", month_kb())
+        return
+
+    if state == STATE_SUGGEST_DAY:
+        year = int(get_data(uid, "year"))
+        month = int(get_data(uid, "month"))
+        if text.isdigit():
+            day = int(text)
+            max_day = calendar.monthrange(year, month)[1]
+            if 1 <= day <= max_day:
+                set_data(uid, "day", day)
+                set_state(uid, STATE_SUGGEST_HOUR)
+                send(uid, "⏳Enter hour (0-23):", hour_kb())
+            else:
+                send(uid, f"Invalid day. {calendar.month_name[month]} {year} has {max_day} days.")
+                send(uid, "🔢Enter day again:", day_kb())
+        else:
+            send(uid, "🔢Please enter a number for the day.")
+            send(uid, "Enter day again:", day_kb())
+        return
+
+    if state == STATE_SUGGEST_HOUR:
+        if text.isdigit() and 0 <= int(text) <= 23:
+            set_data(uid, "hour", int(text))
+            set_state(uid, STATE_SUGGEST_MINUTE)
+            send(uid, "🔄Enter minute (0-59):", minute_kb())
+        else:
+            send(uid, "⏳Invalid hour. Enter 0-23:", hour_kb())
+        return
+
+    if state == STATE_SUGGEST_MINUTE:
+        if text.isdigit() and 0 <= int(text) <= 59:
+            set_data(uid, "minute", int(text))
+            set_state(uid, STATE_SUGGEST_DESC)
+            send(uid, "Send description:")
+        else:
+            send(uid, "🔄Invalid minute. Enter 0-59:", minute_kb())
+        return
+
+    if state == STATE_SUGGEST_DESC:
+        set_data(uid, "desc", text)
+        set_state(uid, STATE_SUGGEST_HASHTAG)
+        send(uid, "Enter hashtag:", hashtag_kb())
+        return
+
+    if state == STATE_SUGGEST_HASHTAG:
+        if text in ["pers", "cons", "job", "event", "control"]:
+            set_data(uid, "hashtag", text)
+            set_state(uid, STATE_SUGGEST_RECURRENCE)
+            send(uid, f"Hashtag {text} accepted.")
+            send(uid, "Select recurrence:", recurrence_kb())
+        else:
+            set_data(uid, "hashtag", text)
+            set_state(uid, STATE_SUGGEST_RECURRENCE)
+            send(uid, "Select recurrence:", recurrence_kb())
+        # Remove the unconditional send() above
+        return
+
+    if state == STATE_SUGGEST_RECURRENCE:
+        recurrence_options = ["One-time", "Weekly", "Biweekly", "Monthly", "Yearly"]
+        if text in recurrence_options:
+            recurrence = text.lower()
+            set_data(uid, "recurrence", recurrence)
+            if recurrence == "one-time":
+                set_data(uid, "count", 1)
+                set_state(uid, STATE_SUGGEST_DURATION)
+                send(uid, "Enter duration in minutes (or ? for unknown):", duration_kb())
+            else:
+                set_state(uid, STATE_SUGGEST_COUNT)
+                send(uid, "Enter number of occurrences:")
+        else:
+            send(uid, "Select recurrence:", recurrence_kb())
+        return
+
+    if state == STATE_SUGGEST_COUNT:
+        if text.isdigit() and int(text) >= 1:
+            set_data(uid, "count", int(text))
+            set_state(uid, STATE_SUGGEST_DURATION)
+            send(uid, "Enter duration in minutes (or ? for unknown):", duration_kb())
+        else:
+            send(uid, "Enter valid number of occurrences:")
+        return
+
+    if state == STATE_SUGGEST_DURATION:
+        set_data(uid, "duration", text)
+        set_state(uid, STATE_SUGGEST_PLACE)
+        send(uid, "Enter place (can be ?):", place_kb())
+        return
+
+    if state == STATE_SUGGEST_PLACE:
+        year = get_data(uid, "year")
+        month = get_data(uid, "month")
+        day = get_data(uid, "day")
+        hour = get_data(uid, "hour")
+        minute = get_data(uid, "minute")
+        desc = get_data(uid, "desc")
+        hashtag = get_data(uid, "hashtag")
+        recurrence = get_data(uid, "recurrence")
+        count = get_data(uid, "count")
+        duration = get_data(uid, "duration")
+        place = text.strip()
+        set_data(uid, "place", place)
+        base_dt = datetime(year, month, day, hour, minute)
+        uid_event = next_uid(uid)
+        delta_map = {
+            "one-time": timedelta(),
+            "weekly": timedelta(days=7),
+            "biweekly": timedelta(days=14),
+            "monthly": None,
+            "yearly": None
+        }
+        events_to_append = []
+        for i in range(count):
+            dt = base_dt
+            if recurrence == "monthly":
+                dt = safe_add_months(base_dt, i)
+            elif recurrence == "yearly":
+                dt = safe_add_years(base_dt, i)
+            else:
+                dt = dt + i * delta_map.get(recurrence, timedelta())
+            line = f"{dt.isoformat()} {desc} {hashtag} {uid_event} {duration} {place}".strip()
+            events_to_append.append(line)
+        with file_lock(planner(uid)).writing():     # readers see all of the series or none
+            for e in events_to_append:
+                append_event(uid, e)
+            rearrange(uid)
+        clear_data(uid)
+        set_state(uid, STATE_START)
+        send(uid, f"Saved {count} events.", main_menu_kb())
+        return
+
+    # ===== EXTEND FLOW =====
+    if state == STATE_EXTEND_SELECT:
+        if text == "Next":
+            send_batch(uid)
+        else:
+            key = picked_ids(uid, text).get(int(text)) if text.isdigit() else None
+            if not text.isdigit():
+                send(uid, "Enter number.", nav_kb(True))
+            elif key and get_line_by_key(planner(uid), key):
+                set_data(uid, "extend_key", key)
+                set_state(uid, STATE_EXTEND_PERIOD)
+                send(uid, "Select extension period:", extend_kb())
+            else:
+                send(uid, "Invalid number.", nav_kb(True))
+        return
+
+    if state == STATE_EXTEND_PERIOD:
+        period_map = {
+            "Weekly": timedelta(days=7),
+            "Biweekly": timedelta(days=14),
+            "Monthly": "monthly",
+            "Annually": "yearly"
+        }
+        if text not in period_map:
+            send(uid, "Select extension period:", extend_kb())
+            return
+        key = get_data(uid, "extend_key")
+        original_line = get_line_by_key(planner(uid), key) if key else None
+        if original_line is None:
+            send(uid, "Extension failed.", main_menu_kb())
+            clear_data(uid)
+            set_state(uid, STATE_START)
+            return
+        parsed = parse_event_line(original_line)
+        if not parsed:
+            send(uid, "Failed parsing event.", main_menu_kb())
+            clear_data(uid)
+            set_state(uid, STATE_START)
+            return
+        dt, desc_text, hashtag, uid_event, _ = parsed
+        period = period_map[text]
+        if period == "monthly":
+            new_dt = safe_add_months(dt, 1)
+        elif period == "yearly":
+            new_dt = safe_add_years(dt, 1)
+        else:
+            new_dt = dt + period
+        tail = original_line.split(" ", 1)[1]
+        new_line = f"{new_dt.isoformat()} {tail}"
+        replace_line_by_key(planner(uid), key, new_line)
+        rearrange(uid)
+        send(uid, "✅ Your event got extended.")
+        send(uid, f"📅 It was rewritten to new date: {new_dt.date()}")
+        send(uid, f"New entry:\n{new_line}")
+        clear_data(uid)
+        set_state(uid, STATE_START)
+        send(uid, "Menu:", main_menu_kb())
+        return
+
+    # ===== LIST MENU (OLD) =====
+    if state == STATE_LIST_MENU:
+        if text == "Show all":
+            events = read_events(uid)
+            if not events:
+                send(uid, "No events.", main_menu_kb())
+                set_state(uid, STATE_START)
+            else:
+                clear_data(uid)
+                open_cursor(uid, "events")
+                set_state(uid, STATE_LIST_VIEW)
+                send_batch(uid)
+        elif text == "Filter by hashtag":
+            set_state(uid, STATE_FILTER)
+            send(uid, "Enter hashtag:")
+        else:
+            set_state(uid, STATE_START)
+            send(uid, "Menu.", main_menu_kb())
+        return
+
+    # ===== FILTER =====
+    if state == STATE_FILTER:
+        tag = text.strip().lower()
+        if tag.startswith('#'):
+            tag = tag[1:]
+        events = [e for e in read_events(uid) if tag in e.lower()]
+        if not events:
+            send(uid, f"No matches for {tag}.", main_menu_kb())
+            set_state(uid, STATE_START)
+        else:
+            clear_data(uid)
+            open_cursor(uid, "filter", tag)
+            set_state(uid, STATE_LIST_VIEW)
+            send(uid, f"🔍 Found {len(events)} event(s) with {tag}:")
+            send_batch(uid)
+        return
+
+    # ===== LIST VIEW =====
+    if state == STATE_LIST_VIEW:
+        if text == "Next":
+            send_batch(uid)
+        else:
+            clear_data(uid)
+            set_state(uid, STATE_START)
+            send(uid, "Menu.", main_menu_kb())
+        return
+
+    # ===== DATE QUERY =====
+    if state == STATE_DATE_QUERY:
+        try:
+            target_date = datetime.strptime(text, "%Y-%m-%d").date()
+        except ValueError:
+            send(uid, "❌ Invalid format. Please use YYYY-MM-DD:")
+            return
+        matches = events_for_date(uid, target_date)
+        if not matches:
+            send(uid, f"No events for {target_date}.")
+        else:
+            send(uid, f"📅 Events for {target_date}:")
+            for line in matches:
+                send(uid, line)
+        clear_data(uid)
+        set_state(uid, STATE_START)
+        send(uid, "Menu:", main_menu_kb())
+        return
+
+    # ===== DELETE BY ARRAY =====
+    if state == STATE_DELETE_ARRAY:
+        if text == "Next":
+            send_batch(uid)
+        else:
+            try:
+                keys = [k for k in picked_ids(uid, text).values() if k]
+                removed = remove_lines_by_keys(planner(uid), keys)
+                if not removed:
+                    send(uid, "No valid numbers.", nav_kb(True))
+                else:
+                    rearrange(uid)
+                    send(uid, "You've deleted entries:")
+                    for r in removed:
+                        send(uid, r)
+                    send(uid, "Done.", main_menu_kb())
+            except:
+                send(uid, "Enter numbers separated by spaces.", nav_kb(True))
+            clear_data(uid)
+            set_state(uid, STATE_START)
+        return
+
+    # ===== COMPLETE EVENT =====
+    if state == STATE_COMPLETE:
+        if text == "Next":
+            send_batch(uid)
+        else:
+            if not text.isdigit():
+                send(uid, "Enter number.", nav_kb(True))
+            else:
+                key = picked_ids(uid, text).get(int(text))
+                removed = remove_lines_by_keys(planner(uid), [key]) if key else []
+                if removed:
+                    completed = removed[0]
+                    append_done(uid, completed)
+                    rearrange(uid)
+                    send(uid, f"✅ Completed:\n{completed}", main_menu_kb())
+                else:
+                    send(uid, "Invalid number.", nav_kb(True))
+            clear_data(uid)
+            set_state(uid, STATE_START)
+        return
+
+    # ===== DELETE BY HASHTAG =====
+    if state == STATE_DELETE_HASHTAG:
+        tag = text.strip()
+        with file_lock(planner(uid)).writing():
+            events = [e for e in read_events(uid) if tag not in e]
+            write_events(uid, events)
+            rearrange(uid)
+        send(uid, f"Deleted events with hashtag {tag}.", main_menu_kb())
+        clear_data(uid)
+        set_state(uid, STATE_START)
+        return
+
+    # ===== DELETE BY UID =====
+    if state == STATE_DELETE_UID:
+        del_uid = text.strip()
+        with file_lock(planner(uid)).writing():
+            events = [e for e in read_events(uid) if not line_has_uid(e, del_uid)]
+            write_events(uid, events)
+            rearrange(uid)
+        send(uid, f"Deleted events with UID {del_uid}.", main_menu_kb())
+        clear_data(uid)
+        set_state(uid, STATE_START)
+        return
+
+    # ===== DELETE COMPLETED BY NUMBER =====
+    if state == STATE_DELETE_DONE:
+        if text == "Next":
+            send_batch(uid)
+        else:
+            if not text.isdigit():
+                send(uid, "Enter number.", nav_kb(True))
+            else:
+                key = picked_ids(uid, text).get(int(text))
+                removed = remove_lines_by_keys(done_file(uid), [key]) if key else []
+                if removed:
+                    send(uid, "Deleted:")
+                    send(uid, f"{removed[0]}", main_menu_kb())
+                else:
+                    send(uid, "Invalid number.", nav_kb(True))
+            clear_data(uid)
+            set_state(uid, STATE_START)
+        return
+
+    # ===== EDIT COMPLETED =====
+    if state == STATE_EDIT_DONE_SELECT:
+        if text == "Next":
+            send_batch(uid)
+        else:
+            key = picked_ids(uid, text).get(int(text)) if text.isdigit() else None
+            line = get_line_by_key(done_file(uid), key) if key else None
+            if not text.isdigit():
+                send(uid, "Enter number.", nav_kb(True))
+            elif line is not None:
+                set_data(uid, "edit_key", key)
+                set_state(uid, STATE_EDIT_DONE_INPUT)
+                send(uid, "Текст оригинального сообщения для правки")
+                send(uid, line)
+                send(uid, "Отправь измененную версию")
+            else:
+                send(uid, "Invalid number.", nav_kb(True))
+        return
+
+    if state == STATE_EDIT_DONE_INPUT:
+        key = get_data(uid, "edit_key")
+        if key and replace_line_by_key(done_file(uid), key, text.strip()):
+            send(uid, "Updated.", main_menu_kb())
+        else:
+            send(uid, "Edit failed.", main_menu_kb())
+        clear_data(uid)
+        set_state(uid, STATE_START)
+        return
+
+    # ===== QUICK ADD =====
+    if state == STATE_QUICK_ADD:
+        append_event(uid, text)
+        clear_data(uid)
+        set_state(uid, STATE_START)
+        send(uid, "Saved.", main_menu_kb())
+        return
+
+    # ===== NUMBER QUERY =====
+    if state == STATE_NUMBER_QUERY:
+        query = text.strip()
+        events = read_events(uid)
+        found = []
+        for idx, line in enumerate(events):
+            parsed = parse_event_line(line)
+            if not parsed:
+                continue
+            dt, desc, _, _, raw = parsed
+            if query in desc:
+                line_no = idx + 1
+                weekday = dt.strftime("%A")
+                found.append((line_no, weekday, raw))
+        if not found:
+            send(uid, "No matches found.")
+        else:
+            send(uid, "🔎 Matches in planner (absolute line numbers):")
+            for line_no, weekday, raw in found:
+                send(uid, f"#{line_no} | {weekday}\n{raw}")
+        clear_data(uid)
+        set_state(uid, STATE_START)
+        send(uid, "Menu:", main_menu_kb())
+        return
+
+    # ===== EDIT =====
+    if state == STATE_EDIT_SELECT:
+        if text == "Next":
+            send_batch(uid)
+        else:
+            key = picked_ids(uid, text).get(int(text)) if text.isdigit() else None
+            line = get_line_by_key(planner(uid), key) if key else None
+            if not text.isdigit():
+                send(uid, "Enter number.", nav_kb(True))
+            elif line is not None:
+                set_data(uid, "edit_key", key)
+                set_state(uid, STATE_EDIT_INPUT)
+                send(uid, "Текст оригинального сообщения для правки")
+                send(uid, f"{line}")
+                send(uid, "Отправь измененную версию")
+            else:
+                send(uid, "Invalid number.", nav_kb(True))
+        return
+
+
+
+    # ===== DELETE PHOTOS =====
+    if state == STATE_DELETE_PHOTOS:
+        try:
+            numbers = sorted({int(x) - 1 for x in text.split() if x.isdigit()}, reverse=True)
+            entries = get_data(uid, "photo_entries", [])
+            removed = []
+            for idx in numbers:
+                if 0 <= idx < len(entries):
+                    removed.append(entries.pop(idx))
+            if not removed:
+                send(uid, "No valid numbers.", main_menu_kb())
+            else:
+                photo_file = os.path.join("user_photos", f"{uid}photo.txt")
+                _write_lines(photo_file, entries)
+                send(uid, "You've deleted photo entries:")
+                for r in removed:
+                    desc = r.split("||", 1)[1] if "||" in r else ""
+                    send(uid, desc or "[no description]")
+                send(uid, "Done.", main_menu_kb())
+        except Exception as e:
+            log.error(f"Photo delete failed for {uid}: {e}")
+            send(uid, "Enter numbers separated by spaces.", main_menu_kb())
+        clear_data(uid)
+        set_state(uid, STATE_START)
+        return
+
+
+
+    # ===== REMIND FLOW: SELECT EVENT =====
+    if state == STATE_REMIND_SELECT:
+        if text == "Next":
+            send_batch(uid)
+        else:
+            try:
+                key = picked_ids(uid, text).get(int(text))
+                line = get_line_by_key(planner(uid), key) if key else None
+                if line is not None:
+                    parsed = parse_event_line(line)
+                    if not parsed:
+                        send(uid, "Failed to parse event.", nav_kb(True))
+                        return
+                    dt, desc, hashtag, uid_event, raw_line = parsed
+                    set_data(uid, "remind_event_uid", uid_event)
+                    set_data(uid, "remind_event_dt", dt.isoformat())
+                    set_data(uid, "remind_event_desc", f"{desc} {hashtag}".strip())
+                    set_state(uid, STATE_REMIND_COUNT)
+                    send(uid, f"Selected: {dt.strftime('%Y-%m-%d %H:%M')} {desc} {hashtag}")
+                    send(uid, "How many reminders do you want to set for this event? (1-5):")
+                else:
+                    send(uid, "Invalid number.", nav_kb(True))
+            except:
+                send(uid, "Enter a valid number.", nav_kb(True))
+        return
+
+    # ===== REMIND FLOW: NUMBER OF REMINDERS =====
+    if state == STATE_REMIND_COUNT:
+        if text.isdigit() and 1 <= int(text) <= 5:
+            count = int(text)
+            set_data(uid, "remind_count", count)
+            set_data(uid, "remind_index", 0)
+            set_data(uid, "remind_minutes_list", [])
+            set_state(uid, STATE_REMIND_MINUTES)
+            send(uid, f"Reminder 1 of {count}: How many minutes before the event should I notify you?", remind_minutes_kb())
+        else:
+            send(uid, "Please enter a number between 1 and 5:")
+        return
+
+    # ===== REMIND FLOW: MINUTES FOR EACH REMINDER =====
+    if state == STATE_REMIND_MINUTES:
+        if text.isdigit() and int(text) >= 0:
+            minutes = int(text)
+            minutes_list = get_data(uid, "remind_minutes_list", [])
+            minutes_list.append(minutes)
+            set_data(uid, "remind_minutes_list", minutes_list)
+            current_index = get_data(uid, "remind_index", 0) + 1
+            total_count = get_data(uid, "remind_count", 1)
+            if current_index < total_count:
+                set_data(uid, "remind_index", current_index)
+                send(uid, f"Reminder {current_index + 1} of {total_count}: How many minutes before the event?", remind_minutes_kb())
+            else:
+                # All reminders collected, save them
+                event_uid = get_data(uid, "remind_event_uid")
+                event_dt_str = get_data(uid, "remind_event_dt")
+                event_desc = get_data(uid, "remind_event_desc")
+                for mins in minutes_list:
+                    reminder_key = f"{uid}|{event_uid}|{event_dt_str}|custom_{mins}m"
+                    ensure_sent_reminders()
+                    with reminder_lock:
+                        sent_reminders[reminder_key] = {
+                            "minutes_before": mins,
+                            "notified": False,
+                            "event_desc": event_desc
+                        }
+                    save_sent_reminders(sent_reminders)
+                send(uid, f"✅ Set {len(minutes_list)} custom reminder(s) for: {event_desc}")
+                send(uid, f"Notifications will be sent {', '.join(str(m) + 'm' for m in minutes_list)} before the event.")
+                clear_data(uid)
+                set_state(uid, STATE_START)
+                send(uid, "Menu:", main_menu_kb())
+        else:
+            send(uid, "Please select or enter a valid number of minutes (0 or more):", remind_minutes_kb())
+        return
+
+    # ===== EDIT INPUT =====
+    if state == STATE_EDIT_INPUT:
+        key = get_data(uid, "edit_key")
+        if key and replace_line_by_key(planner(uid), key, text.strip()):
+            rearrange(uid)
+            send(uid, "Updated.", main_menu_kb())
+        else:
+            send(uid, "Edit failed.", main_menu_kb())
+        clear_data(uid)
+        set_state(uid, STATE_START)
+        return
@@ -0,0 +1,132 @@
+"""Timing and counters for background worker passes, surfaced as health.json and /status."""
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from storage import state_lock, states, _write_json
+
+# ================= WORKER HEALTH =================
+# Each pass of a background worker runs inside worker_tick(), which times
+# it and counts the users scanned, planner lines read and messages sent on
+# that thread. Workers sleep with next_tick_delay(), so a pass starts every
+# `period` seconds; drift is how late a pass started against that schedule
+# and lag is how overdue the next one is right now. Stats are written to
+# HEALTH_FILE every HEALTH_WRITE_INTERVAL seconds and shown by /status.
+HEALTH_FILE = "health.json"
+HEALTH_WRITE_INTERVAL = 30
+BOOT_TIME = time.time()
+_worker_health = {}            # worker name -> stats of its latest passes
+_worker_health_lock = threading.Lock()
+_worker_tick_local = threading.local()
+_health_written = 0.0
+
+def tick_count(field, n=1):
+    """Add to the current worker pass's counter, if this thread is inside one."""
+    tick = getattr(_worker_tick_local, "tick", None)
+    if tick is not None:
+        tick[field] += n
+
+@contextmanager
+def worker_tick(name, period):
+    """Time one pass of worker `name`, which is meant to start every `period` seconds."""
+    tick = {"users": 0, "lines": 0, "sent": 0, "backlog": None}
+    _worker_tick_local.tick = tick
+    started = time.time()
+    t0 = time.perf_counter()
+    with _worker_health_lock:
+        h = _worker_health.setdefault(name, {"period": period, "ticks": 0, "errors": 0, "max_duration": 0.0})
+        if "last_start" in h:
+            h["drift"] = round(started - h["last_start"] - period, 3)
+        h["last_start"] = started
+        h["running"] = True
+    try:
+        yield tick
+    except Exception as e:
+        with _worker_health_lock:
+            h["errors"] += 1
+            h["last_error"] = f"{datetime.now().isoformat(timespec='seconds')} {e}"
+        raise
+    else:
+        with _worker_health_lock:
+            h["last_ok"] = time.time()
+    finally:
+        _worker_tick_local.tick = None
+        duration = time.perf_counter() - t0
+        with _worker_health_lock:
+            h["running"] = False
+            h["ticks"] += 1
+            h["duration"] = round(duration, 3)
+            h["max_duration"] = round(max(h["max_duration"], duration), 3)
+            h.update(users=tick["users"], lines=tick["lines"], sent=tick["sent"])
+            if tick["users"]:
+                h["last_scan"] = started
+            if tick["backlog"] is not None:
+                h["backlog"] = tick["backlog"]
+        if time.time() - _health_written >= HEALTH_WRITE_INTERVAL:
+            write_health()
+
+def next_tick_delay(name):
+    """Seconds until worker `name` is due again; 0 if it is already late."""
+    with _worker_health_lock:
+        h = _worker_health.get(name)
+        if not h:
+            return 0
+        return max(0.0, h["last_start"] + h["period"] - time.time())
+
+def worker_health(now=None):
+    """Per-worker stats with lag and timestamps made readable."""
+    now = now or time.time()
+    out = {}
+    with _worker_health_lock:
+        for name, h in sorted(_worker_health.items()):
+            row = dict(h)
+            row["lag"] = round(max(0.0, now - h["last_start"] - h["period"]), 1)
+            row["overrun"] = h.get("duration", 0) > h["period"]
+            for k in ("last_start", "last_ok", "last_scan"):
+                if k in row:
+                    row[k] = datetime.fromtimestamp(row[k]).isoformat(timespec="seconds")
+            out[name] = row
+    return out
+
+def write_health():
+    global _health_written
+    _health_written = time.time()
+    with state_lock:
+        users = len(states)
+    _write_json(HEALTH_FILE, {
+        "written": datetime.now().isoformat(timespec="seconds"),
+        "uptime_s": int(_health_written - BOOT_TIME),
+        "users": users,
+        "workers": worker_health(_health_written),
+    })
+
+def _ago(iso):
+    if not iso:
+        return "never"
+    secs = int((datetime.now() - datetime.fromisoformat(iso)).total_seconds())
+    return f"{secs}s ago" if secs < 120 else f"{secs // 60}m ago" if secs < 7200 else f"{secs // 3600}h ago"
+
+def format_status():
+    up = int(time.time() - BOOT_TIME)
+    with state_lock:
+        users = len(states)
+    lines = [f"🩺 Up {up // 3600}h{up % 3600 // 60:02d}m, {users} users"]
+    for name, h in worker_health().items():
+        late = h["lag"] >= 1
+        flag = "⚠️" if late or h["overrun"] or h.get("last_error") else "✅"
+        line = (f"{flag} {name}: ok {_ago(h.get('last_ok'))}, {h.get('duration', 0) * 1000:.0f} ms"
+                f" (max {h['max_duration'] * 1000:.0f}) / {h['period']} s, {h.get('users', 0)} users,"
+                f" {h.get('lines', 0)} lines, {h.get('sent', 0)} sent")
+        if h.get("drift"):
+            line += f", drift {h['drift']:+.1f} s"
+        if late:
+            line += f", lag {h['lag']:.0f} s"
+        if h.get("backlog"):
+            line += f", backlog {h['backlog']}"
+        if h.get("last_scan"):
+            line += f", last scan {_ago(h['last_scan'])}"
+        if h.get("last_error"):
+            line += f"\n    {h['errors']} error(s), last: {h['last_error']}"
+        lines.append(line)
+    return "\n".join(lines)
@@ -0,0 +1,340 @@
+"""VK keyboards for every menu and picker."""
+from datetime import datetime, timedelta
+
+from vk_api.keyboard import VkKeyboard, VkKeyboardColor
+
+# ================= KEYBOARDS =================
+def year_kb():
+    kb = VkKeyboard(one_time=True)
+    now = datetime.now().year
+    kb.add_button(str(now), VkKeyboardColor.PRIMARY)
+    kb.add_line()
+    kb.add_button(str(now + 1), VkKeyboardColor.PRIMARY)
+    return kb.get_keyboard()
+
+def month_kb():
+    kb = VkKeyboard(one_time=True)
+    now = datetime.now().month
+    kb.add_button(f"{now:02d}", VkKeyboardColor.PRIMARY)
+    kb.add_line()
+    kb.add_button(f"{((now % 12) + 1):02d}", VkKeyboardColor.PRIMARY)
+    return kb.get_keyboard()
+
+def day_kb():
+    kb = VkKeyboard(one_time=True)
+    today = datetime.now().day
+    tomorrow = (datetime.now() + timedelta(days=1)).day
+    kb.add_button(str(today), VkKeyboardColor.PRIMARY)
+    kb.add_line()
+    kb.add_button(str(tomorrow), VkKeyboardColor.PRIMARY)
+    return kb.get_keyboard()
+
+def hour_kb():
+    kb = VkKeyboard(one_time=True)
+    kb.add_button("08", VkKeyboardColor.PRIMARY)
+    kb.add_button("10", VkKeyboardColor.PRIMARY)
+    kb.add_button("11", VkKeyboardColor.PRIMARY)
+    kb.add_line()
+    kb.add_button("13", VkKeyboardColor.PRIMARY)
+    kb.add_button("15", VkKeyboardColor.PRIMARY)
+    kb.add_button("16", VkKeyboardColor.PRIMARY)
+    kb.add_line()
+    kb.add_button("18", VkKeyboardColor.PRIMARY)
+    kb.add_button("20", VkKeyboardColor.PRIMARY)
+    kb.add_button("23", VkKeyboardColor.PRIMARY)
+    return kb.get_keyboard()
+
+def minute_kb():
+    kb = VkKeyboard(one_time=True)
+    kb.add_button("00", VkKeyboardColor.PRIMARY)
+    kb.add_button("10", VkKeyboardColor.PRIMARY)
+    kb.add_button("30", VkKeyboardColor.PRIMARY)
+    kb.add_line()
+    kb.add_button("40", VkKeyboardColor.PRIMARY)
+    kb.add_button("50", VkKeyboardColor.PRIMARY)
+    kb.add_button("59", VkKeyboardColor.PRIMARY)
+    return kb.get_keyboard()
+
+def duration_kb():
+    kb = VkKeyboard(one_time=True)
+    kb.add_button("?", VkKeyboardColor.PRIMARY)
+    kb.add_button("60", VkKeyboardColor.PRIMARY)
+    kb.add_button("90", VkKeyboardColor.PRIMARY)
+    return kb.get_keyboard()
+
+def place_kb():
+    kb = VkKeyboard(one_time=True)
+    kb.add_button("?", VkKeyboardColor.PRIMARY)
+    return kb.get_keyboard()
+
+def delete_menu_kb():
+    kb = VkKeyboard(one_time=True)
+    kb.add_button("Del P", VkKeyboardColor.NEGATIVE)
+    kb.add_button("Del Hash", VkKeyboardColor.NEGATIVE)
+    kb.add_button("Del ID", VkKeyboardColor.NEGATIVE)
+    kb.add_line()
+    kb.add_button("Del Ar", VkKeyboardColor.NEGATIVE)
+    kb.add_button("Del C", VkKeyboardColor.NEGATIVE)
+    kb.add_line()
+    kb.add_button("Back to menu", VkKeyboardColor.SECONDARY)
+    return kb.get_keyboard()
+
+def list_menu_main_kb():
+    kb = VkKeyboard(one_time=True)
+    kb.add_button("List events", VkKeyboardColor.PRIMARY)
+    kb.add_button("List completed", VkKeyboardColor.PRIMARY)
+    kb.add_line()
+    kb.add_button("Filter by hashtag", VkKeyboardColor.SECONDARY)
+    kb.add_button("Back to menu", VkKeyboardColor.SECONDARY)
+    return kb.get_keyboard()
+
+def edit_menu_kb():
+    kb = VkKeyboard(one_time=True)
+    kb.add_button("Edit event", VkKeyboardColor.SECONDARY)
+    kb.add_button("Edit completed", VkKeyboardColor.SECONDARY)
+    kb.add_line()
+    kb.add_button("Back to menu", VkKeyboardColor.SECONDARY)
+    return kb.get_keyboard()
+
+def quick_commands_kb():
+    kb = VkKeyboard(one_time=True)
+    kb.add_button("/pics", VkKeyboardColor.PRIMARY)
+    kb.add_button("/number", VkKeyboardColor.PRIMARY)
+    kb.add_button("/date", VkKeyboardColor.PRIMARY)
+    kb.add_line()
+    kb.add_button("/remind", VkKeyboardColor.PRIMARY)  
+    kb.add_button("/extend", VkKeyboardColor.PRIMARY)
+    kb.add_button("/largesumsrevisit", VkKeyboardColor.PRIMARY)
+    kb.add_line()   
+    kb.add_button("/today", VkKeyboardColor.PRIMARY)    
+    kb.add_button("/tomorrow", VkKeyboardColor.PRIMARY)    
+    kb.add_line()
+    kb.add_button("/ntb", VkKeyboardColor.PRIMARY) 
+    kb.add_button("/mntb", VkKeyboardColor.SECONDARY)
+    kb.add_button("Back to menu", VkKeyboardColor.SECONDARY)
+    return kb.get_keyboard()
+
+def main_menu_kb():
+    kb = VkKeyboard(one_time=True)
+    kb.add_button("Suggest", VkKeyboardColor.POSITIVE)
+    kb.add_button("Quick note", VkKeyboardColor.POSITIVE)
+    kb.add_button("Complete", VkKeyboardColor.POSITIVE)
+    kb.add_line()
+    kb.add_button("List", VkKeyboardColor.PRIMARY)
+    kb.add_button("Delete", VkKeyboardColor.NEGATIVE)
+    kb.add_button("Edit", VkKeyboardColor.PRIMARY)
+    kb.add_line()
+    kb.add_button("Quick Commands", VkKeyboardColor.SECONDARY)
+    kb.add_button("Budget", VkKeyboardColor.SECONDARY)
+    return kb.get_keyboard()
+
+def budget_menu_kb():
+    kb = VkKeyboard(one_time=True)
+    kb.add_button("Expenses", VkKeyboardColor.PRIMARY)
+    kb.add_line()
+    kb.add_button("Income", VkKeyboardColor.PRIMARY)
+    kb.add_line()
+    kb.add_button("💹 Cashflow", VkKeyboardColor.PRIMARY)
+    kb.add_line()
+    kb.add_button("Back to menu", VkKeyboardColor.SECONDARY)
+    return kb.get_keyboard()
+
+def list_menu_kb():
+    kb = VkKeyboard(one_time=True)
+    kb.add_button("Show all", VkKeyboardColor.PRIMARY)
+    kb.add_button("Filter by hashtag", VkKeyboardColor.SECONDARY)
+    kb.add_line()
+    kb.add_button("Back to menu", VkKeyboardColor.SECONDARY)
+    return kb.get_keyboard()
+
+
+def nav_kb(has_next):
+    kb = VkKeyboard(one_time=True)
+    if has_next:
+        kb.add_button("Next", VkKeyboardColor.PRIMARY)
+        kb.add_button("Back to menu", VkKeyboardColor.SECONDARY)
+    else:
+        kb.add_button("Back to menu", VkKeyboardColor.SECONDARY)
+    return kb.get_keyboard()
+
+def recurrence_kb():
+    kb = VkKeyboard(one_time=True)
+    kb.add_button("One-time", VkKeyboardColor.SECONDARY)
+    kb.add_button("Weekly", VkKeyboardColor.SECONDARY)
+    kb.add_line()
+    kb.add_button("Biweekly", VkKeyboardColor.SECONDARY)
+    kb.add_button("Monthly", VkKeyboardColor.SECONDARY)
+    kb.add_line()
+    kb.add_button("Yearly", VkKeyboardColor.SECONDARY)
+    return kb.get_keyboard()
+
+def extend_kb():
+    kb = VkKeyboard(one_time=True)
+    kb.add_button("Weekly", VkKeyboardColor.PRIMARY)
+    kb.add_button("Biweekly", VkKeyboardColor.PRIMARY)
+    kb.add_line()
+    kb.add_button("Monthly", VkKeyboardColor.PRIMARY)
+    kb.add_button("Annually", VkKeyboardColor.PRIMARY)
+    kb.add_line()
+    kb.add_button("Back to menu", VkKeyboardColor.SECONDARY)
+    return kb.get_keyboard()
+
+def remind_minutes_kb():
+    kb = VkKeyboard(one_time=True)
+    kb.add_button("5", VkKeyboardColor.PRIMARY)
+    kb.add_button("10", VkKeyboardColor.PRIMARY)
+    kb.add_button("30", VkKeyboardColor.PRIMARY)
+    kb.add_line()
+    kb.add_button("120", VkKeyboardColor.PRIMARY)
+    kb.add_button("180", VkKeyboardColor.PRIMARY)
+    kb.add_button("720", VkKeyboardColor.PRIMARY)
+    return kb.get_keyboard()
+
+
+def inc_menu_kb():
+    kb = VkKeyboard(one_time=True)
+    kb.add_button("➕ Add income", VkKeyboardColor.POSITIVE)
+    kb.add_line()
+    kb.add_button("📊 This month", VkKeyboardColor.PRIMARY)
+    kb.add_button("📅 By month", VkKeyboardColor.PRIMARY)
+    kb.add_line()
+    kb.add_button("🗑 Delete income", VkKeyboardColor.NEGATIVE)
+    kb.add_line()
+    kb.add_button("Back to menu", VkKeyboardColor.SECONDARY)
+    return kb.get_keyboard()
+
+
+
+
+
+
+def exp_menu_kb():
+    kb = VkKeyboard(one_time=True)
+    kb.add_button("➕ Add expense", VkKeyboardColor.POSITIVE)
+    kb.add_line()
+    kb.add_button("📊 This month", VkKeyboardColor.PRIMARY)
+    kb.add_button("📅 By month", VkKeyboardColor.PRIMARY)
+    kb.add_line()
+    kb.add_button("🗑 Delete expense", VkKeyboardColor.NEGATIVE)
+    kb.add_line()
+    kb.add_button("Back to menu", VkKeyboardColor.SECONDARY)
+    return kb.get_keyboard()
+
+def exp_date_choice_kb():
+    kb = VkKeyboard(one_time=True)
+    kb.add_button("For today",     VkKeyboardColor.POSITIVE)
+    kb.add_line()
+    kb.add_button("For yesterday", VkKeyboardColor.POSITIVE)
+    kb.add_line()
+    kb.add_button("For specific day", VkKeyboardColor.PRIMARY)
+    kb.add_line()
+    kb.add_button("Back", VkKeyboardColor.SECONDARY)
+    return kb.get_keyboard()
+
+
+def exp_year_choice_kb():
+    kb = VkKeyboard(one_time=True)
+    now = datetime.now()
+    kb.add_button(f"This year ({now.year})",   VkKeyboardColor.POSITIVE)
+    kb.add_line()
+    kb.add_button(f"Previous year ({now.year-1})", VkKeyboardColor.PRIMARY)
+    kb.add_line()
+    kb.add_button("Specific year", VkKeyboardColor.SECONDARY)
+    kb.add_line()
+    kb.add_button("Back", VkKeyboardColor.SECONDARY)
+    return kb.get_keyboard()
+
+
+def exp_month_choice_kb():
+    kb = VkKeyboard(one_time=True)
+    now = datetime.now()
+    prev = now - timedelta(days=now.day + 5)   # rough previous month
+    kb.add_button(f"This month ({now.strftime('%Y-%m')})",   VkKeyboardColor.POSITIVE)
+    kb.add_line()
+    kb.add_button(f"Previous month ({prev.strftime('%Y-%m')})", VkKeyboardColor.PRIMARY)
+    kb.add_line()
+    kb.add_button("Specific month", VkKeyboardColor.SECONDARY)
+    kb.add_line()
+    kb.add_button("Back", VkKeyboardColor.SECONDARY)
+    return kb.get_keyboard()
+
+
+def exp_category_kb():
+    kb = VkKeyboard(one_time=True)
+    kb.add_button("🍔 food",       VkKeyboardColor.PRIMARY)
+    kb.add_button("🚗 transport",  VkKeyboardColor.PRIMARY)
+    kb.add_button("✈️ travel",  VkKeyboardColor.PRIMARY)
+    kb.add_line()
+    kb.add_button("🏠 housing",    VkKeyboardColor.PRIMARY)
+    kb.add_button("💊 health",     VkKeyboardColor.PRIMARY)
+    kb.add_button("🚫 notmy",      VkKeyboardColor.SECONDARY)
+    kb.add_line()
+    kb.add_button("🎮 fun",        VkKeyboardColor.PRIMARY)
+    kb.add_button("🛒 shop",       VkKeyboardColor.PRIMARY)
+    kb.add_button("➡️ transfer",       VkKeyboardColor.PRIMARY)
+    kb.add_line()
+    kb.add_button("🎓 education",    VkKeyboardColor.PRIMARY)
+    kb.add_button("🧾 bills",      VkKeyboardColor.PRIMARY)
+    kb.add_line()
+    kb.add_button("🎁 gifts",      VkKeyboardColor.PRIMARY)
+    kb.add_button("📲 sbp",      VkKeyboardColor.PRIMARY)
+    kb.add_button("📦 other",      VkKeyboardColor.SECONDARY)
+    return kb.get_keyboard()
+
+def exp_desc_kb():
+    kb = VkKeyboard(one_time=True)
+    kb.add_button("— skip —", VkKeyboardColor.SECONDARY)
+    return kb.get_keyboard()
+
+def exp_month_kb():
+    kb = VkKeyboard(one_time=True)
+    today = datetime.now().date()
+    months = []
+    y, m = today.year, today.month
+    for _ in range(6):
+        months.append((y, m))
+        m -= 1
+        if m == 0:
+            m = 12
+            y -= 1
+    months.reverse()
+    for i in range(0, 6, 2):
+        for j in range(2):
+            if i + j < len(months):
+                yy, mm = months[i + j]
+                kb.add_button(f"{yy}-{mm:02d}", VkKeyboardColor.PRIMARY)
+        if i + 2 < 6:
+            kb.add_line()
+    kb.add_line()
+    kb.add_button("Back to menu", VkKeyboardColor.SECONDARY)
+    return kb.get_keyboard()
+
+
+def exp_tool_kb():
+    kb = VkKeyboard(one_time=True)
+    kb.add_button("gp",   VkKeyboardColor.PRIMARY)
+    kb.add_button("hal",  VkKeyboardColor.PRIMARY)
+    kb.add_button("sb",   VkKeyboardColor.PRIMARY)
+    kb.add_line()
+    kb.add_button("ren",  VkKeyboardColor.PRIMARY)
+    kb.add_button("oz",   VkKeyboardColor.PRIMARY)
+    kb.add_button("ya",   VkKeyboardColor.PRIMARY)
+    kb.add_line()
+    kb.add_button("cert", VkKeyboardColor.PRIMARY)
+    kb.add_button("cash", VkKeyboardColor.PRIMARY)
+    kb.add_button("other",VkKeyboardColor.SECONDARY)
+    kb.add_line()
+    kb.add_button("— skip —", VkKeyboardColor.SECONDARY)
+    return kb.get_keyboard()
+
+
+
+def hashtag_kb():
+    kb = VkKeyboard(one_time=True)
+    kb.add_button("pers", VkKeyboardColor.PRIMARY)
+    kb.add_button("cons", VkKeyboardColor.PRIMARY)
+    kb.add_button("job", VkKeyboardColor.PRIMARY)
+    kb.add_line()
+    kb.add_button("event", VkKeyboardColor.PRIMARY)
+    kb.add_button("control", VkKeyboardColor.PRIMARY)
+    return kb.get_keyboard()
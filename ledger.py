@@ -0,0 +1,1803 @@
+"""
+Expense and income ledgers: entries, monthly totals, cashflow, the
+columnar archive, the in-memory index, and CSV import / export.
+"""
+import base64
+import bisect
+import csv
+import io
+import itertools
+import os
+import re
+import shutil
+import struct
+import tempfile
+import threading
+import time
+import urllib.request
+import zlib
+from datetime import datetime, timedelta
+from typing import Dict
+
+import codec
+from config import KNOWN_TOOLS, LARGE_EXPENSE_LIMIT, log, PLANNER_DIR
+from storage import (
+    commit_hooks, ledger_lock, ledger_txn, save_states, state_lock, states, user, _apply_staged_files, _file_version,
+    write_at_record, _iter_json_list, _json_exists, _read_json, _read_json_list, _txn_local, _write_json,
+)
+from health import next_tick_delay, tick_count, worker_tick
+from transport import send, upload_document, vk
+from keyboards import main_menu_kb
+from planner import done_file, line_key, minute_text, parse_event_line, planner, safe_add_months, to_minute
+
+# ================= CATEGORIES =================
+CATEGORIES = [
+    ("🍔", "food"),
+    ("🚗", "transport"),
+    ("✈️", "travel"),      # ← new
+    ("🏠", "housing"),
+    ("💊", "health"),
+    ("🚫", "notmy"),
+    ("🎮", "fun"),
+    ("🛒", "shop"),
+    ("➡️", "transfer"),      # ← new
+    ("🎓", "education"),
+    ("🧾", "bills"),
+    ("🎁", "gifts"),
+    ("📲", "sbp"),
+    ("📦", "other"),
+]
+
+CAT_SLUGS = [c[1] for c in CATEGORIES]
+CAT_LABEL_MAP = {f"{e} {s}": s for e, s in CATEGORIES}
+for s in CAT_SLUGS:
+    CAT_LABEL_MAP[s] = s
+
+# ================= INCOME FILE HELPERS =================
+def inc_file(uid):
+    return os.path.join(PLANNER_DIR, f"{uid}income.json")
+
+def inc_totals_file(uid):
+    return os.path.join(PLANNER_DIR, f"{uid}inc_totals.json")
+
+def read_income(uid):
+    return _read_json_list(inc_file(uid))
+
+def write_income(uid, entries):
+    _write_json(inc_file(uid), entries)
+
+def read_inc_totals(uid):
+    return _read_json(inc_totals_file(uid), {})
+
+def _save_inc_totals(uid, totals):
+    _write_json(inc_totals_file(uid), totals)
+
+def next_inc_id(uid):
+    with state_lock:
+        u = user(uid)
+        val = u.get("next_inc_id", 1)
+        u["next_inc_id"] = val + 1
+        save_states()
+        return f"i{val}"
+
+def save_income(uid, amount, desc, dt: datetime = None):
+    if dt is None:
+        dt = datetime.now()
+    entry = {
+        "id": next_inc_id(uid),
+        "dt": dt.strftime("%Y-%m-%dT%H:%M"),
+        "amount": amount,
+        "desc": desc,
+    }
+    with ledger_lock(uid).writing(), ledger_txn(uid):
+        entries = read_income(uid)
+        entries.append(entry)
+        write_income(uid, entries)
+        _add_to_inc_totals(uid, entry)
+        _apply_cashflow(uid, _month_key(entry["dt"]), income=entry["amount"])
+    return entry
+
+def delete_income_by_ids(uid, entry_ids):
+    """
+    Remove every income entry whose id is in `entry_ids` with one ledger
+    rewrite and one update of totals and cashflow. Returns the removed
+    entries in ledger order.
+    """
+    wanted = set(entry_ids)
+    with ledger_lock(uid).writing(), ledger_txn(uid):
+        entries = read_income(uid)
+        kept = [e for e in entries if e.get("id") not in wanted]
+        if len(kept) == len(entries):
+            return []
+        removed = [e for e in entries if e.get("id") in wanted]
+        write_income(uid, kept)
+        _subtract_from_inc_totals(uid, removed)
+        deltas = {}
+        for e in removed:
+            mk = _month_key(e["dt"])
+            deltas[mk] = (deltas.get(mk, (0.0, 0.0))[0] - e["amount"], 0.0)
+        _apply_cashflow_deltas(uid, deltas)
+    return removed
+
+def delete_income_by_id(uid, entry_id):
+    removed = delete_income_by_ids(uid, [entry_id])
+    return removed[0] if removed else None
+
+def _add_to_inc_totals(uid, entry):
+    totals = read_inc_totals(uid)
+    mk = _month_key(entry["dt"])
+    if mk not in totals:
+        totals[mk] = {"total": 0.0}
+    totals[mk]["total"] = round(totals[mk].get("total", 0) + entry["amount"], 2)
+    _save_inc_totals(uid, totals)
+
+def _subtract_from_inc_totals(uid, entries):
+    """Subtract one entry or a list of entries with a single totals write."""
+    if isinstance(entries, dict):
+        entries = [entries]
+    totals = read_inc_totals(uid)
+    for entry in entries:
+        mk = _month_key(entry["dt"])
+        if mk not in totals:
+            continue
+        totals[mk]["total"] = round(totals[mk].get("total", 0) - entry["amount"], 2)
+    _save_inc_totals(uid, totals)
+
+def format_inc_entry(entry, idx=None):
+    dt = entry["dt"][5:16].replace("T", " ")
+    amt = f"{entry['amount']:,.0f}"
+    desc = f" {entry['desc']}" if entry.get("desc") else ""
+    prefix = f"{idx+1}. " if idx is not None else ""
+    return f"{prefix}{dt} +{amt}{desc}"
+
+def format_inc_month_stats(uid, month_key):
+    totals = read_inc_totals(uid)
+    if month_key not in totals:
+        return f"No income recorded for {month_key}."
+    grand = totals[month_key].get("total", 0)
+    return f"📈 {month_key} income — {grand:,.0f}"
+
+# ================= EXPENSE FILE HELPERS =================
+EXPENSE_ARCHIVE_MONTHS = 3
+
+def exp_file(uid):
+    return os.path.join(PLANNER_DIR, f"{uid}expenses.json")
+
+def exp_totals_file(uid):
+    return os.path.join(PLANNER_DIR, f"{uid}exp_totals.json")
+
+def exp_archive_file(uid, year):
+    return os.path.join(PLANNER_DIR, f"{uid}expenses_{year}.col")
+
+def legacy_archive_file(uid, year):
+    """Pretty-printed JSON archive used before the columnar format."""
+    return os.path.join(PLANNER_DIR, f"{uid}expenses_{year}.json")
+
+def read_expenses(uid):
+    return _read_json_list(exp_file(uid))
+
+def write_expenses(uid, entries):
+    _write_json(exp_file(uid), entries)
+
+def read_totals(uid):
+    return _read_json(exp_totals_file(uid), {})
+
+def _save_totals(uid, totals):
+    _write_json(exp_totals_file(uid), totals)
+
+def _month_key(dt_str):
+    return dt_str[:7]
+
+def _cat_emoji(cat):
+    for e, s in CATEGORIES:
+        if s == cat:
+            return e
+    return "📦"
+
+def _entry_digest(entry):
+    """Order-independent fingerprint of one ledger entry (XOR-combined per month)."""
+    key = f"{entry.get('id')}|{entry.get('dt')}|{entry.get('amount')}|{entry.get('category', 'other')}"
+    return zlib.crc32(key.encode("utf-8"))
+
+def _empty_totals_row():
+    row = {"total": 0.0, "count": 0, "checksum": 0}
+    for s in CAT_SLUGS:
+        row[s] = 0.0
+    return row
+
+def _totals_row_for(entries):
+    """Build one month's totals row (with count and checksum) from its ledger entries."""
+    row = _empty_totals_row()
+    for entry in entries:
+        cat = entry.get("category", "other")
+        row["total"] = round(row["total"] + entry["amount"], 2)
+        row[cat]     = round(row.get(cat, 0) + entry["amount"], 2)
+        row["count"] += 1
+        row["checksum"] ^= _entry_digest(entry)
+    return row
+
+def _apply_to_totals(uid, entries, sign):
+    """Add (sign=1) or remove (sign=-1) entries in a single read-modify-write."""
+    with ledger_lock(uid).writing():
+        totals = read_totals(uid)
+        for entry in entries:
+            mk = _month_key(entry["dt"])
+            row = totals.setdefault(mk, _empty_totals_row())
+            cat = entry.get("category", "other")
+            amount = sign * entry["amount"]
+            row["total"]    = round(row.get("total", 0) + amount, 2)
+            row[cat]        = round(row.get(cat, 0)     + amount, 2)
+            row["count"]    = row.get("count", 0) + sign
+            row["checksum"] = row.get("checksum", 0) ^ _entry_digest(entry)
+        _save_totals(uid, totals)
+
+def _add_to_totals(uid, entry):
+    _apply_to_totals(uid, [entry], 1)
+
+def next_exp_id(uid):
+    with state_lock:
+        u = user(uid)
+        val = u.get("next_exp_id", 1)
+        u["next_exp_id"] = val + 1
+        save_states()
+        return f"e{val}"
+
+def reserve_exp_ids(uid, count):
+    """Reserve `count` consecutive expense ids with one states write; returns the first number."""
+    with state_lock:
+        u = user(uid)
+        first = u.get("next_exp_id", 1)
+        u["next_exp_id"] = first + count
+        save_states()
+        return first
+
+
+def save_expense(uid, amount, category, desc, dt: datetime = None, tool: str = None):
+    if dt is None:
+        dt = datetime.now()
+   
+    entry = {
+        "id": next_exp_id(uid),
+        "dt": dt.strftime("%Y-%m-%dT%H:%M"),
+        "amount": amount,
+        "category": category,
+        "desc": desc,
+    }
+    if tool and tool != "— skip —":
+        entry["tool"] = tool.lower().strip()
+
+    with ledger_lock(uid).writing(), ledger_txn(uid):
+        entries = read_expenses(uid)
+        entries.append(entry)
+        write_expenses(uid, entries)
+        _add_to_totals(uid, entry)
+        _apply_cashflow(uid, _month_key(entry["dt"]), expense=entry["amount"])
+    return entry
+
+def save_expense_with_transfer(uid, amount, category, desc, dt: datetime = None, tool: str = None):
+    """save_expense; a transfer also gets its matching income entry, in the same transaction."""
+    with ledger_lock(uid).writing(), ledger_txn(uid):
+        entry = save_expense(uid, amount, category, desc, dt=dt, tool=tool)
+        if category == "transfer":
+            save_income(uid, amount, f"Transfer{': ' + desc if desc else ''}", dt=dt)
+    return entry
+
+def delete_expenses_by_ids(uid, entry_ids):
+    """
+    Remove every expense whose id is in `entry_ids` with one ledger rewrite
+    and one update of totals and cashflow. Returns the removed entries in
+    ledger order.
+    """
+    wanted = set(entry_ids)
+    with ledger_lock(uid).writing(), ledger_txn(uid):
+        entries = read_expenses(uid)
+        kept = [e for e in entries if e.get("id") not in wanted]
+        if len(kept) == len(entries):
+            return []
+        removed = [e for e in entries if e.get("id") in wanted]
+        write_expenses(uid, kept)
+        _apply_to_totals(uid, removed, -1)
+        deltas = {}
+        for e in removed:
+            mk = _month_key(e["dt"])
+            deltas[mk] = (0.0, deltas.get(mk, (0.0, 0.0))[1] - e["amount"])
+        _apply_cashflow_deltas(uid, deltas)
+    return removed
+
+def delete_expense_by_id(uid, entry_id):
+    removed = delete_expenses_by_ids(uid, [entry_id])
+    return removed[0] if removed else None
+
+
+def format_entry(entry, idx=None):
+    dt = entry["dt"][5:16].replace("T", " ")          # e.g. "03-09 14:30"
+    em = _cat_emoji(entry["category"])
+    amt = f"{entry['amount']:,.0f}"
+    
+    desc_part = f" {entry['desc']}" if entry.get("desc") else ""
+    tool_part = f"  → {entry['tool'].upper()}" if entry.get("tool") else ""
+    
+    prefix = f"{idx+1}. " if idx is not None else ""
+    
+    return f"{prefix}{dt} {em}{amt}{desc_part}{tool_part}"
+
+
+def format_tool_breakdown_for_month(uid, month_key):
+    """Return a formatted breakdown of expenses by payment tool for a given month."""
+    entries = read_expenses(uid)
+    month_entries = [e for e in entries if e["dt"][:7] == month_key]
+    if not month_entries:
+        return ""
+
+    tool_totals: Dict[str, float] = {}
+    no_tool_total = 0.0
+
+    for e in month_entries:
+        tool = e.get("tool", "").lower().strip()
+        if not tool or tool == "— skip —":
+            no_tool_total += e["amount"]
+        else:
+            tool_totals[tool] = tool_totals.get(tool, 0.0) + e["amount"]
+
+    if not tool_totals and no_tool_total == 0:
+        return ""
+
+    grand = sum(tool_totals.values()) + no_tool_total
+    lines = ["💳 By payment method:"]
+
+    # Show known tools first (in button order), then any unexpected ones
+    seen = set()
+    ordered = KNOWN_TOOLS + [t for t in tool_totals if t not in KNOWN_TOOLS]
+    for tool in ordered:
+        amt = tool_totals.get(tool, 0.0)
+        if amt == 0:
+            continue
+        pct = int(amt / grand * 100) if grand else 0
+        lines.append(f"  {tool.upper():<6}  {amt:>10,.0f}  {pct:>3}%")
+        seen.add(tool)
+
+    if no_tool_total > 0:
+        pct = int(no_tool_total / grand * 100) if grand else 0
+        lines.append(f"  {'—':<6}  {no_tool_total:>10,.0f}  {pct:>3}%  (no method)")
+
+    return "\n".join(lines)
+
+
+# ── NEW: /newtoolsbreakdown helpers ──────────────────────────────────────────
+
+def newtoolsbreakdown_file(uid):
+    return os.path.join(PLANNER_DIR, f"{uid}newtoolsbreakdown.json")
+
+def read_newtoolsbreakdown_start(uid):
+    """Return the ISO datetime string from which the secondary breakdown counts, or None."""
+    path = newtoolsbreakdown_file(uid)
+    if not os.path.exists(path):
+        return None
+    try:
+        return codec.read(path).get("start_dt")
+    except Exception:
+        return None
+
+def write_newtoolsbreakdown_start(uid, dt_iso: str):
+    _write_json(newtoolsbreakdown_file(uid), {"start_dt": dt_iso})
+
+def format_tool_breakdown_from_date(uid, since_dt_iso: str) -> str:
+    """
+    Same layout as format_tool_breakdown_for_month but counts ALL expenses
+    recorded on or after since_dt_iso (cross-month).
+    """
+    since_dt = datetime.fromisoformat(since_dt_iso)
+    entries = read_expenses(uid)
+    filtered = [e for e in entries if datetime.fromisoformat(e["dt"]) >= since_dt]
+    if not filtered:
+        return ""
+
+    tool_totals: Dict[str, float] = {}
+    no_tool_total = 0.0
+
+    for e in filtered:
+        tool = e.get("tool", "").lower().strip()
+        if not tool or tool == "— skip —":
+            no_tool_total += e["amount"]
+        else:
+            tool_totals[tool] = tool_totals.get(tool, 0.0) + e["amount"]
+
+    if not tool_totals and no_tool_total == 0:
+        return ""
+
+    grand = sum(tool_totals.values()) + no_tool_total
+    since_label = since_dt.strftime("%Y-%m-%d %H:%M")
+    lines = [f"💳 By payment method (since {since_label}):"]
+
+    seen = set()
+    ordered = KNOWN_TOOLS + [t for t in tool_totals if t not in KNOWN_TOOLS]
+    for tool in ordered:
+        amt = tool_totals.get(tool, 0.0)
+        if amt == 0:
+            continue
+        pct = int(amt / grand * 100) if grand else 0
+        lines.append(f"  {tool.upper():<6}  {amt:>10,.0f}  {pct:>3}%")
+        seen.add(tool)
+
+    if no_tool_total > 0:
+        pct = int(no_tool_total / grand * 100) if grand else 0
+        lines.append(f"  {'—':<6}  {no_tool_total:>10,.0f}  {pct:>3}%  (no method)")
+
+    return "\n".join(lines)
+
+# ── END NEW ───────────────────────────────────────────────────────────────────
+
+
+def format_month_stats(uid, month_key):
+    totals = read_totals(uid)
+    if month_key not in totals:
+        return f"No expenses recorded for {month_key}."
+    data  = totals[month_key]
+    grand = data.get("total", 0)
+    lines = [f"📊 {month_key}  —  {grand:,.0f}"]
+    for em, cat in CATEGORIES:
+        amt = data.get(cat, 0)
+        if amt == 0:
+            continue
+        pct = int(amt / grand * 100) if grand else 0
+        bar = "█" * (pct // 10)
+        lines.append(f"{em} {cat:<10} {amt:>8,.0f}  {pct:>3}% {bar}")
+    return "\n".join(lines)
+
+def format_all_month_totals(uid):
+    totals = read_totals(uid)
+    if not totals:
+        return "No expense history yet."
+    lines = ["📅 Monthly totals:"]
+    for mk in sorted(totals.keys()):
+        amt = totals[mk].get("total", 0)
+        lines.append(f"  {mk}  {amt:>10,.0f}")
+    return "\n".join(lines)
+
+def format_all_inc_month_totals(uid):
+    totals = read_inc_totals(uid)
+    if not totals:
+        return "No income history yet."
+    lines = ["📅 Monthly income totals:"]
+    for mk in sorted(totals.keys()):
+        amt = totals[mk].get("total", 0)
+        lines.append(f" {mk} {amt:>10,.0f}")
+    return "\n".join(lines)
+
+
+
+def format_large_expenses_for_month(uid, month_key):
+    """Return a formatted string of large expenses for the given month, or empty string."""
+    month_entries = large_expenses(uid, get_large_threshold(uid), month_key)
+    if not month_entries:
+        return ""
+    lines = [f"⚠️ Large expenses :"]
+    for e in month_entries:
+        lines.append(format_entry(e))
+    return "\n".join(lines)
+
+
+def _merge_totals_rows(a, b):
+    """Combine two totals rows for the same month (checksums XOR together)."""
+    row = dict(a)
+    for k, v in b.items():
+        if k == "checksum":
+            row[k] = row.get(k, 0) ^ v
+        elif k == "count":
+            row[k] = row.get(k, 0) + v
+        else:
+            row[k] = round(row.get(k, 0) + v, 2)
+    return row
+
+def recalc_all_totals(uid):
+    """Rebuild exp_totals.json: archived months come from the archive footers, live months from the ledger."""
+    with ledger_lock(uid).writing(), ledger_txn(uid):
+        totals = {}
+        for year in archive_years(uid):
+            for mk, row in archive_month_summaries(uid, year).items():
+                totals[mk] = _merge_totals_rows(totals.get(mk, _empty_totals_row()), row)
+        by_month = {}
+        for entry in read_expenses(uid):
+            by_month.setdefault(_month_key(entry["dt"]), []).append(entry)
+        for mk, entries in by_month.items():
+            totals[mk] = _merge_totals_rows(totals.get(mk, _empty_totals_row()), _totals_row_for(entries))
+        _save_totals(uid, totals)
+        rebuild_cashflow(uid)
+    return totals
+
+
+# ================= TOTALS RECONCILIATION =================
+TOTALS_RECONCILE_INTERVAL = 300     # seconds between reconciler passes
+TOTALS_RECONCILE_MONTHS = 3         # months verified per user per pass
+_reconcile_queue = {}               # uid -> months still to verify in the current round
+_reconcile_lock = threading.Lock()  # guards _reconcile_queue; callers only hold the ledger read lock
+
+def _totals_row_matches(row, expected):
+    return (
+        row.get("count") == expected["count"]
+        and row.get("checksum") == expected["checksum"]
+        and abs(row.get("total", 0) - expected["total"]) < 0.005
+    )
+
+def _drifted_months(uid, months, totals, live):
+    """Map each month in `months` whose totals row disagrees with the ledger to its expected row."""
+    drifted = {}
+    archives = {}
+    for mk in months:
+        year = int(mk[:4])
+        if year not in archives:
+            archives[year] = archive_month_summaries(uid, year)
+        expected = _totals_row_for([e for e in live if _month_key(e["dt"]) == mk])
+        if mk in archives[year]:
+            expected = _merge_totals_rows(expected, archives[year][mk])
+        row = totals.get(mk)
+        if row is None and not expected["count"]:
+            continue
+        if row is not None and _totals_row_matches(row, expected):
+            continue
+        drifted[mk] = expected
+    return drifted
+
+def reconcile_totals(uid, max_months=TOTALS_RECONCILE_MONTHS):
+    """
+    Verify the next few months of exp_totals.json against the ledger and
+    rebuild only the months that drifted. Returns the list of rebuilt months.
+    The check runs under the read lock; the write lock is only taken to fix
+    drifted months, which are checked again under it.
+    """
+    uid = str(uid)
+    with ledger_lock(uid).reading():
+        totals = read_totals(uid)
+        live = read_expenses(uid)
+        with _reconcile_lock:
+            queue = _reconcile_queue.get(uid)
+            if not queue:
+                queue = sorted(set(totals) | {_month_key(e["dt"]) for e in live}, reverse=True)
+            batch, _reconcile_queue[uid] = queue[:max_months], queue[max_months:]
+        drifted = _drifted_months(uid, batch, totals, live)
+    if not drifted:
+        return []
+
+    with ledger_lock(uid).writing(), ledger_txn(uid):
+        totals = read_totals(uid)
+        drifted = _drifted_months(uid, sorted(drifted, reverse=True), totals, read_expenses(uid))
+        for mk, expected in drifted.items():
+            if expected["count"]:
+                totals[mk] = expected
+            else:
+                totals.pop(mk, None)
+            if _json_exists(cashflow_file(uid)):
+                _set_cashflow_month(uid, mk, expense=expected["total"])
+        if drifted:
+            _save_totals(uid, totals)
+    return list(drifted)
+
+def totals_reconcile_worker():
+    """Continuously verify expense totals a few months at a time and repair drift."""
+    while True:
+        try:
+            with worker_tick("totals_reconcile", TOTALS_RECONCILE_INTERVAL) as tick:
+                with state_lock:
+                    uids = list(states.keys())
+                tick_count("users", len(uids))
+                for uid in uids:
+                    if not os.path.exists(exp_totals_file(uid)):
+                        continue
+                    rebuilt = reconcile_totals(uid)
+                    if rebuilt:
+                        log.warning(f"Repaired drifted totals for {uid}: {', '.join(rebuilt)}")
+                with _reconcile_lock:
+                    tick["backlog"] = sum(len(q) for q in _reconcile_queue.values())
+            time.sleep(next_tick_delay("totals_reconcile"))
+        except Exception as e:
+            log.error(f"Totals reconcile worker error: {e}")
+            time.sleep(60)
+
+
+
+# ================= ARCHIVE FORMAT =================
+# Archived years live in {uid}expenses_{year}.col, a columnar file:
+#
+#   MAGIC | row group | row group | ... | footer JSON | u32 footer length | MAGIC
+#
+# A row group holds up to ARCHIVE_GROUP_ROWS consecutive entries as one
+# block per column, each zlib-compressed on its own: amounts as
+# little-endian doubles, categories as u16 codes into a dictionary kept in
+# the footer, the other fields as JSON string lists. Readers decode one
+# group at a time, so streaming a year never holds more than one group.
+# The footer also holds one totals row (with count and checksum) per
+# month, so totals rebuilds and reconciliation never decode archived
+# entries. Version 1 files (a single group described at the top level of
+# the footer) and legacy .json archives are still read; both get
+# rewritten the next time their year is written.
+
+ARCHIVE_MAGIC = b"VKCOL1\n"
+ARCHIVE_GROUP_ROWS = 2048
+ARCHIVE_TEXT_COLUMNS = ("id", "dt", "desc", "tool")
+ARCHIVE_KNOWN_KEYS = {"id", "dt", "amount", "category", "desc", "tool"}
+_archive_footer_cache = {}   # path -> (version, footer)
+
+def _encode_group(entries, cat_codes, out, base=0):
+    """Append one row group's column blocks to out (which starts at file offset base); returns its footer entry."""
+    n = len(entries)
+    raw = {
+        "amount": struct.pack(f"<{n}d", *(float(e["amount"]) for e in entries)),
+        "category": struct.pack(f"<{n}H", *(cat_codes[e.get("category", "other")] for e in entries)),
+    }
+    for name in ARCHIVE_TEXT_COLUMNS:
+        raw[name] = codec.dumpb([e.get(name) for e in entries])
+    extra = [{k: v for k, v in e.items() if k not in ARCHIVE_KNOWN_KEYS} or None for e in entries]
+    if any(extra):
+        raw["extra"] = codec.dumpb(extra)
+    columns = {}
+    for name, data in raw.items():
+        block = zlib.compress(data, 6)
+        columns[name] = [base + len(out), len(block)]
+        out += block
+    return {
+        "rows": n,
+        "columns": columns,
+        "int_amounts": [i for i, e in enumerate(entries) if isinstance(e["amount"], int)],
+    }
+
+def encode_archive(entries):
+    """Serialise entries (kept in the given order) to the columnar format."""
+    entries = list(entries)
+    cats = []
+    cat_codes = {}
+    by_month = {}
+    for e in entries:
+        cat = e.get("category", "other")
+        if cat not in cat_codes:
+            cat_codes[cat] = len(cats)
+            cats.append(cat)
+        by_month.setdefault(_month_key(e["dt"]), []).append(e)
+
+    out = bytearray(ARCHIVE_MAGIC)
+    groups = [_encode_group(entries[i:i + ARCHIVE_GROUP_ROWS], cat_codes, out)
+              for i in range(0, len(entries), ARCHIVE_GROUP_ROWS)]
+    footer = {
+        "version": 2,
+        "rows": len(entries),
+        "groups": groups,
+        "categories": cats,
+        "months": {mk: _totals_row_for(rows) for mk, rows in sorted(by_month.items())},
+    }
+    footer_bytes = codec.dumpb(footer)
+    out += footer_bytes + struct.pack("<I", len(footer_bytes)) + ARCHIVE_MAGIC
+    return bytes(out)
+
+class ArchiveReader:
+    """Random access to one columnar archive (on disk, staged in the current transaction, or given as bytes)."""
+
+    def __init__(self, path, data=None):
+        self.path = path
+        txn = getattr(_txn_local, "txn", None)
+        if data is None and txn is not None and path in txn.staged:
+            data = txn.staged[path]
+            if isinstance(data, dict):          # a staged append: the file up to it, then the new tail
+                with open(path, "rb") as f:
+                    data = f.read(data["at"]) + base64.b64decode(data["b64"])
+        self.data = data
+        if self.data is None:
+            hit = _archive_footer_cache.get(path)
+            version = _file_version(path)
+            if hit is None or hit[0] != version:
+                hit = (version,) + self._read_footer()
+                _archive_footer_cache[path] = hit
+            self.footer, self.footer_offset = hit[1], hit[2]
+        else:
+            self.footer, self.footer_offset = self._read_footer()
+
+    def _read(self, offset, length):
+        if self.data is not None:
+            return self.data[offset:offset + length]
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            return f.read(length)
+
+    def _read_footer(self):
+        tail_len = 4 + len(ARCHIVE_MAGIC)
+        if self.data is not None:
+            tail = self.data[-tail_len:]
+            size = len(self.data)
+        else:
+            size = os.path.getsize(self.path)
+            tail = self._read(size - tail_len, tail_len)
+        if size < len(ARCHIVE_MAGIC) + tail_len or tail[4:] != ARCHIVE_MAGIC:
+            raise ValueError(f"not a columnar archive: {self.path}")
+        (footer_len,) = struct.unpack("<I", tail[:4])
+        offset = size - tail_len - footer_len
+        return codec.loads(self._read(offset, footer_len)), offset
+
+    def groups(self):
+        if self.footer.get("version", 1) == 1:
+            return [self.footer] if self.footer["rows"] else []
+        return self.footer["groups"]
+
+    def _group_column(self, group, name):
+        n = group["rows"]
+        if name not in group["columns"]:
+            return [None] * n
+        offset, length = group["columns"][name]
+        data = zlib.decompress(self._read(offset, length))
+        if name == "amount":
+            values = list(struct.unpack(f"<{n}d", data))
+            for i in group.get("int_amounts", []):
+                values[i] = int(values[i])
+            return values
+        if name == "category":
+            cats = self.footer["categories"]
+            return [cats[c] for c in struct.unpack(f"<{n}H", data)]
+        return codec.loads(data)
+
+    def column(self, name):
+        """Decode a single column into a list."""
+        values = []
+        for group in self.groups():
+            values.extend(self._group_column(group, name))
+        return values
+
+    def iter_entries(self):
+        """Yield entry dicts one row group at a time."""
+        for group in self.groups():
+            cols = {name: self._group_column(group, name)
+                    for name in ("id", "dt", "amount", "category", "desc", "tool", "extra")}
+            for i in range(group["rows"]):
+                e = {"id": cols["id"][i], "dt": cols["dt"][i], "amount": cols["amount"][i],
+                     "category": cols["category"][i], "desc": cols["desc"][i]}
+                if cols["tool"][i] is not None:
+                    e["tool"] = cols["tool"][i]
+                if cols["extra"][i]:
+                    e.update(cols["extra"][i])
+                yield e
+
+    def entries(self):
+        return list(self.iter_entries())
+
+_archive_years_cache = {}    # uid -> on-disk archive years, dropped by write_archive and ledger commits
+
+def _disk_archive_years(uid):
+    years = _archive_years_cache.get(uid)
+    if years is None:
+        prefix = f"{uid}expenses_"
+        years = set()
+        for fname in os.listdir(PLANNER_DIR):
+            stem, ext = os.path.splitext(fname)
+            if fname.startswith(prefix) and ext in (".col", ".json") and stem[len(prefix):].isdigit():
+                years.add(int(stem[len(prefix):]))
+        _archive_years_cache[uid] = years = frozenset(years)
+    return years
+
+def archive_years(uid):
+    """Years that have an expenses_{year} archive (columnar or legacy JSON) for this user."""
+    uid = str(uid)
+    prefix = f"{uid}expenses_"
+    years = set(_disk_archive_years(uid))
+    txn = getattr(_txn_local, "txn", None)
+    if txn is not None:
+        for path, data in txn.staged.items():
+            fname = os.path.basename(path)
+            if data is not None and fname.startswith(prefix) and fname.endswith(".col"):
+                years.add(int(fname[len(prefix):-4]))
+    return sorted(years)
+
+def _archive_reader(uid, year):
+    path = exp_archive_file(uid, year)
+    if not _json_exists(path):
+        return None
+    # archives are appended in place: the footer must not be read mid-append (the
+    # row groups it lists are never rewritten, so reading them later is safe)
+    with ledger_lock(uid).reading():
+        return ArchiveReader(path)
+
+def read_archived_expenses(uid, year):
+    reader = _archive_reader(uid, year)
+    if reader is not None:
+        return reader.entries()
+    return _read_json_list(legacy_archive_file(uid, year))
+
+def iter_archived_expenses(uid, year):
+    """Like read_archived_expenses, but one row group (or JSON element) at a time."""
+    reader = _archive_reader(uid, year)
+    if reader is not None:
+        return reader.iter_entries()
+    return _iter_json_list(legacy_archive_file(uid, year))
+
+def archive_month_summaries(uid, year):
+    """{month: totals row} for an archived year, straight from the footer when possible."""
+    reader = _archive_reader(uid, year)
+    if reader is not None:
+        return reader.footer["months"]
+    by_month = {}
+    for e in _iter_json_list(legacy_archive_file(uid, year)):
+        by_month.setdefault(_month_key(e["dt"]), []).append(e)
+    return {mk: _totals_row_for(rows) for mk, rows in by_month.items()}
+
+def read_archive_column(uid, year, name):
+    """One field of every archived entry of a year, without decoding the others."""
+    reader = _archive_reader(uid, year)
+    if reader is not None:
+        return reader.column(name)
+    return [e.get(name) for e in _iter_json_list(legacy_archive_file(uid, year))]
+
+def write_archive(uid, year, entries):
+    """Write a year's archive in the columnar format, retiring any legacy JSON file."""
+    path = exp_archive_file(uid, year)
+    data = encode_archive(entries)
+    txn = getattr(_txn_local, "txn", None)
+    if txn is not None:
+        txn.stage(path, data)
+        if _json_exists(legacy_archive_file(uid, year)):
+            txn.stage(legacy_archive_file(uid, year), None)
+        return
+    files = {path: data}
+    if os.path.exists(legacy_archive_file(uid, year)):
+        files[legacy_archive_file(uid, year)] = None
+    _apply_staged_files(files)
+    _archive_years_cache.pop(str(uid), None)
+
+def append_archive(uid, year, entries):
+    """
+    Add entries to a year's archive as new row groups plus a new footer,
+    written over the old footer; the existing groups are neither decoded nor
+    rewritten. Entries whose id is already archived are skipped. Legacy JSON
+    and version 1 archives are rewritten whole instead. Returns the number
+    of entries added.
+    """
+    reader = _archive_reader(uid, year)
+    if reader is None or reader.footer.get("version", 1) == 1 or _json_exists(legacy_archive_file(uid, year)):
+        existing = read_archived_expenses(uid, year)
+        if reader is not None and _json_exists(legacy_archive_file(uid, year)):
+            seen = {e["id"] for e in existing}
+            existing += [e for e in _read_json_list(legacy_archive_file(uid, year)) if e["id"] not in seen]
+        ids = {e["id"] for e in existing}
+        new = [e for e in entries if e["id"] not in ids]
+        if new:
+            write_archive(uid, year, existing + new)
+        return len(new)
+
+    ids = set(reader.column("id"))
+    new = [e for e in entries if e["id"] not in ids]
+    if not new:
+        return 0
+    footer = reader.footer
+    cats = list(footer["categories"])
+    cat_codes = {cat: i for i, cat in enumerate(cats)}
+    by_month = {}
+    for e in new:
+        cat = e.get("category", "other")
+        if cat not in cat_codes:
+            cat_codes[cat] = len(cats)
+            cats.append(cat)
+        by_month.setdefault(_month_key(e["dt"]), []).append(e)
+    months = dict(footer["months"])
+    for mk, rows in by_month.items():
+        months[mk] = _merge_totals_rows(months.get(mk, _empty_totals_row()), _totals_row_for(rows))
+
+    tail = bytearray()
+    groups = footer["groups"] + [_encode_group(new[i:i + ARCHIVE_GROUP_ROWS], cat_codes, tail, reader.footer_offset)
+                                 for i in range(0, len(new), ARCHIVE_GROUP_ROWS)]
+    footer_bytes = codec.dumpb({
+        "version": 2,
+        "rows": footer["rows"] + len(new),
+        "groups": groups,
+        "categories": cats,
+        "months": dict(sorted(months.items())),
+    })
+    tail += footer_bytes + struct.pack("<I", len(footer_bytes)) + ARCHIVE_MAGIC
+
+    path = exp_archive_file(uid, year)
+    txn = getattr(_txn_local, "txn", None)
+    if txn is not None:
+        txn.stage_write_at(path, reader.footer_offset, bytes(tail))
+    else:
+        with ledger_lock(uid).writing():
+            _apply_staged_files({path: write_at_record(reader.footer_offset, bytes(tail))})
+    return len(new)
+
+def migrate_legacy_archives(uid):
+    """Convert any expenses_{year}.json archive of this user to the columnar format."""
+    years = [y for y in archive_years(uid) if os.path.exists(legacy_archive_file(uid, y))]
+    if not years:
+        return 0
+    with ledger_lock(uid).writing(), ledger_txn(uid):
+        for year in years:
+            entries = read_archived_expenses(uid, year)
+            if os.path.exists(exp_archive_file(uid, year)):
+                # both formats present: merge, columnar copy wins on id clashes
+                seen = {e["id"] for e in entries}
+                entries += [e for e in _read_json_list(legacy_archive_file(uid, year)) if e["id"] not in seen]
+            write_archive(uid, year, entries)
+    log.info(f"Converted {len(years)} legacy archive(s) for {uid} to columnar format")
+    return len(years)
+
+# Per-user copies of views the ledger index now derives on the fly.
+LEGACY_VIEW_RE = re.compile(r"^\d+(large_expenses|notmy)\.json$")
+
+def remove_legacy_views():
+    """Delete the old {uid}large_expenses.json / {uid}notmy.json files so snapshots stop carrying them."""
+    names = [n for n in os.listdir(PLANNER_DIR) if LEGACY_VIEW_RE.match(n)]
+    for name in names:
+        os.remove(os.path.join(PLANNER_DIR, name))
+    if names:
+        log.info(f"Removed {len(names)} legacy large-expense/notmy file(s)")
+    return len(names)
+
+
+# ================= COMPACT ENTRIES =================
+# The ledger index keeps every expense of a user in memory, so its rows are
+# Entry records instead of dicts: the minute as an int, the amount in
+# kopecks, category and tool as small codes into shared tables. Reading
+# e["dt"], e["amount"], e.get("tool") still works, so formatters take
+# either form; to_dict() gives back the dict for writing.
+_code_lock = threading.Lock()
+_CATEGORY_NAMES = list(CAT_SLUGS)
+_CATEGORY_CODES = {name: i for i, name in enumerate(_CATEGORY_NAMES)}
+_TOOL_NAMES = [None] + list(KNOWN_TOOLS)
+_TOOL_CODES = {name: i for i, name in enumerate(_TOOL_NAMES)}
+
+def _code(codes, names, value):
+    code = codes.get(value)
+    if code is None:
+        with _code_lock:
+            code = codes.get(value)
+            if code is None:
+                code = codes[value] = len(names)
+                names.append(value)
+    return code
+
+def to_kopecks(amount):
+    return int(round(amount * 100))
+
+def from_kopecks(kopecks):
+    rubles, rest = divmod(kopecks, 100)
+    return kopecks / 100 if rest else rubles
+
+class Entry:
+    __slots__ = ("id", "minute", "kopecks", "cat_code", "tool_code", "desc", "extra")
+
+    _KEYS = ("id", "dt", "amount", "category", "desc", "tool")
+
+    @classmethod
+    def from_dict(cls, d):
+        e = cls()
+        e.id = d.get("id")
+        dt = d["dt"]
+        try:
+            e.minute = to_minute(datetime.fromisoformat(dt))
+        except ValueError:
+            e.minute = 0
+            dt = dt + "?"              # never canonical, so the text below is kept
+        e.kopecks = to_kopecks(d.get("amount", 0))
+        e.cat_code = _code(_CATEGORY_CODES, _CATEGORY_NAMES, d.get("category", "other"))
+        e.tool_code = _code(_TOOL_CODES, _TOOL_NAMES, d.get("tool"))
+        e.desc = d.get("desc")
+        extra = {k: v for k, v in d.items() if k not in ARCHIVE_KNOWN_KEYS}
+        if len(dt) != 16:
+            extra["dt"] = d["dt"]      # seconds, a bare date or garbage: keep the original text
+        e.extra = extra or None
+        return e
+
+    @property
+    def dt(self):
+        if self.extra and "dt" in self.extra:
+            return self.extra["dt"]
+        return minute_text(self.minute)
+
+    @property
+    def amount(self):
+        return from_kopecks(self.kopecks)
+
+    @property
+    def category(self):
+        return _CATEGORY_NAMES[self.cat_code]
+
+    @property
+    def tool(self):
+        return _TOOL_NAMES[self.tool_code]
+
+    def get(self, key, default=None):
+        if key in self._KEYS:
+            value = getattr(self, key)
+            return default if value is None else value
+        if self.extra:
+            return self.extra.get(key, default)
+        return default
+
+    def __getitem__(self, key):
+        value = self.get(key, KeyError)
+        if value is KeyError:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def to_dict(self):
+        d = {"id": self.id, "dt": self.dt, "amount": self.amount, "category": self.category}
+        if self.desc is not None:
+            d["desc"] = self.desc
+        if self.tool_code:
+            d["tool"] = self.tool
+        if self.extra:
+            d.update(self.extra)
+        return d
+
+    def __repr__(self):
+        return f"Entry({self.to_dict()!r})"
+
+def _month_range(month_key):
+    """(first minute, first minute of the next month) for "YYYY-MM"."""
+    start = datetime.strptime(month_key, "%Y-%m")
+    return to_minute(start), to_minute(safe_add_months(start, 1))
+
+
+# ================= LEDGER INDEX =================
+_ledger_index_cache = {}   # uid -> LedgerIndex
+
+def _ledger_signature(uid):
+    """
+    Cheap change detector for the live ledger plus every archive year: file
+    versions only, the archive years come from _archive_years_cache.
+    """
+    archives = [f(uid, y) for y in _disk_archive_years(uid) for f in (exp_archive_file, legacy_archive_file)]
+    return tuple((path, _file_version(path)) for path in [exp_file(uid)] + sorted(archives))
+
+class LedgerIndex:
+    """
+    Read-only indexes over one user's live + archived expenses.
+
+    Entries keep ledger order (archives by year, then the live file) as
+    compact Entry records. The amount and category indexes are built on
+    first use, and per-month views are materialized lazily and cached for
+    the life of the index.
+    """
+
+    def __init__(self, signature, entries, live_count):
+        self.signature = signature
+        self.entries = entries
+        self.live = entries[len(entries) - live_count:]
+        self.by_id = {e.id: e for e in entries}
+        self._kopecks = None
+        self._by_amount = None
+        self._by_category = None
+        self._views = {}
+
+    def _view(self, key, build):
+        if key not in self._views:
+            self._views[key] = build()
+        return self._views[key]
+
+    @staticmethod
+    def _in_month(entries, month_key):
+        lo, hi = _month_range(month_key)
+        return [e for e in entries if lo <= e.minute < hi]
+
+    def month(self, month_key):
+        return self._view(("month", month_key), lambda: self._in_month(self.entries, month_key))
+
+    def large(self, threshold, month_key=None):
+        """Entries with amount > threshold, oldest first."""
+        if self._by_amount is None:
+            self._by_amount = sorted(self.entries, key=lambda e: e.kopecks)
+            self._kopecks = [e.kopecks for e in self._by_amount]
+        def build():
+            hits = self._by_amount[bisect.bisect_right(self._kopecks, to_kopecks(threshold)):]
+            if month_key:
+                hits = self._in_month(hits, month_key)
+            return sorted(hits, key=lambda e: e.minute)
+        return self._view(("large", threshold, month_key), build)
+
+    def category(self, cat, month_key=None):
+        if self._by_category is None:
+            self._by_category = {}
+            for e in self.entries:
+                self._by_category.setdefault(e.cat_code, []).append(e)
+        def build():
+            hits = self._by_category.get(_CATEGORY_CODES.get(cat), [])
+            if month_key:
+                hits = self._in_month(hits, month_key)
+            return hits
+        return self._view(("category", cat, month_key), build)
+
+def ledger_index(uid):
+    """Return the cached LedgerIndex for uid, rebuilding it if any ledger file changed."""
+    uid = str(uid)
+    by_id = {}
+    with ledger_lock(uid).reading():       # the signature and the files it describes, together
+        sig = _ledger_signature(uid)
+        cached = _ledger_index_cache.get(uid)
+        if cached is not None and cached.signature == sig:
+            return cached
+        for year in archive_years(uid):
+            for e in read_archived_expenses(uid, year):
+                by_id[e.get("id")] = e
+        live = read_expenses(uid)
+    for e in live:
+        by_id.pop(e.get("id"), None)
+        by_id[e.get("id")] = e
+    index = LedgerIndex(sig, [Entry.from_dict(e) for e in by_id.values()], len(live))
+    if getattr(_txn_local, "txn", None) is None:       # staged data may still be rolled back
+        _ledger_index_cache[uid] = index
+    return index
+
+def _drop_ledger_caches(uid):
+    _ledger_index_cache.pop(uid, None)
+    _archive_years_cache.pop(uid, None)
+
+commit_hooks.append(_drop_ledger_caches)
+
+def invalidate_user_caches(uid):
+    """Forget everything cached for uid, e.g. after its files were replaced wholesale."""
+    uid = str(uid)
+    _drop_ledger_caches(uid)
+    _cashflow_report_cache.pop(uid, None)
+    with _reconcile_lock:
+        _reconcile_queue.pop(uid, None)
+
+def large_expenses(uid, threshold, month_key=None):
+    """Expenses with amount > threshold (optionally in one month), oldest first."""
+    return ledger_index(uid).large(threshold, month_key)
+
+def notmy_expenses(uid, month_key=None):
+    return ledger_index(uid).category("notmy", month_key)
+
+def get_large_threshold(uid):
+    with state_lock:
+        return user(uid).get("large_threshold", LARGE_EXPENSE_LIMIT)
+
+def set_large_threshold(uid, threshold):
+    with state_lock:
+        user(uid)["large_threshold"] = threshold
+        save_states()
+
+
+# ================= NOTMY VIEW =================
+def format_notmy_for_month(uid, month_key):
+    """Return formatted notmy entries for the given month, or empty string."""
+    month_entries = notmy_expenses(uid, month_key)
+    if not month_entries:
+        return ""
+    total = sum(e["amount"] for e in month_entries)
+    lines = [f"🚫 Not-my expenses for {month_key} — {total:,.0f}:"]
+    for e in month_entries:
+        lines.append(format_entry(e))
+    return "\n".join(lines)
+
+
+# ================= CASHFLOW =================
+CASHFLOW_REPORT_MONTHS = 6
+_cashflow_report_cache = {}
+
+def cashflow_file(uid):
+    return os.path.join(PLANNER_DIR, f"{uid}cashflow.json")
+
+def read_cashflow(uid):
+    """Return the per-month cashflow table, building it from the totals files on first use."""
+    table = _read_json(cashflow_file(uid), None)
+    if table is None:
+        with ledger_lock(uid).writing(), ledger_txn(uid):
+            table = _read_json(cashflow_file(uid), None)     # built by another thread meanwhile?
+            if table is None:
+                table = rebuild_cashflow(uid)
+    return table
+
+def _save_cashflow(uid, table):
+    _write_json(cashflow_file(uid), table)
+    _cashflow_report_cache.pop(str(uid), None)
+
+def _roll_cashflow(table, from_mk=""):
+    """Recompute net and running balance for every month from from_mk onwards."""
+    balance = 0.0
+    for mk in sorted(table):
+        row = table[mk]
+        if mk < from_mk:
+            balance = row.get("balance", 0.0)
+            continue
+        row["net"] = round(row.get("income", 0) - row.get("expense", 0), 2)
+        balance = round(balance + row["net"], 2)
+        row["balance"] = balance
+
+def rebuild_cashflow(uid):
+    """Rebuild the cashflow table from the income and expense totals files."""
+    with ledger_lock(uid).writing(), ledger_txn(uid):     # no commit lands between the reads and the write
+        table = {}
+        for mk, row in read_inc_totals(uid).items():
+            table.setdefault(mk, {"income": 0.0, "expense": 0.0})["income"] = row.get("total", 0)
+        for mk, row in read_totals(uid).items():
+            table.setdefault(mk, {"income": 0.0, "expense": 0.0})["expense"] = row.get("total", 0)
+        _roll_cashflow(table)
+        _save_cashflow(uid, table)
+    return table
+
+def _apply_cashflow(uid, mk, income=0.0, expense=0.0):
+    """Apply an income/expense delta to one month. Call after the totals files are updated."""
+    _apply_cashflow_deltas(uid, {mk: (income, expense)})
+
+def _apply_cashflow_deltas(uid, deltas):
+    """Apply {month: (income delta, expense delta)} and re-roll balances once."""
+    if not deltas:
+        return
+    if not _json_exists(cashflow_file(uid)):
+        rebuild_cashflow(uid)
+        return
+    table = read_cashflow(uid)
+    for mk, (income, expense) in deltas.items():
+        row = table.setdefault(mk, {"income": 0.0, "expense": 0.0})
+        row["income"]  = round(row.get("income", 0)  + income, 2)
+        row["expense"] = round(row.get("expense", 0) + expense, 2)
+    _roll_cashflow(table, min(deltas))
+    _save_cashflow(uid, table)
+
+def _set_cashflow_month(uid, mk, income=None, expense=None):
+    """Overwrite one month's income and/or expense with known-good values."""
+    table = read_cashflow(uid)
+    row = table.setdefault(mk, {"income": 0.0, "expense": 0.0})
+    if income is not None:
+        row["income"] = round(income, 2)
+    if expense is not None:
+        row["expense"] = round(expense, 2)
+    _roll_cashflow(table, mk)
+    _save_cashflow(uid, table)
+
+def format_cashflow_report(uid, months=CASHFLOW_REPORT_MONTHS):
+    """Income vs expense for the last `months` months; cached until the table changes."""
+    uid = str(uid)
+    cached = _cashflow_report_cache.get(uid, {}).get(months)
+    if cached is not None:
+        return cached
+    table = read_cashflow(uid)
+    if not table:
+        report = "No income or expense history yet."
+    else:
+        lines = ["💹 Cashflow (income / expense / net / balance):"]
+        for mk in sorted(table)[-months:]:
+            row = table[mk]
+            lines.append(
+                f"  {mk}  +{row.get('income', 0):,.0f}  -{row.get('expense', 0):,.0f}"
+                f"  = {row.get('net', 0):+,.0f}  Σ {row.get('balance', 0):,.0f}"
+            )
+        report = "\n".join(lines)
+    _cashflow_report_cache.setdefault(uid, {})[months] = report
+    return report
+
+# ================= EXPENSE IMPORT =================
+# Bulk import of a CSV file or a bank statement export. Rows are streamed
+# through the mapping rules below, deduplicated against the ledger (live and
+# archived) and appended with one ledger write and one aggregate update.
+#
+#   python bot.py import <uid> <file.csv> [--signed]
+#   /import in the bot, then send the .csv as a document
+#
+# --signed: the statement has one signed amount column, debits negative and
+# credits positive; credits are skipped. Without it every amount is an expense.
+
+IMPORT_DATE_COLUMNS   = ("date", "datetime", "transaction date", "operation date", "дата", "дата операции")
+IMPORT_AMOUNT_COLUMNS = ("amount", "sum", "сумма", "сумма операции")
+IMPORT_DEBIT_COLUMNS  = ("debit", "расход", "списание")
+IMPORT_DESC_COLUMNS   = ("description", "desc", "merchant", "details", "описание", "назначение платежа")
+IMPORT_CAT_COLUMNS    = ("category", "категория")
+IMPORT_TOOL_COLUMNS   = ("tool", "card", "account", "карта", "счет")
+
+# First matching keyword (case-insensitive substring of the description or
+# the file's own category) wins; anything else lands in "other".
+IMPORT_CATEGORY_RULES = [
+    ("taxi", "transport"), ("uber", "transport"), ("metro", "transport"), ("такси", "transport"),
+    ("azs", "transport"), ("fuel", "transport"), ("азс", "transport"),
+    ("cafe", "food"), ("restaurant", "food"), ("coffee", "food"), ("кафе", "food"),
+    ("ресторан", "food"), ("продукты", "food"), ("supermarket", "food"),
+    ("pharmacy", "health"), ("аптека", "health"), ("clinic", "health"),
+    ("airline", "travel"), ("hotel", "travel"), ("авиа", "travel"), ("отель", "travel"),
+    ("rent", "housing"), ("аренда", "housing"), ("жкх", "bills"), ("mobile", "bills"),
+    ("связь", "bills"), ("internet", "bills"), ("cinema", "fun"), ("кино", "fun"),
+    ("steam", "fun"), ("ozon", "shop"), ("wildberries", "shop"), ("market", "shop"),
+    ("сбп", "sbp"), ("sbp", "sbp"), ("перевод", "transfer"), ("transfer", "transfer"),
+    ("course", "education"), ("курс", "education"), ("gift", "gifts"), ("подарок", "gifts"),
+]
+IMPORT_TOOL_RULES = [
+    ("halva", "hal"), ("халва", "hal"), ("sber", "sb"), ("сбер", "sb"),
+    ("renaissance", "ren"), ("ренессанс", "ren"), ("ozon", "oz"), ("yandex", "ya"),
+    ("яндекс", "ya"), ("cash", "cash"), ("налич", "cash"),
+]
+IMPORT_DATE_FORMATS = (
+    "%Y-%m-%dT%H:%M:%S", "%Y-%m-%dT%H:%M", "%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d",
+    "%d.%m.%Y %H:%M:%S", "%d.%m.%Y %H:%M", "%d.%m.%Y", "%d/%m/%Y %H:%M", "%d/%m/%Y",
+)
+
+def _import_column(header, names):
+    for i, h in enumerate(header):
+        if h.strip().lower() in names:
+            return i
+    return None
+
+def _import_amount(raw):
+    """Parse '1 234,56', '-1234.56', '1,234.56 RUB' into a float (None if not a number)."""
+    s = re.sub(r"[^\d,.\-+]", "", (raw or "").replace("−", "-"))
+    if "," in s and "." in s:
+        s = s.replace(",", "")
+    else:
+        s = s.replace(",", ".")
+    try:
+        return float(s)
+    except ValueError:
+        return None
+
+def _import_date(raw):
+    raw = (raw or "").strip()
+    for fmt in IMPORT_DATE_FORMATS:
+        try:
+            return datetime.strptime(raw, fmt)
+        except ValueError:
+            continue
+    return None
+
+def _import_match(rules, *texts):
+    hay = " ".join(t for t in texts if t).lower()
+    for keyword, value in rules:
+        if keyword in hay:
+            return value
+    return None
+
+def _import_key(entry):
+    """Duplicate key: same minute, amount and description means the same purchase."""
+    return (entry["dt"][:16], round(entry["amount"], 2), (entry.get("desc") or "").strip().lower())
+
+def iter_import_rows(f, signed=False):
+    """
+    Stream (entry, None) for each importable row of a CSV file object, or
+    (None, reason) for rows that are skipped. Entries have no id yet.
+    """
+    head = f.read(4096)
+    try:
+        dialect = csv.Sniffer().sniff(head, delimiters=",;\t")
+    except csv.Error:
+        dialect = csv.excel
+    rows = csv.reader(itertools.chain(io.StringIO(head + f.readline()), f), dialect)
+    header = next(rows, None) or []
+    col_date   = _import_column(header, IMPORT_DATE_COLUMNS)
+    col_amount = _import_column(header, IMPORT_AMOUNT_COLUMNS)
+    col_debit  = _import_column(header, IMPORT_DEBIT_COLUMNS)
+    col_desc   = _import_column(header, IMPORT_DESC_COLUMNS)
+    col_cat    = _import_column(header, IMPORT_CAT_COLUMNS)
+    col_tool   = _import_column(header, IMPORT_TOOL_COLUMNS)
+    col_kind   = _import_column(header, ("kind",))   # our own CSV export
+    if col_date is None or (col_amount is None and col_debit is None):
+        raise ValueError("no date/amount columns in the header")
+
+    def cell(row, col):
+        return row[col].strip() if col is not None and col < len(row) else ""
+
+    for row in rows:
+        if not any(c.strip() for c in row):
+            continue
+        if cell(row, col_kind) not in ("", "expense"):
+            yield None, "kind"
+            continue
+        dt = _import_date(cell(row, col_date))
+        if dt is None:
+            yield None, "date"
+            continue
+        if cell(row, col_debit):
+            amount = _import_amount(cell(row, col_debit))
+        else:
+            amount = _import_amount(cell(row, col_amount))
+            if amount is not None and signed:
+                amount = -amount if amount < 0 else None   # credits are not expenses
+        if not amount:
+            yield None, "amount"
+            continue
+        desc = cell(row, col_desc)
+        file_cat = cell(row, col_cat)
+        if file_cat.lower() in CAT_SLUGS:
+            category = file_cat.lower()
+        else:
+            category = _import_match(IMPORT_CATEGORY_RULES, desc, file_cat) or "other"
+        entry = {
+            "dt": dt.strftime("%Y-%m-%dT%H:%M"),
+            "amount": round(abs(amount), 2),
+            "category": category,
+            "desc": desc,
+        }
+        raw_tool = cell(row, col_tool).lower()
+        tool = raw_tool if raw_tool in KNOWN_TOOLS else _import_match(IMPORT_TOOL_RULES, raw_tool, desc)
+        if tool:
+            entry["tool"] = tool
+        yield entry, None
+
+def _import_encoding(path):
+    """Bank exports are either UTF-8 (often with a BOM) or cp1251."""
+    with open(path, "rb") as f:
+        sample = f.read(65536)
+    try:
+        sample.decode("utf-8")
+        return "utf-8-sig"
+    except UnicodeDecodeError as e:
+        # a multi-byte character cut at the sample boundary is still UTF-8
+        truncated = len(sample) == 65536 and e.start >= len(sample) - 3
+        return "utf-8-sig" if truncated else "cp1251"
+
+def import_expenses(uid, path, signed=False):
+    """
+    Import a CSV file into the user's expense ledger. Returns a summary dict
+    with added/duplicates/skipped counts and the months touched.
+    """
+    uid = str(uid)
+    summary = {"added": 0, "duplicates": 0, "skipped": 0, "months": []}
+    with ledger_lock(uid).writing():
+        seen = {_import_key(e) for e in ledger_index(uid).entries}
+        new = []
+        with open(path, "r", encoding=_import_encoding(path), errors="replace", newline="") as f:
+            for entry, _reason in iter_import_rows(f, signed):
+                if entry is None:
+                    summary["skipped"] += 1
+                    continue
+                key = _import_key(entry)
+                if key in seen:
+                    summary["duplicates"] += 1
+                    continue
+                seen.add(key)
+                new.append(entry)
+        if not new:
+            return summary
+
+        first = reserve_exp_ids(uid, len(new))
+        for n, entry in enumerate(new):
+            entry["id"] = f"e{first + n}"
+        with ledger_txn(uid):
+            entries = read_expenses(uid)
+            entries.extend(new)
+            entries.sort(key=lambda e: e["dt"])
+            write_expenses(uid, entries)
+            _apply_to_totals(uid, new, 1)
+            deltas = {}
+            for e in new:
+                mk = _month_key(e["dt"])
+                deltas[mk] = (0.0, deltas.get(mk, (0.0, 0.0))[1] + e["amount"])
+            _apply_cashflow_deltas(uid, deltas)
+    summary["added"] = len(new)
+    summary["months"] = sorted(deltas)
+    log.info(f"Imported {len(new)} expenses for {uid} from {path} "
+             f"({summary['duplicates']} duplicates, {summary['skipped']} skipped)")
+    return summary
+
+def format_import_summary(summary):
+    text = (f"📥 Imported {summary['added']} expense(s); "
+            f"skipped {summary['duplicates']} duplicate(s) and {summary['skipped']} other row(s) "
+            f"(credits, blank or unreadable dates/amounts).")
+    if summary["months"]:
+        text += "\nMonths: " + ", ".join(summary["months"])
+    return text
+
+def _message_doc(message_id):
+    """The first document attached to a message, or None."""
+    msg = vk.messages.getById(message_ids=message_id)["items"][0]
+    for att in msg.get("attachments") or []:
+        if att.get("type") == "doc":
+            return att["doc"]
+    return None
+
+def import_doc(message_id):
+    """The CSV document attached to a message, or None."""
+    doc = _message_doc(message_id)
+    if not doc or doc.get("ext", "").lower() not in ("csv", "txt"):
+        return None
+    return doc
+
+def import_from_doc(uid, doc, signed=False):
+    """Download a VK document and import it; returns the import summary."""
+    fd, tmp = tempfile.mkstemp(suffix=".csv", dir=PLANNER_DIR)
+    try:
+        with os.fdopen(fd, "wb") as out, urllib.request.urlopen(doc["url"], timeout=60) as resp:
+            shutil.copyfileobj(resp, out)
+        return import_expenses(uid, tmp, signed)
+    finally:
+        os.remove(tmp)
+
+def _import_in_background(uid, doc, signed):
+    try:
+        summary = import_from_doc(uid, doc, signed)
+        send(uid, format_import_summary(summary), main_menu_kb())
+    except Exception as e:
+        log.error(f"Import failed for {uid}: {e}")
+        send(uid, f"❌ Import failed: {e}", main_menu_kb())
+
+def cli_import(argv):
+    """python bot.py import <uid> <file.csv> [--signed]"""
+    args = [a for a in argv if not a.startswith("--")]
+    if len(args) != 2:
+        print("usage: python bot.py import <uid> <file.csv> [--signed]")
+        return 2
+    uid, path = args
+    try:
+        summary = import_expenses(uid, path, signed="--signed" in argv)
+    except (OSError, ValueError) as e:
+        print(f"Import failed: {e}")
+        return 1
+    print(format_import_summary(summary))
+    return 0
+
+# ================= QUICK ENTRY =================
+# One-message expenses and income, typed at a menu:
+#   -450 food coffee gp yesterday     → expense 450, food, "coffee", tool gp, yesterday
+#   -90 fun cinema 3.10               → expense 90, fun, "cinema", on 3 October
+#   +12000 salary                     → income 12000, "salary", today
+# Words are matched against categories (slug or emoji), KNOWN_TOOLS and the
+# date shortcuts below; whatever is left becomes the description. A short
+# d.m date counts only as the last word or after "@" ("-300 @1.5 taxi"), so
+# "-200 coffee 1.5 kg" keeps "1.5" in the description; it means the latest
+# such day not after today, so 29.02 typed in 2025 is 2024-02-29. An entry
+# for an earlier day is stored at the current time of day on that day, so
+# it sorts among that day's entries by when it was typed.
+
+QUICK_ENTRY_RE = re.compile(r"^([+-])\s*(\d+(?:[.,]\d{1,2})?)(?:\s+(.*))?$", re.S)
+QUICK_DAY_OFFSETS = {"today": 0, "сегодня": 0, "yesterday": 1, "вчера": 1, "позавчера": 2}
+QUICK_DATE_MARKER = "@"
+QUICK_SHORT_DATE_RE = re.compile(r"^(\d{1,2})\.(\d{1,2})$")
+QUICK_CATEGORY_WORDS = {}
+for _emoji, _slug in CATEGORIES:
+    QUICK_CATEGORY_WORDS[_slug] = _slug
+    QUICK_CATEGORY_WORDS[_emoji] = _slug
+
+def _quick_date(word, today, trailing=False):
+    """The date `word` names, or None; a short d.m date needs the marker unless trailing."""
+    word = word.lower()
+    if word in QUICK_DAY_OFFSETS:
+        return today - timedelta(days=QUICK_DAY_OFFSETS[word])
+    marked = word.startswith(QUICK_DATE_MARKER)
+    if marked:
+        word = word[len(QUICK_DATE_MARKER):]
+    for fmt in ("%Y-%m-%d", "%d.%m.%Y"):
+        try:
+            return datetime.strptime(word, fmt).date()
+        except ValueError:
+            pass
+    m = QUICK_SHORT_DATE_RE.match(word) if marked or trailing else None
+    if m is None:
+        return None
+    # not strptime("%d.%m"): that parses in 1900, which has no 29.02
+    day, month = int(m.group(1)), int(m.group(2))
+    for year in range(today.year, today.year - 8, -1):     # 31.12 typed in January means last year
+        try:
+            d = datetime(year, month, day).date()
+        except ValueError:
+            continue
+        if d <= today:
+            return d
+    return None
+
+def parse_quick_entry(text, now=None):
+    """
+    Parse a quick-entry message. Returns None if `text` is not one, else a
+    dict with kind ("expense"/"income"), amount, category, tool, desc and dt.
+    """
+    m = QUICK_ENTRY_RE.match(text.strip())
+    if not m:
+        return None
+    sign, raw_amount, rest = m.groups()
+    try:
+        amount = float(raw_amount.replace(",", "."))
+    except ValueError:
+        return None
+    if amount <= 0:
+        return None
+    now = now or datetime.now()
+    day, category, tool, words = None, None, None, []
+    tokens = (rest or "").split()
+    for i, word in enumerate(tokens):
+        low = word.lower()
+        when = _quick_date(low, now.date(), trailing=i == len(tokens) - 1) if day is None else None
+        if when is not None:
+            day = when
+        elif sign == "-" and category is None and low in QUICK_CATEGORY_WORDS:
+            category = QUICK_CATEGORY_WORDS[low]
+        elif sign == "-" and tool is None and low in KNOWN_TOOLS:
+            tool = low
+        else:
+            words.append(word)
+    dt = now.replace(second=0, microsecond=0)
+    if day is not None:
+        dt = datetime.combine(day, dt.time())
+    return {
+        "kind": "expense" if sign == "-" else "income",
+        "amount": int(amount) if amount.is_integer() else amount,
+        "category": category or "other",
+        "tool": tool,
+        "desc": " ".join(words),
+        "dt": dt,
+    }
+
+def save_quick_entry(uid, q):
+    """Save a parsed quick entry; returns the confirmation text."""
+    mk = q["dt"].strftime("%Y-%m")
+    note_line = f" 📝 {q['desc']}" if q["desc"] else ""
+    if q["kind"] == "income":
+        save_income(uid, q["amount"], q["desc"], dt=q["dt"])
+        month_tot = read_inc_totals(uid).get(mk, {}).get("total", 0)
+        return f"✅ +{q['amount']:,.0f}{note_line}\n📈 {mk} total: {month_tot:,.0f}"
+    save_expense_with_transfer(uid, q["amount"], q["category"], q["desc"], dt=q["dt"], tool=q["tool"])
+    inc_note = "\n📈 Auto-added to income" if q["category"] == "transfer" else ""
+    tool_str = f"  → {q['tool'].upper()}" if q["tool"] else ""
+    month_tot = read_totals(uid).get(mk, {}).get("total", 0)
+    return (f"✅ {_cat_emoji(q['category'])} {q['amount']:,.0f}{note_line}{tool_str}\n"
+            f"📊 {mk} total: {month_tot:,.0f}{inc_note}")
+
+# ================= EXPORT =================
+# Streams a user's ledgers and planner out as CSV, JSONL or iCalendar. Every
+# source is read incrementally (JSON arrays element by element, text files
+# line by line), so memory stays flat however long the history is.
+#
+#   python bot.py export <uid> <csv|jsonl|ics> [out_file]
+#   /export [csv|jsonl|ics] in the bot → sent back as a VK document
+
+EXPORT_DIR = "exports"
+EXPORT_FORMATS = ("csv", "jsonl", "ics")
+EXPORT_CSV_COLUMNS = ["kind", "id", "date", "amount", "category", "tool", "description"]
+
+def iter_text_lines(path):
+    if not os.path.exists(path):
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if line.strip():
+                yield line
+
+def iter_expense_records(uid):
+    """Archived years oldest first, then the live ledger."""
+    for year in archive_years(uid):
+        yield from iter_archived_expenses(uid, year)
+    yield from _iter_json_list(exp_file(uid))
+
+def iter_export_rows(uid):
+    """(kind, record) for everything a user owns, in export order."""
+    for e in iter_expense_records(uid):
+        yield "expense", e
+    for e in _iter_json_list(inc_file(uid)):
+        yield "income", e
+    for line in iter_text_lines(planner(uid)):
+        yield "event", line
+    for line in iter_text_lines(done_file(uid)):
+        yield "done", line
+
+def export_csv(uid, out):
+    """Ledger rows only; the header is one import_expenses understands."""
+    w = csv.writer(out)
+    w.writerow(EXPORT_CSV_COLUMNS)
+    count = 0
+    for kind, e in iter_export_rows(uid):
+        if kind not in ("expense", "income"):
+            continue
+        w.writerow([kind, e.get("id", ""), e.get("dt", ""), e.get("amount", ""),
+                    e.get("category", ""), e.get("tool", ""), e.get("desc", "")])
+        count += 1
+    return count
+
+def export_jsonl(uid, out):
+    count = 0
+    for kind, rec in iter_export_rows(uid):
+        rec = {"kind": kind, **rec} if isinstance(rec, dict) else {"kind": kind, "line": rec}
+        out.write(codec.dumps(rec) + "\n")
+        count += 1
+    return count
+
+def _ics_text(value):
+    return (value.replace("\\", "\\\\").replace(";", "\\;")
+                 .replace(",", "\\,").replace("\n", "\\n"))
+
+def _ics_line(out, line):
+    """Write one content line, folded at 75 octets (RFC 5545 3.1) without splitting a character."""
+    chunk, size = [], 0
+    for ch in line:
+        n = len(ch.encode("utf-8"))
+        if size + n > 75:
+            out.write("".join(chunk) + "\r\n")
+            chunk, size = [" "], 1
+        chunk.append(ch)
+        size += n
+    out.write("".join(chunk) + "\r\n")
+
+def export_ics(uid, out):
+    """Planned and completed events as VEVENTs (floating local time)."""
+    stamp = time.strftime("%Y%m%dT%H%M%SZ", time.gmtime())
+    out.write("BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:-//vkbotprivate//planner//EN\r\n")
+    count = 0
+    for kind, line in iter_export_rows(uid):
+        if kind not in ("event", "done"):
+            continue
+        parsed = parse_event_line(line)
+        if not parsed:
+            continue
+        dt, desc, hashtag, uid_event, _ = parsed
+        out.write("BEGIN:VEVENT\r\n")
+        _ics_line(out, f"UID:{uid_event or line_key(line)}-{dt.strftime('%Y%m%dT%H%M')}@{uid}")
+        out.write(f"DTSTAMP:{stamp}\r\n")
+        out.write(f"DTSTART:{dt.strftime('%Y%m%dT%H%M%S')}\r\n")
+        _ics_line(out, f"SUMMARY:{_ics_text(desc or line)}")
+        cats = [hashtag.lstrip("#")] if hashtag else []
+        if kind == "done":
+            cats.append("done")
+        if cats:
+            _ics_line(out, f"CATEGORIES:{','.join(_ics_text(c) for c in cats)}")
+        out.write("END:VEVENT\r\n")
+        count += 1
+    out.write("END:VCALENDAR\r\n")
+    return count
+
+_EXPORTERS = {"csv": export_csv, "jsonl": export_jsonl, "ics": export_ics}
+
+def export_user(uid, fmt, path=None):
+    """Write the export to `path` (default a new exports/{uid}_{timestamp}_*.{fmt}); returns (path, rows)."""
+    uid = str(uid)
+    if path is None:
+        # exports run in background threads; two in the same second must not share a file
+        os.makedirs(EXPORT_DIR, exist_ok=True)
+        fd, path = tempfile.mkstemp(prefix=f"{uid}_{datetime.now().strftime('%Y%m%d_%H%M%S')}_",
+                                    suffix=f".{fmt}", dir=EXPORT_DIR)
+        os.close(fd)
+    newline = "" if fmt in ("csv", "ics") else None
+    with open(path, "w", encoding="utf-8", newline=newline) as out:
+        rows = _EXPORTERS[fmt](uid, out)
+    log.info(f"Exported {rows} {fmt} rows for {uid} to {path}")
+    return path, rows
+
+def send_export(uid, fmt):
+    """Build the export and send it back as a VK document."""
+    path, rows = export_user(uid, fmt)
+    try:
+        attachment = upload_document(path, int(uid), title=os.path.basename(path))
+        send(uid, f"📤 Export ({fmt}, {rows} rows)", main_menu_kb(), attachment=attachment)
+    finally:
+        os.remove(path)
+
+def _export_in_background(uid, fmt):
+    try:
+        send_export(uid, fmt)
+    except Exception as e:
+        log.error(f"Export failed for {uid}: {e}")
+        send(uid, f"❌ Export failed: {e}", main_menu_kb())
+
+def cli_export(argv):
+    """python bot.py export <uid> <csv|jsonl|ics> [out_file]"""
+    if len(argv) not in (2, 3) or argv[1] not in EXPORT_FORMATS:
+        print("usage: python bot.py export <uid> <csv|jsonl|ics> [out_file]")
+        return 2
+    path, rows = export_user(argv[0], argv[1], argv[2] if len(argv) == 3 else None)
+    print(f"{rows} rows → {path}")
+    return 0
+
+
+# ================= EXPENSE ARCHIVE WORKER =================
+def archive_user_expenses(uid, cutoff):
+    """Move ledger entries dated before `cutoff` into the per-year archive files."""
+    with ledger_lock(uid).writing(), ledger_txn(uid):
+        entries = read_expenses(uid)
+        keep, archive = [], {}
+        for e in entries:
+            try:
+                e_date = datetime.fromisoformat(e["dt"]).date()
+            except Exception:
+                keep.append(e)
+                continue
+            if e_date < cutoff:
+                archive.setdefault(e_date.year, []).append(e)
+            else:
+                keep.append(e)
+        if not archive:
+            return 0
+        moved = 0
+        for yr, archived_entries in archive.items():
+            added = append_archive(uid, yr, archived_entries)
+            moved += added
+            log.info(f"Archived {added} expense(s) for user {uid} → {yr}")
+        write_expenses(uid, keep)
+        return moved
+
+def archive_cutoff(day):
+    """First day of the month EXPENSE_ARCHIVE_MONTHS before `day`; older entries get archived."""
+    cutoff_month = day.month - EXPENSE_ARCHIVE_MONTHS
+    cutoff_year  = day.year
+    while cutoff_month <= 0:
+        cutoff_month += 12
+        cutoff_year  -= 1
+    return datetime(cutoff_year, cutoff_month, 1).date()
@@ -0,0 +1,218 @@
+"""
+Reader/writer locks per user and store.
+
+A handler adding an expense and the nightly archive job both rewrite a
+user's ledger, while reminder workers only read plan.txt. Each store of
+each user (a ledger, a plan.txt, ...) gets its own RWLock: many readers or
+one writer, and users never wait on each other.
+
+    lock = locks.get("12ledger")
+    with lock.reading(): ...
+    with lock.writing(): ...
+
+Writers are preferred, so a steady stream of readers can't starve a write.
+The locks are reentrant like the RLocks they replace: a thread holding the
+write side may take either side again, and a reader may read again.
+Upgrading a read to a write raises RuntimeError instead of deadlocking.
+
+Environment:
+    BOT_FILE_LOCKS   "1" also backs every lock with an fcntl.flock on
+                     locks/<name>.lock, shared for readers and exclusive for
+                     writers, so readers in other processes (`python bot.py
+                     export`, say) never see a half-done write of the bot.
+                     Where fcntl is missing the locks stay in-process.
+
+Only one process may write a data directory: states.json and the id
+counters in it live in that process's memory. claim_data_dir() takes
+locks/owner.lock for the life of the process; the bot claims it at startup
+and `python bot.py import` refuses to run while the bot holds it.
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+LOCK_DIR = "locks"
+FILE_LOCKS = os.environ.get("BOT_FILE_LOCKS") == "1" and fcntl is not None
+
+_registry = {}                  # name -> RWLock
+_registry_lock = threading.Lock()
+
+
+class RWLock:
+    """Many readers or one (reentrant) writer, writers first."""
+
+    def __init__(self, name, path=None, stats=None):
+        self.name = name
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = {}          # thread ident -> read depth
+        self._writer = None         # ident of the writing thread
+        self._write_depth = 0
+        self._waiting_writers = 0
+        self._path = path           # flock file, when file locks are on
+        self._fd = None
+        self._fd_mode = None        # fcntl.LOCK_SH / LOCK_EX currently held on _fd
+        self._flock_mutex = threading.Lock()
+        self._stats = stats         # metrics.LockStats or None
+
+    # ----- cross-process side -----
+    def _sync_flock(self):
+        """
+        Make the flock match the in-process holders: exclusive for a writer,
+        shared for readers, none when idle. Runs after _cond is released, so
+        waiting on another process never blocks threads that only need the
+        in-process state; the mutex keeps the open/flock/close steps in order.
+        """
+        if self._path is None:
+            return
+        with self._flock_mutex:
+            with self._cond:
+                if self._writer is not None:
+                    want = fcntl.LOCK_EX
+                elif self._readers:
+                    want = fcntl.LOCK_SH
+                else:
+                    want = None
+            if want is None:
+                if self._fd is not None:
+                    os.close(self._fd)      # closing drops the flock
+                    self._fd = self._fd_mode = None
+                return
+            if self._fd is None:
+                os.makedirs(os.path.dirname(self._path), exist_ok=True)
+                self._fd = os.open(self._path, os.O_RDWR | os.O_CREAT, 0o666)
+            if self._fd_mode != want:
+                fcntl.flock(self._fd, want)     # also converts EX -> SH on a downgrade
+                self._fd_mode = want
+
+    def _note(self, waited):
+        if self._stats is not None:
+            self._stats.note(waited)
+
+    # ----- read side -----
+    def acquire_read(self):
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer == me or me in self._readers:
+                self._readers[me] = self._readers.get(me, 0) + 1
+                return
+            waited = None
+            if self._writer is not None or self._waiting_writers:
+                t0 = time.perf_counter()
+                while self._writer is not None or self._waiting_writers:
+                    self._cond.wait()
+                waited = time.perf_counter() - t0
+            self._readers[me] = 1
+        try:
+            self._sync_flock()
+        except BaseException:
+            self.release_read()
+            raise
+        self._note(waited)
+
+    def release_read(self):
+        me = threading.get_ident()
+        with self._cond:
+            depth = self._readers[me] - 1
+            if depth:
+                self._readers[me] = depth
+                return
+            del self._readers[me]
+            if self._readers or self._writer is not None:
+                return
+            self._cond.notify_all()
+        self._sync_flock()
+
+    # ----- write side -----
+    def acquire_write(self):
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer == me:
+                self._write_depth += 1
+                return
+            if me in self._readers:
+                raise RuntimeError(f"lock {self.name}: can't upgrade a read to a write")
+            waited = None
+            if self._writer is not None or self._readers:
+                self._waiting_writers += 1
+                t0 = time.perf_counter()
+                try:
+                    while self._writer is not None or self._readers:
+                        self._cond.wait()
+                finally:
+                    self._waiting_writers -= 1
+                waited = time.perf_counter() - t0
+            self._writer = me
+            self._write_depth = 1
+        try:
+            self._sync_flock()
+        except BaseException:
+            self.release_write()
+            raise
+        self._note(waited)
+
+    def release_write(self):
+        with self._cond:
+            if self._writer != threading.get_ident():
+                raise RuntimeError(f"lock {self.name}: released by a thread that isn't writing")
+            self._write_depth -= 1
+            if self._write_depth:
+                return
+            self._writer = None
+            self._cond.notify_all()
+        self._sync_flock()          # none left, or this thread's own reads: downgrade to shared
+
+    @contextmanager
+    def reading(self):
+        self.acquire_read()
+        try:
+            yield self
+        finally:
+            self.release_read()
+
+    @contextmanager
+    def writing(self):
+        self.acquire_write()
+        try:
+            yield self
+        finally:
+            self.release_write()
+
+
+def get(name, stats=None):
+    """The RWLock called `name`, created on first use; `stats` only applies then."""
+    lock = _registry.get(name)
+    if lock is None:
+        with _registry_lock:
+            lock = _registry.get(name)
+            if lock is None:
+                path = os.path.join(LOCK_DIR, f"{name}.lock") if FILE_LOCKS else None
+                lock = _registry[name] = RWLock(name, path, stats)
+    return lock
+
+
+OWNER_LOCK = os.path.join(LOCK_DIR, "owner.lock")
+_owner_fd = None
+
+def claim_data_dir():
+    """
+    Hold OWNER_LOCK exclusively until the process exits. False if another
+    process holds it; True where fcntl is missing (nothing to check with).
+    """
+    global _owner_fd
+    if fcntl is None or _owner_fd is not None:
+        return True
+    os.makedirs(LOCK_DIR, exist_ok=True)
+    fd = os.open(OWNER_LOCK, os.O_RDWR | os.O_CREAT, 0o666)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        os.close(fd)
+        return False
+    _owner_fd = fd
+    return True
@@ -0,0 +1,337 @@
+"""
+Per-handler latency and I/O counters for the bot, off unless enabled.
+
+Every message is handled inside track(label), where label is the user's
+state or the slash command. While a message is being handled, the bot's
+file helpers, send() and the timed locks add to the current record:
+messages sent, bytes read and written, JSON dumps and time spent waiting
+for state_lock / reminder_lock and the per-user ledger and file locks. When
+the handler returns, the record is folded into per-label totals.
+
+Environment:
+    BOT_METRICS_PORT          serve Prometheus text on http://HOST:PORT/metrics
+    BOT_METRICS_HOST          bind address (default 127.0.0.1)
+    BOT_METRICS               "1" collects without serving, for the log summary only
+    BOT_METRICS_LOG_INTERVAL  seconds between summary lines in the log (default 600, 0 = off)
+
+When disabled, track() returns a shared no-op context, timed_lock() returns
+the plain lock, lock_stats() returns None and the counting helpers return
+straight away.
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PORT = int(os.environ.get("BOT_METRICS_PORT") or 0)
+HOST = os.environ.get("BOT_METRICS_HOST", "127.0.0.1")
+LOG_INTERVAL = int(os.environ.get("BOT_METRICS_LOG_INTERVAL") or 600)
+ENABLED = bool(PORT) or os.environ.get("BOT_METRICS") == "1"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SUMMARY_TOP = 10                 # handlers listed per log summary
+
+_local = threading.local()
+_stats_lock = threading.Lock()
+_handlers = {}                   # label -> HandlerStats
+_locks = []                      # TimedLock / LockStats instances, for rendering
+
+
+class _Record:
+    """Counters for the message currently being handled on this thread."""
+    __slots__ = ("sends", "bytes_read", "bytes_written", "json_dumps", "lock_wait")
+
+    def __init__(self):
+        self.sends = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.json_dumps = 0
+        self.lock_wait = {}
+
+
+class HandlerStats:
+    """Running totals for one state / command."""
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.interval_max = 0.0      # reset by each log summary
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+        self.sends = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.json_dumps = 0
+        self.lock_wait = {}          # lock name -> seconds
+
+    def observe(self, elapsed, rec, failed):
+        self.calls += 1
+        self.errors += failed
+        self.seconds += elapsed
+        self.max_seconds = max(self.max_seconds, elapsed)
+        self.interval_max = max(self.interval_max, elapsed)
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if elapsed <= bound:
+                self.buckets[i] += 1
+                break
+        self.sends += rec.sends
+        self.bytes_read += rec.bytes_read
+        self.bytes_written += rec.bytes_written
+        self.json_dumps += rec.json_dumps
+        for name, waited in rec.lock_wait.items():
+            self.lock_wait[name] = self.lock_wait.get(name, 0.0) + waited
+
+
+# ----- collection -----
+@contextmanager
+def _track(label):
+    rec = _Record()
+    outer = getattr(_local, "rec", None)
+    _local.rec = rec
+    failed = 0
+    t0 = time.perf_counter()
+    try:
+        yield rec
+    except BaseException:
+        failed = 1
+        raise
+    finally:
+        elapsed = time.perf_counter() - t0
+        _local.rec = outer
+        with _stats_lock:
+            stats = _handlers.get(label)
+            if stats is None:
+                stats = _handlers[label] = HandlerStats()
+            stats.observe(elapsed, rec, failed)
+
+
+_NOOP = nullcontext()
+
+def track(label):
+    """Context manager timing one handled message under `label`."""
+    return _track(label) if ENABLED else _NOOP
+
+
+def _current():
+    return getattr(_local, "rec", None) if ENABLED else None
+
+def count_send():
+    rec = _current()
+    if rec is not None:
+        rec.sends += 1
+
+def count_dump():
+    rec = _current()
+    if rec is not None:
+        rec.json_dumps += 1
+
+def add_read(nbytes):
+    rec = _current()
+    if rec is not None:
+        rec.bytes_read += nbytes
+
+def add_written(nbytes):
+    rec = _current()
+    if rec is not None:
+        rec.bytes_written += nbytes
+
+def _size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+def file_read(path):
+    """Count a whole-file read of `path` (stat only happens while tracking)."""
+    rec = _current()
+    if rec is not None:
+        rec.bytes_read += _size(path)
+
+def file_written(path):
+    rec = _current()
+    if rec is not None:
+        rec.bytes_written += _size(path)
+
+
+class LockStats:
+    """Acquisitions and waits of one lock, or of a family such as every per-user ledger lock."""
+
+    def __init__(self, name):
+        self.name = name
+        self.acquisitions = 0
+        self.contended = 0
+        self.wait_seconds = 0.0
+        self._guard = threading.Lock()
+
+    def note(self, waited=None):
+        """Count one acquisition; `waited` is the seconds spent blocked, None if it wasn't."""
+        with self._guard:
+            self.acquisitions += 1
+            if waited is None:
+                return
+            self.contended += 1
+            self.wait_seconds += waited
+        rec = getattr(_local, "rec", None)
+        if rec is not None:
+            rec.lock_wait[self.name] = rec.lock_wait.get(self.name, 0.0) + waited
+
+
+class TimedLock(LockStats):
+    """Wraps a Lock/RLock and records how long acquirers had to wait."""
+
+    def __init__(self, name, lock):
+        super().__init__(name)
+        self._lock = lock
+
+    def acquire(self, blocking=True, timeout=-1):
+        if self._lock.acquire(False):
+            self.note()
+            return True
+        if not blocking:
+            return False
+        t0 = time.perf_counter()
+        if not self._lock.acquire(True, timeout):
+            return False
+        self.note(time.perf_counter() - t0)
+        return True
+
+    def release(self):
+        self._lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self._lock.release()
+
+
+def timed_lock(name, lock):
+    """`lock` wrapped in a TimedLock when metrics are on, else `lock` itself."""
+    if not ENABLED:
+        return lock
+    timed = TimedLock(name, lock)
+    _locks.append(timed)
+    return timed
+
+
+def lock_stats(name):
+    """A LockStats rendered next to the timed locks, or None when metrics are off."""
+    if not ENABLED:
+        return None
+    stats = LockStats(name)
+    _locks.append(stats)
+    return stats
+
+
+# ----- output -----
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def render():
+    """Prometheus text exposition of everything collected so far."""
+    with _stats_lock:
+        items = sorted(_handlers.items())
+        out = []
+
+        def metric(name, kind, help_text, rows):
+            out.append(f"# HELP {name} {help_text}")
+            out.append(f"# TYPE {name} {kind}")
+            out.extend(rows)
+
+        def per_handler(name, kind, help_text, attr):
+            metric(name, kind, help_text,
+                   [f'{name}{{handler="{_label(h)}"}} {getattr(s, attr)}' for h, s in items])
+
+        per_handler("vkbot_handler_calls_total", "counter", "Messages handled.", "calls")
+        per_handler("vkbot_handler_errors_total", "counter", "Handlers that raised.", "errors")
+        per_handler("vkbot_handler_seconds_max", "gauge", "Slowest single message, seconds.", "max_seconds")
+        rows = []
+        for h, s in items:
+            cumulative = 0
+            for bound, n in zip(LATENCY_BUCKETS, s.buckets):
+                cumulative += n
+                rows.append(f'vkbot_handler_seconds_bucket{{handler="{_label(h)}",le="{bound}"}} {cumulative}')
+            rows.append(f'vkbot_handler_seconds_bucket{{handler="{_label(h)}",le="+Inf"}} {s.calls}')
+            rows.append(f'vkbot_handler_seconds_sum{{handler="{_label(h)}"}} {s.seconds:.6f}')
+            rows.append(f'vkbot_handler_seconds_count{{handler="{_label(h)}"}} {s.calls}')
+        metric("vkbot_handler_seconds", "histogram", "Wall time per handled message.", rows)
+        per_handler("vkbot_handler_sends_total", "counter", "messages.send calls.", "sends")
+        per_handler("vkbot_handler_read_bytes_total", "counter", "Bytes read from data files.", "bytes_read")
+        per_handler("vkbot_handler_written_bytes_total", "counter", "Bytes written to data files.", "bytes_written")
+        per_handler("vkbot_handler_json_dumps_total", "counter", "JSON documents serialised.", "json_dumps")
+        metric("vkbot_handler_lock_wait_seconds_total", "counter", "Time handlers waited for a lock.",
+               [f'vkbot_handler_lock_wait_seconds_total{{handler="{_label(h)}",lock="{_label(n)}"}} {w:.6f}'
+                for h, s in items for n, w in sorted(s.lock_wait.items())])
+
+    locks = list(_locks)
+    metric("vkbot_lock_acquisitions_total", "counter", "Lock acquisitions from any thread.",
+           [f'vkbot_lock_acquisitions_total{{lock="{_label(l.name)}"}} {l.acquisitions}' for l in locks])
+    metric("vkbot_lock_contended_total", "counter", "Acquisitions that had to wait.",
+           [f'vkbot_lock_contended_total{{lock="{_label(l.name)}"}} {l.contended}' for l in locks])
+    metric("vkbot_lock_wait_seconds_total", "counter", "Time spent waiting, any thread.",
+           [f'vkbot_lock_wait_seconds_total{{lock="{_label(l.name)}"}} {l.wait_seconds:.6f}' for l in locks])
+    return "\n".join(out) + "\n"
+
+
+_last_summary = {}   # label -> (calls, seconds, sends, lock wait) at the previous summary
+
+def summary_lines(top=SUMMARY_TOP):
+    """One line per busiest handler since the previous call."""
+    rows = []
+    with _stats_lock:
+        for label, s in _handlers.items():
+            now = (s.calls, s.seconds, s.sends, sum(s.lock_wait.values()))
+            calls, seconds, sends, waited = (x - y for x, y in zip(now, _last_summary.get(label, (0, 0.0, 0, 0.0))))
+            if calls:
+                rows.append((seconds, label, calls, s.interval_max, sends, waited))
+            _last_summary[label] = now
+            s.interval_max = 0.0
+    rows.sort(reverse=True)
+    return [f"{label}: {calls} msg, {seconds * 1000 / calls:.1f} ms avg, {worst * 1000:.1f} ms max, "
+            f"{sends / calls:.1f} sends/msg, {waited * 1000:.1f} ms lock wait"
+            for seconds, label, calls, worst, sends, waited in rows[:top]]
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, fmt, *args):
+        pass
+
+
+def _summary_worker(log):
+    while True:
+        time.sleep(LOG_INTERVAL)
+        try:
+            lines = summary_lines()
+            if lines:
+                log.info(f"Metrics, last {LOG_INTERVAL}s:\n  " + "\n  ".join(lines))
+        except Exception as e:
+            log.error(f"Metrics summary error: {e}")
+
+
+def start(log):
+    """Start the HTTP endpoint and the log summary thread, if enabled."""
+    if not ENABLED:
+        return None
+    server = None
+    if PORT:
+        server = ThreadingHTTPServer((HOST, PORT), _MetricsHandler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        log.info(f"Metrics on http://{HOST}:{server.server_address[1]}/metrics")
+    if LOG_INTERVAL:
+        threading.Thread(target=_summary_worker, args=(log,), daemon=True).start()
+    return server
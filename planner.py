@@ -0,0 +1,338 @@
+"""
+Planner events ({uid}plan.txt), completed events, day grouping and saved
+photos.
+"""
+import calendar
+import os
+import random
+import re
+import sys
+import zlib
+from datetime import date, datetime
+from typing import Optional
+
+import metrics
+from config import log, PLANNER_DIR
+from storage import file_lock, note_file_write, _file_version, _read_lines, _write_lines
+from health import tick_count
+from transport import send, vk
+from keyboards import main_menu_kb
+
+# ================= HASHTAG & LINE PARSING =================
+HASHTAG_RE = re.compile(r"(#\w+)")
+EVENT_OR_PERS_RE = re.compile(r"\b(event|pers|control)\b", re.IGNORECASE)
+
+def extract_hashtag(text):
+    """Return first hashtag in a line or None if missing"""
+    m = HASHTAG_RE.search(text)
+    return m.group(1) if m else None
+
+def line_has_uid(line, uid_value):
+    parsed = parse_event_line(line)
+    if not parsed:
+        return False
+    _, _, _, uid_event, _ = parsed
+    return uid_event == uid_value
+
+
+# ================= PLANNER FILE =================
+def planner(uid):
+    return os.path.join(PLANNER_DIR, f"{uid}plan.txt")
+
+def read_events(uid):
+    lines = _read_lines(planner(uid))
+    tick_count("lines", len(lines))
+    return lines
+
+def write_events(uid, events):
+    _write_lines(planner(uid), events)
+
+def append_event(uid, text):
+    line = text.strip() + "\n"
+    path = planner(uid)
+    with file_lock(path).writing():
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(line)
+        note_file_write(path)
+    metrics.add_written(len(line.encode("utf-8")))
+
+def rearrange(uid):
+    with file_lock(planner(uid)).writing():
+        events = read_events(uid)
+        parsed = []
+        for l in events:
+            try:
+                dt = datetime.fromisoformat(l.split()[0])
+                parsed.append((dt, l))
+            except:
+                pass
+        parsed.sort(key=lambda x: x[0])
+        write_events(uid, [l for _, l in parsed])
+
+# Planner/done lines have no unique id of their own (recurring events share
+# one uidN), so selections address a line by a hash of its text instead of
+# its position. Identical lines share a key, which is harmless: acting on
+# either one gives the same file.
+_line_key_cache = {}   # path -> (version, lines, {key: index})
+
+def line_key(line):
+    return f"{zlib.crc32(line.encode('utf-8')):08x}"
+
+def _keyed_lines(path):
+    version = _file_version(path)
+    hit = _line_key_cache.get(path)
+    if hit is None or hit[0] != version:
+        lines = _read_lines(path)
+        keys = {}
+        for i, l in enumerate(lines):
+            keys.setdefault(line_key(l), i)
+        hit = (version, lines, keys)
+        _line_key_cache[path] = hit
+    return hit[1], hit[2]
+
+def get_line_by_key(path, key):
+    lines, keys = _keyed_lines(path)
+    i = keys.get(key)
+    return None if i is None else lines[i]
+
+def remove_lines_by_keys(path, keys):
+    """Drop the lines with the given keys; returns the removed lines in file order."""
+    with file_lock(path).writing():
+        lines, index = _keyed_lines(path)
+        drop = {index[k] for k in keys if k in index}
+        if not drop:
+            return []
+        _write_lines(path, [l for i, l in enumerate(lines) if i not in drop])
+    return [lines[i] for i in sorted(drop)]
+
+def replace_line_by_key(path, key, new_line):
+    with file_lock(path).writing():
+        lines, index = _keyed_lines(path)
+        if key not in index:
+            return False
+        lines = list(lines)
+        lines[index[key]] = new_line
+        _write_lines(path, lines)
+    return True
+
+def parse_event_line(line):
+    try:
+        parts = line.split()
+        dt = datetime.fromisoformat(parts[0])
+        hashtag = extract_hashtag(line)
+        uid_event = next((p for p in parts if p.startswith("uid")), None)
+        desc_start = line.find(' ') + 1
+        desc_end = line.find(uid_event) if uid_event else len(line)
+        desc_text = line[desc_start:desc_end].strip()
+        return dt, desc_text, hashtag, uid_event, line
+    except Exception as e:
+        log.warning(f"Failed parsing line: {line} | {e}")
+        return None
+
+
+def events_for_date(uid, target_date):
+    lo = to_minute(datetime.combine(target_date, datetime.min.time()))
+    return [ev.line for ev in planner_events(uid) if lo <= ev.minute < lo + 1440]
+
+
+# ================= PARSED EVENTS =================
+# Workers scan every user's plan on each tick. Instead of re-parsing each
+# line into (datetime, desc, hashtag, uid, line), the parse is kept per
+# file version as one small record per line: the minute as an int, the
+# interned hashtag and uid token, and the line itself. desc and the exact
+# datetime are derived from the line only when a record is actually used.
+_events_cache = {}   # path -> (version, [PlannerEvent])
+
+class PlannerEvent:
+    __slots__ = ("minute", "hashtag", "uid_event", "line")
+
+    def __init__(self, minute, hashtag, uid_event, line):
+        self.minute = minute
+        self.hashtag = hashtag
+        self.uid_event = uid_event
+        self.line = line
+
+    @property
+    def dt(self):
+        return datetime.fromisoformat(self.line.split(None, 1)[0])
+
+    @property
+    def desc(self):
+        line = self.line
+        end = line.find(self.uid_event) if self.uid_event else len(line)
+        return line[line.find(' ') + 1:end].strip()
+
+def _compact_event(line):
+    parts = line.split()
+    dt = datetime.fromisoformat(parts[0])
+    hashtag = extract_hashtag(line)
+    uid_event = next((p for p in parts if p.startswith("uid")), None)
+    return PlannerEvent(to_minute(dt), hashtag and sys.intern(hashtag),
+                        uid_event and sys.intern(uid_event), line)
+
+def planner_events(uid):
+    """Parsed plan lines for uid, in file order, re-parsed only when the file changes."""
+    path = planner(uid)
+    version = _file_version(path)
+    hit = _events_cache.get(path)
+    if hit is None or hit[0] != version:
+        events = []
+        for line in _read_lines(path):
+            try:
+                events.append(_compact_event(line))
+            except Exception as e:
+                log.warning(f"Failed parsing line: {line} | {e}")
+        hit = (version, events)
+        _events_cache[path] = hit
+    tick_count("lines", len(hit[1]))
+    return hit[1]
+
+# ================= COMPLETED EVENTS =================
+def done_file(uid):
+    return os.path.join(PLANNER_DIR, f"{uid}done.txt")
+
+def append_done(uid, text):
+    path = done_file(uid)
+    with file_lock(path).writing():
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(text.strip() + "\n")
+        note_file_write(path)
+
+def read_done(uid):
+    return _read_lines(done_file(uid))
+
+# ================= DATE HELPERS =================
+def safe_add_months(dt, months):
+    month = dt.month - 1 + months
+    year = dt.year + month // 12
+    month = month % 12 + 1
+    day = min(dt.day, calendar.monthrange(year, month)[1])
+    return dt.replace(year=year, month=month, day=day)
+
+def safe_add_years(dt, years):
+    try:
+        return dt.replace(year=dt.year + years)
+    except ValueError:
+        return dt.replace(year=dt.year + years, day=28)
+
+# Compact timestamps: whole minutes since 1970-01-01, local time like the files.
+EPOCH = datetime(1970, 1, 1)
+_EPOCH_DAY = EPOCH.toordinal()
+
+def to_minute(dt):
+    return (dt.toordinal() - _EPOCH_DAY) * 1440 + dt.hour * 60 + dt.minute
+
+def minute_date(minute):
+    return date.fromordinal(_EPOCH_DAY + minute // 1440)
+
+def minute_text(minute):
+    """The minute as the files write it: "YYYY-MM-DDTHH:MM"."""
+    days, rest = divmod(minute, 1440)
+    hours, minutes = divmod(rest, 60)
+    return f"{date.fromordinal(_EPOCH_DAY + days).isoformat()}T{hours:02d}:{minutes:02d}"
+
+# ================= GROUPING =================
+WEEKDAY_EMOJI = ["", "1️⃣", "2️⃣", "3️⃣", "4️⃣", "5️⃣", "6️⃣", "7️⃣"]
+
+def day_groups(events):
+    """Group planner lines by day: [(date, [(line_index, line), ...]), ...] in date order."""
+    parsed = []
+    for i, l in enumerate(events):
+        try:
+            dt = datetime.fromisoformat(l.split()[0])
+            parsed.append((dt, i, l))
+        except:
+            continue
+    parsed.sort(key=lambda x: x[0])
+    day_map = {}
+    for dt, idx, line in parsed:
+        day = dt.date()
+        day_map.setdefault(day, []).append((idx, line))
+    return [(day, day_map[day]) for day in sorted(day_map)]
+
+def format_day_group(day, items, today):
+    weekday_num = datetime.combine(day, datetime.min.time()).isoweekday()
+    wd = WEEKDAY_EMOJI[weekday_num]
+    overdue_prefix = "⏳ " if day < today else ""
+    block = "\n".join(f"{i+1}. {l}" for i, l in items)
+    return f"{overdue_prefix}{wd} {day}\n{block}"
+
+def send_today_with_weekday(uid):
+    now = datetime.now()
+    msg = now.strftime("Today: %Y-%m-%d (%A)")
+    send(uid, msg)
+
+def save_photos(uid, message_id, peer_id):
+    os.makedirs("user_photos", exist_ok=True)
+    path = os.path.join("user_photos", f"{uid}photo.txt")
+    msg = vk.messages.getById(message_ids=message_id)["items"][0]
+    if not msg.get("attachments"):
+        return
+    desc = msg.get("text", "").strip()
+    with file_lock(path).writing():
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(f"{peer_id}|{message_id}||{desc}\n")
+        note_file_write(path)
+    send(uid, "Saved photo reference.", main_menu_kb())
+
+def days_per_month_message(year: int, selected_month: Optional[int] = None) -> str:
+    now = datetime.now()
+    current_year = now.year
+    current_month = now.month
+    lines = [f"📅 Days per month for {year}:"]
+    for m in range(1, 13):
+        days = calendar.monthrange(year, m)[1]
+        marks = ""
+        if year == current_year and m == current_month:
+            marks += " ✔"
+        if selected_month == m:
+            marks += " 🎯"
+        lines.append(f"{m:02d}: {days} days{marks}")
+    return "\n".join(lines)
+
+def two_month_calendar_message():
+    today = datetime.now().date()
+    calendar.setfirstweekday(calendar.MONDAY)
+    def render_month(year, month):
+        lines = [f"📆 {calendar.month_name[month]} {year}"]
+        for week in calendar.monthcalendar(year, month):
+            cells = []
+            for d in week:
+                if d == 0:
+                    cells.append("  ")
+                elif d == today.day and month == today.month and year == today.year:
+                    cells.append(f"[{d:02}]")
+                else:
+                    cells.append(f"{d:02}")
+            lines.append("Mo " + " ".join(cells) + " Su")
+        return lines
+    y, m = today.year, today.month
+    ny, nm = (y + 1, 1) if m == 12 else (y, m + 1)
+    output = []
+    output.extend(render_month(y, m))
+    output.append("")
+    output.extend(render_month(ny, nm))
+    return "\n".join(output)
+
+# ===== PHOTO RETRIEVAL =====
+def send_photos(uid):
+    path = os.path.join("user_photos", f"{uid}photo.txt")
+    if not os.path.exists(path):
+        send(uid, "You have no saved photos.", main_menu_kb())
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        lines = [l.strip() for l in f if l.strip()]
+    for i, line in enumerate(lines, 1):
+        ref, desc = line.split("||", 1)
+        peer_id, msg_id = ref.split("|")
+        if desc:
+            send(uid, f"Photo {i}:\n{desc}")
+        vk.messages.send(user_id=uid, random_id=random.randint(1, 2**31 - 1), forward_messages=int(msg_id))
+    send(uid, "Menu:", main_menu_kb())
+
+def read_photo_entries(uid):
+    path = os.path.join("user_photos", f"{uid}photo.txt")
+    if not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        return [l.rstrip() for l in f if l.strip()]
@@ -0,0 +1,181 @@
+"""
+Time-bounded sampling profiler for the running bot.
+
+A background thread wakes every `interval` seconds, reads the current
+frame of every other thread via sys._current_frames() and counts each
+stack. Nothing is installed in the profiled threads, so the long-poll loop
+and all workers keep running at full speed apart from the sampling itself.
+
+The result is written in collapsed-stack format, one line per distinct
+stack, root first, frames separated by ';':
+
+    hourly_reminder_worker;_bootstrap (threading.py:1012);...;parse_event_line (bot.py:1858) 412
+
+which flamegraph.pl, speedscope or inferno render directly. Where per-thread
+CPU clocks are available (Linux, macOS), a thread that used almost no CPU
+since the previous sample is sleeping or blocked (time.sleep, a lock, a
+socket), and its stack gets an extra "[idle]" leaf. The flamegraph still
+shows where threads wait; summary() ranks only the busy samples.
+"""
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+DEFAULT_INTERVAL = 0.005        # seconds between samples
+IDLE_CPU_SHARE = 0.1            # below this share of the interval in CPU, a thread counts as idle
+IDLE_FRAME = "[idle]"
+MAX_DURATION = 600              # upper bound for one run, seconds
+
+_run_lock = threading.Lock()
+_active = None                  # the SamplingProfiler currently running, if any
+
+
+def _frame_label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(";", ",")
+
+
+class SamplingProfiler:
+    """Counts the stacks of all threads except its own."""
+
+    def __init__(self, interval=DEFAULT_INTERVAL):
+        self.interval = interval
+        self.stacks = Counter()          # tuple of frames, root first -> samples
+        self.samples = 0
+        self.started = None
+        self.elapsed = 0.0
+        self._stop = threading.Event()
+        self._labels = {}                # code object -> label
+        self._cpu = {}                   # thread ident -> (clock id, CPU seconds, wall time) at the last sample
+
+    def _label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = _frame_label(code)
+        return label
+
+    def _idle(self, ident, wall):
+        """True if thread `ident` barely ran since the previous sample; None if unknown."""
+        try:
+            entry = self._cpu.get(ident)
+            clock = entry[0] if entry else time.pthread_getcpuclockid(ident)
+            cpu = time.clock_gettime(clock)
+        except (AttributeError, OSError, OverflowError):
+            return None
+        self._cpu[ident] = (clock, cpu, wall)
+        if not entry:
+            return None
+        return cpu - entry[1] < IDLE_CPU_SHARE * (wall - entry[2])
+
+    def sample(self):
+        own = threading.get_ident()
+        names = {t.ident: t.name for t in threading.enumerate()}
+        wall = time.perf_counter()
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            stack = [IDLE_FRAME] if self._idle(ident, wall) else []
+            while frame is not None:
+                stack.append(self._label(frame.f_code))
+                frame = frame.f_back
+            stack.append(names.get(ident, f"thread-{ident}"))
+            self.stacks[tuple(reversed(stack))] += 1
+        self.samples += 1
+
+    def run(self, duration):
+        self.started = time.time()
+        t0 = time.perf_counter()
+        deadline = t0 + duration
+        while not self._stop.is_set():
+            now = time.perf_counter()
+            if now >= deadline:
+                break
+            self.sample()
+            self._stop.wait(self.interval)
+        self.elapsed = time.perf_counter() - t0
+
+    def stop(self):
+        self._stop.set()
+
+    def write_collapsed(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(";".join(stack) + f" {count}\n")
+
+    def busy_stacks(self):
+        return {stack: count for stack, count in self.stacks.items() if stack[-1] != IDLE_FRAME}
+
+    def top(self, n=10, inclusive=False):
+        """[(frame, samples)] over busy stacks, by self time (leaf frame) or inclusive time."""
+        counts = Counter()
+        for stack, count in self.busy_stacks().items():
+            if inclusive:
+                for frame in set(stack[1:]):
+                    if "(threading.py:" not in frame:
+                        counts[frame] += count
+            else:
+                counts[stack[-1]] += count
+        return counts.most_common(n)
+
+    def summary(self, n=8):
+        total = sum(self.stacks.values())
+        busy = sum(self.busy_stacks().values())
+        lines = [f"{self.samples} samples over {self.elapsed:.1f}s; {busy} of {total} thread stacks busy"]
+        for title, inclusive in (("self", False), ("inclusive", True)):
+            lines.append(f"top {title}:")
+            lines.extend(f"  {count * 100 / (busy or 1):5.1f}%  {frame}" for frame, count in self.top(n, inclusive))
+        return "\n".join(lines)
+
+
+def running():
+    return _active is not None
+
+
+def start(duration, out_dir, interval=DEFAULT_INTERVAL, on_done=None):
+    """
+    Profile every thread for `duration` seconds in the background and write
+    out_dir/profile-<time>.collapsed. Returns that path, or None if a run is
+    already in progress. on_done(path, profiler) is called from the profiler
+    thread when the file is written.
+    """
+    global _active
+    duration = max(1, min(MAX_DURATION, duration))
+    with _run_lock:
+        if _active is not None:
+            return None
+        prof = _active = SamplingProfiler(interval)
+    os.makedirs(out_dir, exist_ok=True)
+    path = os.path.join(out_dir, f"profile-{time.strftime('%Y%m%d-%H%M%S')}.collapsed")
+
+    def worker():
+        global _active
+        try:
+            prof.run(duration)
+            prof.write_collapsed(path)
+        finally:
+            with _run_lock:
+                _active = None
+        if on_done:
+            on_done(path, prof)
+
+    threading.Thread(target=worker, name="profiler", daemon=True).start()
+    return path
+
+
+def stop():
+    """End the current run early; it still writes its file."""
+    prof = _active
+    if prof is not None:
+        prof.stop()
+    return prof is not None
+
+
+def install_signal_handler(signum, duration, out_dir, on_done=None):
+    """Start a run whenever the process receives `signum` (e.g. SIGUSR1)."""
+    import signal
+
+    def handler(sig, frame):
+        start(duration, out_dir, on_done=on_done)
+
+    signal.signal(signum, handler)
@@ -0,0 +1,472 @@
+"""Reminder bookkeeping and the background workers that send reminders and run nightly jobs."""
+import os
+import re
+import time
+from datetime import datetime, timedelta
+
+import codec
+import metrics
+from config import log, REMINDER_FILE
+from storage import atomic_write, load_json, reminder_lock, state_lock, states, _read_json, _write_json
+from health import next_tick_delay, tick_count, worker_tick
+from transport import send
+from planner import EVENT_OR_PERS_RE, minute_date, planner_events, to_minute, WEEKDAY_EMOJI
+from ledger import archive_cutoff, archive_user_expenses
+from snapshots import create_snapshot, gc_snapshot_blobs, prune_snapshots
+
+# ================= REMINDER TRACKING =================
+sent_reminders = {}      # reminder key -> True / custom reminder dict, loaded lazily
+_reminders_loaded = False
+
+def load_sent_reminders():
+    if not os.path.exists(REMINDER_FILE):
+        return {}
+    try:
+        return load_json(REMINDER_FILE)
+    except Exception as e:
+        log.error(f"Unreadable {REMINDER_FILE} and no usable backup ({e}); starting with no sent reminders")
+        return {}
+
+def ensure_sent_reminders():
+    """Load REMINDER_FILE into `sent_reminders` the first time anything needs it."""
+    global _reminders_loaded
+    if _reminders_loaded:
+        return
+    with reminder_lock:
+        if not _reminders_loaded:
+            for key, value in load_sent_reminders().items():
+                sent_reminders.setdefault(key, value)
+            _reminders_loaded = True
+
+def save_sent_reminders(data):
+    ensure_sent_reminders()
+    with reminder_lock:
+        atomic_write(REMINDER_FILE, codec.dumpb(data), backup=True)
+        metrics.count_dump()
+
+
+def cleanup_sent_reminders():
+    """Enhancement 2: Remove old reminder keys to prevent memory leak"""
+    ensure_sent_reminders()
+    now = datetime.now()
+    keys_to_delete = []
+    with reminder_lock:
+        for key in sent_reminders:
+            parts = key.split('|')
+            if len(parts) >= 3:
+                try:
+                    event_date = datetime.fromisoformat(parts[2])
+                    if now - event_date > timedelta(days=7):
+                        keys_to_delete.append(key)
+                except:
+                    pass
+        if keys_to_delete:
+            for k in keys_to_delete:
+                del sent_reminders[k]
+            save_sent_reminders(sent_reminders)
+            log.info(f"Cleaned up {len(keys_to_delete)} old reminder keys.")
+
+
+# ================= MAINTENANCE JOBS =================
+# Nightly per-user jobs with durable progress in jobs.json:
+#
+#   {"expense_archive": {"period": "2026-10-19", "users": {"123": "2026-10-19", ...},
+#                        "errors": {"456": {"period": ..., "attempts": 1, "error": "..."}}}, ...}
+#
+# A job's period is the date of its most recent scheduled hour, so a run
+# missed while the bot was down is picked up as soon as it is back. Each
+# tick handles a batch of users per job, sized so that every user is done
+# within MAINTENANCE_TARGET_SECONDS, and records every finished user right
+# away, so a restart resumes where it stopped and the nightly I/O is spread
+# out instead of one burst. A user whose job fails stays pending and is
+# retried on later ticks, up to MAINTENANCE_MAX_ATTEMPTS per period.
+
+JOBS_FILE = "jobs.json"
+MAINTENANCE_TICK = 30             # seconds between scheduler ticks
+MAINTENANCE_USERS_PER_TICK = 5    # smallest batch per job per tick
+MAINTENANCE_TARGET_SECONDS = 1800 # aim to finish each job's period within this
+MAINTENANCE_MAX_ATTEMPTS = 3      # failures per user and period before it is skipped
+
+def _job_expense_archive(uid, period):
+    moved = archive_user_expenses(uid, archive_cutoff(period))
+    if moved:
+        log.info(f"Archived {moved} expense(s) for {uid} (period {period})")
+
+def _job_snapshot(uid, period):
+    ts, _, count = create_snapshot(uid)
+    prune_snapshots(uid, gc=False)      # blobs are collected once, when the job finishes
+    log.info(f"Nightly snapshot for {uid}: {ts}, {count} files")
+
+def _finish_snapshot(period):
+    gc_snapshot_blobs()
+
+MAINTENANCE_JOBS = [
+    # (name, hour it becomes due, per-user function, function run once all users are done or None)
+    ("snapshot", 2, _job_snapshot, _finish_snapshot),
+    ("expense_archive", 3, _job_expense_archive, None),
+]
+
+def load_jobs():
+    return _read_json(JOBS_FILE, {})
+
+def save_jobs(jobs):
+    _write_json(JOBS_FILE, jobs)
+
+def job_period(hour, now=None):
+    """Date of the latest scheduled run at or before `now`."""
+    now = now or datetime.now()
+    day = now.date()
+    return day if now.hour >= hour else day - timedelta(days=1)
+
+def maintenance_batch(users):
+    """Users per job per tick so that `users` are all done within MAINTENANCE_TARGET_SECONDS."""
+    ticks = max(1, MAINTENANCE_TARGET_SECONDS // MAINTENANCE_TICK)
+    return max(MAINTENANCE_USERS_PER_TICK, -(-users // ticks))
+
+def _note_job_failure(job, uid, error):
+    """Record a failed attempt; returns True once the user has used up its attempts."""
+    errors = job.setdefault("errors", {})
+    prev = errors.get(uid)
+    attempts = prev["attempts"] if isinstance(prev, dict) and prev.get("period") == job["period"] else 0
+    errors[uid] = {"period": job["period"], "attempts": attempts + 1, "error": str(error)}
+    return attempts + 1 >= MAINTENANCE_MAX_ATTEMPTS
+
+def run_maintenance_tick(jobs, now=None, limit=None):
+    """
+    Advance every due job by up to `limit` users (default: maintenance_batch
+    of all users). Returns the number of users processed.
+    """
+    with state_lock:
+        uids = list(states.keys())
+    tick_count("users", len(uids))
+    if limit is None:
+        limit = maintenance_batch(len(uids))
+    processed = 0
+    for name, hour, func, finish in MAINTENANCE_JOBS:
+        period = job_period(hour, now)
+        job = jobs.setdefault(name, {"period": None, "users": {}})
+        if job["period"] != period.isoformat():
+            if job["period"]:
+                behind = [u for u in uids if job["users"].get(u) != job["period"]]
+                if behind:
+                    log.warning(f"Job {name}: period {job['period']} superseded with {len(behind)} user(s) pending")
+            job["period"] = period.isoformat()
+        pending = [u for u in uids if job["users"].get(u) != job["period"]]
+        for uid in pending[:limit]:
+            try:
+                func(uid, period)
+            except Exception as e:
+                if _note_job_failure(job, uid, e):
+                    # marked done so it cannot block the queue; it runs again next period
+                    log.error(f"Job {name} failed for {uid}, giving up until the next period: {e}")
+                    job["users"][uid] = job["period"]
+                else:
+                    log.error(f"Job {name} failed for {uid}, will retry: {e}")
+            else:
+                job.get("errors", {}).pop(uid, None)
+                job["users"][uid] = job["period"]
+            save_jobs(jobs)
+            processed += 1
+        if pending and all(job["users"].get(u) == job["period"] for u in pending):
+            if finish is not None:
+                try:
+                    finish(period)
+                except Exception as e:
+                    log.error(f"Job {name} finish step failed: {e}")
+            job["finished"] = datetime.now().isoformat(timespec="seconds")
+            save_jobs(jobs)
+            log.info(f"Job {name} finished for period {job['period']}")
+    return processed
+
+def maintenance_backlog(jobs):
+    """Users still pending across all jobs for their current period."""
+    with state_lock:
+        uids = list(states.keys())
+    return sum(1 for job in jobs.values() if job.get("period")
+               for u in uids if job["users"].get(u) != job["period"])
+
+def maintenance_worker():
+    """Drive the nightly jobs from jobs.json, a few users per tick."""
+    jobs = load_jobs()
+    while True:
+        try:
+            with worker_tick("maintenance", MAINTENANCE_TICK) as tick:
+                run_maintenance_tick(jobs)
+                tick["backlog"] = maintenance_backlog(jobs)
+        except Exception as e:
+            log.error(f"Maintenance worker error: {e}")
+        time.sleep(next_tick_delay("maintenance"))
+
+
+# ================= REMINDER WORKERS =================
+def _daily_due(now, hour, last_run_date):
+    """True once per day, on the first tick inside `hour` (so a late or slow tick still runs it)."""
+    return now.hour == hour and last_run_date != now.date()
+
+def _all_uids():
+    with state_lock:
+        uids = list(states.keys())
+    tick_count("users", len(uids))
+    return uids
+
+def _events_on(uid, day):
+    lo = to_minute(datetime.combine(day, datetime.min.time()))
+    return [ev.line for ev in planner_events(uid) if lo <= ev.minute < lo + 1440]
+
+def daily_digest_worker():
+    last_run_date = None
+    while True:
+        try:
+            with worker_tick("daily_digest", 61):
+                now = datetime.now()
+                if _daily_due(now, 8, last_run_date):
+                    last_run_date = now.date()
+                    cleanup_sent_reminders()
+                    for uid in _all_uids():
+                        todays = _events_on(uid, now.date())
+                        if todays:
+                            msg = "📅 Events today:\n" + "\n".join(todays)
+                            try:
+                                send(int(uid), msg)
+                            except Exception as e:
+                                log.error(f"Daily digest send failed for {uid}: {e}")
+            time.sleep(next_tick_delay("daily_digest"))
+        except Exception as e:
+            log.error(f"Daily digest worker error: {e}")
+            time.sleep(60)
+
+
+
+def daily_tomorrow_reminder_worker():
+    """Send full tomorrow's events reminder at 22:00 (10 PM)"""
+    last_run_date = None
+    while True:
+        try:
+            with worker_tick("daily_tomorrow_reminder", 30):
+                now = datetime.now()
+                tomorrow = now.date() + timedelta(days=1)
+                # Run once during the 22:00 hour
+                if _daily_due(now, 22, last_run_date):
+                    last_run_date = now.date()
+                    for uid in _all_uids():
+                        tomorrows_events = _events_on(uid, tomorrow)
+                        if tomorrows_events:
+                            weekday = tomorrow.strftime("%A")
+                            msg = f"📅 Events for tomorrow ({tomorrow} {weekday}):\n" + "\n".join(tomorrows_events)
+                            try:
+                                send(int(uid), msg)
+                                log.info(f"Sent tomorrow's events reminder to {uid}")
+                            except Exception as e:
+                                log.error(f"Tomorrow reminder send failed for {uid}: {e}")
+            time.sleep(next_tick_delay("daily_tomorrow_reminder"))
+        except Exception as e:
+            log.error(f"Daily tomorrow reminder worker error: {e}")
+            time.sleep(60)
+
+def _send_reminder(uid, msg, label):
+    """
+    Send one reminder; False if it failed. Never call with reminder_lock held:
+    send() backs off on VK rate limits, which would stall every reminder worker.
+    """
+    try:
+        send(int(uid), msg)
+        return True
+    except Exception as e:
+        log.error(f"{label} failed for {uid}: {e}")
+        return False
+
+def _mark_sent(key):
+    with reminder_lock:
+        sent_reminders[key] = True
+        save_sent_reminders(sent_reminders)
+
+def hourly_reminder_tick(now=None):
+    """Send the one-hour-ahead reminders that are due at `now`."""
+    ensure_sent_reminders()
+    now = now or datetime.now()
+    now_minute = to_minute(now)
+    for uid in _all_uids():
+        for ev in planner_events(uid):
+            # whole-minute prefilter; the exact check uses the line's own timestamp
+            if not now_minute <= ev.minute <= now_minute + 60:
+                continue
+            dt = ev.dt
+            delta = (dt - now).total_seconds()
+            if 0 < delta <= 3600:
+                key = f"{uid}|{ev.uid_event}|{dt.isoformat()}"
+                with reminder_lock:
+                    if key in sent_reminders:
+                        continue
+                # Use the full original line for the reminder
+                msg = f"⏰ Reminder:\n{ev.line}"
+                if _send_reminder(uid, msg, "Reminder send"):
+                    _mark_sent(key)
+
+def hourly_reminder_worker():
+    while True:
+        try:
+            with worker_tick("hourly_reminder", 60):
+                hourly_reminder_tick()
+            time.sleep(next_tick_delay("hourly_reminder"))
+        except Exception as e:
+            log.error(f"Hourly reminder worker error: {e}")
+            time.sleep(60)
+
+def send_tag_reminders(now, tag_re, title, label):
+    """Send each user their upcoming events matching tag_re, one message per day."""
+    now_minute = to_minute(now)
+    for uid in _all_uids():
+        day_map = {}
+        for ev in planner_events(uid):
+            if ev.minute >= now_minute and tag_re.search(ev.line) and ev.dt >= now:
+                day_map.setdefault(minute_date(ev.minute), []).append(ev.line)
+        for day in sorted(day_map):
+            weekday_emoji = WEEKDAY_EMOJI[day.isoweekday()]
+            block = "\n".join(day_map[day])
+            msg = f"📌 {weekday_emoji} {title} for {day}:\n{block}"
+            try:
+                send(int(uid), msg)
+            except Exception as e:
+                log.error(f"{label} failed for {uid}: {e}")
+
+def daily_event_reminder_worker():
+    """Send reminders for #event hashtag at 17:00"""
+    last_run_date = None
+    event_re = re.compile(r"\b(event)\b", re.IGNORECASE)
+    while True:
+        try:
+            with worker_tick("daily_event_reminder", 30):
+                now = datetime.now()
+                if _daily_due(now, 17, last_run_date):
+                    last_run_date = now.date()
+                    send_tag_reminders(now, event_re, "Event reminders", "17:00 event reminder")
+            time.sleep(next_tick_delay("daily_event_reminder"))
+        except Exception as e:
+            log.error(f"Daily event reminder worker error: {e}")
+            time.sleep(60)
+
+def daily_control_reminder_worker():
+    """Send reminders for #control hashtag at 18:00"""
+    last_run_date = None
+    control_re = re.compile(r"\b(control)\b", re.IGNORECASE)
+    while True:
+        try:
+            with worker_tick("daily_control_reminder", 30):
+                now = datetime.now()
+                if _daily_due(now, 18, last_run_date):
+                    last_run_date = now.date()
+                    send_tag_reminders(now, control_re, "Control reminders", "18:00 control reminder")
+            time.sleep(next_tick_delay("daily_control_reminder"))
+        except Exception as e:
+            log.error(f"Daily control reminder worker error: {e}")
+            time.sleep(60)
+
+def daily_pers_reminder_worker():
+    """Send reminders for #pers hashtag at 21:00"""
+    last_run_date = None
+    pers_re = re.compile(r"\b(pers)\b", re.IGNORECASE)
+    while True:
+        try:
+            with worker_tick("daily_pers_reminder", 30):
+                now = datetime.now()
+                if _daily_due(now, 21, last_run_date):
+                    last_run_date = now.date()
+                    send_tag_reminders(now, pers_re, "Personal reminders", "21:00 pers reminder")
+            time.sleep(next_tick_delay("daily_pers_reminder"))
+        except Exception as e:
+            log.error(f"Daily pers reminder worker error: {e}")
+            time.sleep(60)
+
+MULTI_DAY_INTERVALS = [
+    (14, "🗓️ Two weeks before"),
+    (7, "🗓️ One week before"),
+    (3, "🗓️ Three days before"),
+]
+
+def multi_day_reminder_tick(now=None):
+    """Send the 14/7/3-days-before reminders for #event, #pers and #control events."""
+    ensure_sent_reminders()
+    now = now or datetime.now()
+    today = now.date()
+    prefixes = dict(MULTI_DAY_INTERVALS)
+    # the only days that can be due today, as minute ranges
+    windows = [(days, to_minute(datetime.combine(today + timedelta(days=days), datetime.min.time())))
+               for days in prefixes]
+    for uid in _all_uids():
+        for ev in planner_events(uid):
+            days_prior = next((d for d, lo in windows if lo <= ev.minute < lo + 1440), None)
+            if days_prior is None or not EVENT_OR_PERS_RE.search(ev.line):
+                continue
+            dt = ev.dt
+            key = f"{uid}|{ev.uid_event}|{dt.isoformat()}|{days_prior}d"
+            with reminder_lock:
+                if key in sent_reminders:
+                    continue
+            msg = f"{prefixes[days_prior]}:\n{dt.strftime('%Y-%m-%d %H:%M')} {ev.desc} {ev.hashtag}"
+            if _send_reminder(uid, msg, "Multi-day reminder"):
+                _mark_sent(key)
+                log.info(f"Sent {days_prior}d reminder to {uid} for {ev.uid_event}")
+
+def multi_day_reminder_worker():
+    """Send reminders at 14, 7, and 3 days prior to events (for event/pers/control tags)"""
+    last_run_date = None
+    while True:
+        try:
+            with worker_tick("multi_day_reminder", 30):
+                now = datetime.now()
+                if _daily_due(now, 9, last_run_date):
+                    last_run_date = now.date()
+                    multi_day_reminder_tick(now)
+            time.sleep(next_tick_delay("multi_day_reminder"))
+        except Exception as e:
+            log.error(f"Multi-day reminder worker error: {e}")
+            time.sleep(60)
+
+
+
+def custom_reminder_tick(now=None):
+    """Send the user-defined minutes-before reminders that are due at `now`."""
+    ensure_sent_reminders()
+    now = now or datetime.now()
+    for uid in _all_uids():
+        due = []
+        with reminder_lock:
+            for key in list(sent_reminders.keys()):
+                parts = key.split('|')
+                if len(parts) >= 4 and parts[3].startswith("custom_"):
+                    if sent_reminders[key].get("notified", False):
+                        continue
+
+                    stored_uid, event_uid, event_dt_str, reminder_tag = parts
+
+                    if stored_uid != str(uid):
+                        continue
+
+                    try:
+                        event_dt = datetime.fromisoformat(event_dt_str)
+                        minutes_before = sent_reminders[key]["minutes_before"]
+                        notify_time = event_dt - timedelta(minutes=minutes_before)
+                        time_diff = (notify_time - now).total_seconds()
+
+                        if -60 <= time_diff <= 60:
+                            desc = sent_reminders[key].get("event_desc", "Event")
+                            msg = f"⏰ Custom Reminder ({minutes_before}m before):\n{event_dt.strftime('%H:%M')} {desc}"
+                            due.append((key, msg))
+                    except Exception as e:
+                        log.warning(f"Failed processing custom reminder key {key}: {e}")
+        for key, msg in due:
+            if _send_reminder(uid, msg, "Custom reminder send"):
+                with reminder_lock:
+                    sent_reminders[key]["notified"] = True
+                    save_sent_reminders(sent_reminders)
+
+def custom_reminder_worker():
+    """Check and send user-defined custom reminders based on minutes-before-event"""
+    while True:
+        try:
+            with worker_tick("custom_reminder", 30):
+                custom_reminder_tick()
+            time.sleep(next_tick_delay("custom_reminder"))
+        except Exception as e:
+            log.error(f"Custom reminder worker error: {e}")
+            time.sleep(60)
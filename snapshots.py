@@ -0,0 +1,325 @@
+"""Content-addressed per-user snapshots with restore and diff."""
+import hashlib
+import os
+import re
+import shutil
+import threading
+from datetime import datetime
+
+import codec
+from config import log, MAX_SNAPSHOTS_PER_USER, PLANNER_DIR, SNAPSHOT_DIR, STATE_START
+from storage import (
+    file_lock, ledger_lock, ledger_txn, save_states, state_lock, states, _apply_staged_files, _read_json,
+)
+from transport import send
+from keyboards import main_menu_kb
+from planner import done_file, planner
+from ledger import ArchiveReader, format_entry, format_inc_entry, invalidate_user_caches, LEGACY_VIEW_RE
+
+# ================= SNAPSHOT SYSTEM =================
+# Content-addressed snapshots:
+#
+#   snapshots/blobs/ab/abcd…   file contents, stored once per sha256
+#   snapshots/manifests/{uid}/{ts}.json
+#       {"ts": ..., "files": {fname: {"sha", "size", "mtime_ns"}}, "state": {...}}
+#
+# A file whose size and mtime match the previous manifest is not even read,
+# so a nightly snapshot costs I/O proportional to what changed.
+
+SNAPSHOT_BLOB_DIR = os.path.join(SNAPSHOT_DIR, "blobs")
+SNAPSHOT_MANIFEST_DIR = os.path.join(SNAPSHOT_DIR, "manifests")
+snapshot_lock = threading.RLock()   # create/prune/gc never interleave
+
+def snapshot_files_for_user(uid):
+    """Return list of source file paths that belong to this user."""
+    uid = str(uid)
+    # "12" must not pick up "123plan.txt": every per-user suffix starts with a letter
+    owned = re.compile(rf"^{re.escape(uid)}[^\d]")
+    files = []
+    for fname in os.listdir(PLANNER_DIR):
+        if owned.match(fname) and not fname.endswith((".tmp", ".wal", ".bak")) and ".corrupt-" not in fname:
+            files.append(os.path.join(PLANNER_DIR, fname))
+    return files
+
+def _blob_path(sha):
+    return os.path.join(SNAPSHOT_BLOB_DIR, sha[:2], sha)
+
+def _store_blob(data):
+    sha = hashlib.sha256(data).hexdigest()
+    path = _blob_path(sha)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        _apply_staged_files({path: data})
+    return sha
+
+def read_blob(sha):
+    with open(_blob_path(sha), "rb") as f:
+        return f.read()
+
+def _manifest_path(uid, ts):
+    return os.path.join(SNAPSHOT_MANIFEST_DIR, str(uid), f"{ts}.json")
+
+def read_manifest(uid, ts):
+    return _read_json(_manifest_path(uid, ts), None)
+
+def create_snapshot(uid):
+    """Record the user's files and states entry as a new manifest; returns (ts, manifest path, files)."""
+    uid = str(uid)
+    ts = datetime.now().strftime("%Y%m%d_%H%M%S")
+    with snapshot_lock:
+        base, n = ts, 1
+        while os.path.exists(_manifest_path(uid, ts)):   # two snapshots within one second
+            ts = f"{base}_{n}"
+            n += 1
+        snaps = list_snapshots(uid)
+        prev = (read_manifest(uid, snaps[-1]) or {}).get("files", {}) if snaps else {}
+        files, new_blobs = {}, 0
+        with ledger_lock(uid).reading():    # no ledger commit half-applied while we read
+            for src in snapshot_files_for_user(uid):
+                fname = os.path.basename(src)
+                st = os.stat(src)
+                old = prev.get(fname)
+                if old and old["size"] == st.st_size and old["mtime_ns"] == st.st_mtime_ns \
+                        and os.path.exists(_blob_path(old["sha"])):
+                    files[fname] = old
+                    continue
+                with open(src, "rb") as f:
+                    data = f.read()
+                sha = hashlib.sha256(data).hexdigest()
+                if not os.path.exists(_blob_path(sha)):
+                    _store_blob(data)
+                    new_blobs += 1
+                files[fname] = {"sha": sha, "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+        # Also snapshot the user's states entry (counters, next_uid, etc.)
+        with state_lock:
+            user_state = codec.loads(codec.dumpb(states.get(uid, {})))
+        path = _manifest_path(uid, ts)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        _apply_staged_files({path: codec.dumps({"ts": ts, "files": files, "state": user_state})})
+
+    log.info(f"Snapshot created for {uid}: {ts} ({len(files)} files, {new_blobs} new blobs)")
+    return ts, path, len(files)
+
+def list_snapshots(uid):
+    """Return sorted list of snapshot timestamps for this user."""
+    folder = os.path.join(SNAPSHOT_MANIFEST_DIR, str(uid))
+    if not os.path.isdir(folder):
+        return []
+    return sorted(name[:-5] for name in os.listdir(folder) if name.endswith(".json"))
+
+def prune_snapshots(uid, gc=True):
+    """
+    Delete oldest snapshots if count exceeds MAX_SNAPSHOTS_PER_USER, then drop
+    orphaned blobs. gc=False leaves the blobs to one gc_snapshot_blobs() call
+    after a batch (it reads every manifest). Returns the number pruned.
+    """
+    uid = str(uid)
+    with snapshot_lock:
+        snaps = list_snapshots(uid)
+        pruned = 0
+        while len(snaps) > MAX_SNAPSHOTS_PER_USER:
+            oldest = snaps.pop(0)
+            os.remove(_manifest_path(uid, oldest))
+            log.info(f"Pruned old snapshot: {uid} {oldest}")
+            pruned += 1
+        if pruned and gc:
+            gc_snapshot_blobs()
+    return pruned
+
+def gc_snapshot_blobs():
+    """Remove blobs no manifest refers to. Returns the number removed."""
+    with snapshot_lock:
+        live = set()
+        for root, _, names in os.walk(SNAPSHOT_MANIFEST_DIR):
+            for name in names:
+                manifest = _read_json(os.path.join(root, name), {})
+                live.update(f["sha"] for f in manifest.get("files", {}).values())
+        removed = 0
+        for root, _, names in os.walk(SNAPSHOT_BLOB_DIR):
+            for sha in names:
+                if sha not in live:
+                    os.remove(os.path.join(root, sha))
+                    removed += 1
+    if removed:
+        log.info(f"Snapshot GC removed {removed} blob(s)")
+    return removed
+
+# ----- restore & diff -----
+SNAPSHOT_DIFF_MAX_LINES = 10   # lines shown per section of a diff report
+
+def _snapshot_side(uid, ts):
+    """
+    {fname: (sha, load)} for a snapshot, or for the user's current files when
+    ts is None. load() returns the bytes; snapshot blobs are only read when needed.
+    """
+    if ts is None:
+        side = {}
+        for src in snapshot_files_for_user(uid):
+            with open(src, "rb") as f:
+                data = f.read()
+            side[os.path.basename(src)] = (hashlib.sha256(data).hexdigest(), lambda d=data: d)
+        return side
+    manifest = read_manifest(uid, ts)
+    if manifest is None:
+        raise ValueError(f"no snapshot {ts}")
+    return {fname: (f["sha"], lambda sha=f["sha"]: read_blob(sha)) for fname, f in manifest["files"].items()}
+
+def _side_lines(side, fname):
+    if fname not in side:
+        return []
+    return [l for l in side[fname][1]().decode("utf-8").splitlines() if l.strip()]
+
+def _side_ledger(uid, side, kind):
+    """{id: entry} for the expense (live + archives) or income ledger of one side."""
+    if kind == "income":
+        names = [f"{uid}income.json"]
+    else:
+        archive = re.compile(rf"^{re.escape(uid)}expenses(_\d{{4}}\.(col|json)|\.json)$")
+        names = sorted(n for n in side if archive.match(n))
+    out = {}
+    for fname in names:
+        if fname not in side:
+            continue
+        data = side[fname][1]()
+        if fname.endswith(".col"):
+            entries = ArchiveReader(fname, data).entries()
+        else:
+            entries = codec.loads(data or b"[]")
+        out.update((e.get("id"), e) for e in entries)
+    return out
+
+def diff_snapshots(uid, old_ts, new_ts=None):
+    """
+    Compare two snapshots (new_ts=None means the current files). Only files
+    whose hashes differ are decoded. Returns a dict of added/removed/changed
+    items per section.
+    """
+    uid = str(uid)
+    old, new = _snapshot_side(uid, old_ts), _snapshot_side(uid, new_ts)
+    names = set(old) | set(new)
+    changed = {f for f in names if old.get(f, (None,))[0] != new.get(f, (None,))[0]}
+    report = {"files_changed": sorted(changed), "files_total": len(names)}
+
+    for section, fname in (("events", f"{uid}plan.txt"), ("done", f"{uid}done.txt")):
+        if fname in changed:
+            before, after = _side_lines(old, fname), _side_lines(new, fname)
+            before_set, after_set = set(before), set(after)
+            report[section] = {
+                "added": [l for l in after if l not in before_set],
+                "removed": [l for l in before if l not in after_set],
+            }
+
+    for section in ("expenses", "income"):
+        prefix = f"{uid}income" if section == "income" else f"{uid}expenses"
+        if not any(f.startswith(prefix) for f in changed):
+            continue
+        kind = "income" if section == "income" else "expense"
+        before, after = _side_ledger(uid, old, kind), _side_ledger(uid, new, kind)
+        report[section] = {
+            "added": [after[i] for i in after if i not in before],
+            "removed": [before[i] for i in before if i not in after],
+            "changed": [(before[i], after[i]) for i in after if i in before and before[i] != after[i]],
+        }
+    return report
+
+def format_snapshot_diff(uid, old_ts, new_ts=None):
+    report = diff_snapshots(uid, old_ts, new_ts)
+    lines = [f"🔍 {old_ts} → {new_ts or 'now'}",
+             f"Files changed: {len(report['files_changed'])} of {report['files_total']}"]
+    if not report["files_changed"]:
+        lines.append("No differences.")
+        return "\n".join(lines)
+
+    def block(title, rows):
+        lines.append(title)
+        for row in rows[:SNAPSHOT_DIFF_MAX_LINES]:
+            lines.append("  " + row)
+        if len(rows) > SNAPSHOT_DIFF_MAX_LINES:
+            lines.append(f"  … and {len(rows) - SNAPSHOT_DIFF_MAX_LINES} more")
+
+    for section, title in (("events", "📅 Events"), ("done", "✅ Completed")):
+        if section in report:
+            d = report[section]
+            block(f"{title}: +{len(d['added'])} / -{len(d['removed'])}",
+                  [f"+ {l}" for l in d["added"]] + [f"- {l}" for l in d["removed"]])
+    for section, title, fmt in (("expenses", "💸 Expenses", format_entry), ("income", "💵 Income", format_inc_entry)):
+        if section in report:
+            d = report[section]
+            rows = [f"+ {fmt(e)}" for e in d["added"]] + [f"- {fmt(e)}" for e in d["removed"]]
+            rows += [f"~ {fmt(a)} → {fmt(b)}" for a, b in d["changed"]]
+            block(f"{title}: +{len(d['added'])} / -{len(d['removed'])} / ~{len(d['changed'])}", rows)
+    return "\n".join(lines)
+
+def restore_snapshot(uid, ts):
+    """
+    Replace the user's files and states entry with snapshot `ts`, all or
+    nothing: every file goes through one ledger transaction (WAL-backed), and
+    the current data is snapshotted first so a restore can itself be undone.
+    Returns the timestamp of that safety snapshot.
+    """
+    uid = str(uid)
+    manifest = read_manifest(uid, ts)
+    if manifest is None:
+        raise ValueError(f"no snapshot {ts}")
+    blobs = {fname: read_blob(f["sha"]) for fname, f in manifest["files"].items()   # outside any lock
+             if not LEGACY_VIEW_RE.match(fname)}     # older snapshots still carry them
+    safety_ts, _, _ = create_snapshot(uid)
+
+    # the line files are written outside ledger transactions, so hold their locks too
+    with ledger_lock(uid).writing(), file_lock(planner(uid)).writing(), file_lock(done_file(uid)).writing():
+        with ledger_txn(uid) as txn:
+            for src in snapshot_files_for_user(uid):
+                if os.path.basename(src) not in blobs:
+                    txn.stage(src, None)
+            for fname, data in blobs.items():
+                txn.stage(os.path.join(PLANNER_DIR, fname), data)
+    invalidate_user_caches(uid)
+
+    restored = dict(manifest.get("state") or {})
+    with state_lock:
+        current = states.get(uid, {})
+        # never hand out an id twice, even if it only existed after the snapshot
+        for counter in ("next_uid", "next_exp_id", "next_inc_id"):
+            if counter in current:
+                restored[counter] = max(restored.get(counter, 1), current[counter])
+        restored["state"] = STATE_START
+        restored["data"] = {}
+        states[uid] = restored
+        save_states()
+    log.info(f"Restored {uid} to snapshot {ts} ({len(blobs)} files; safety snapshot {safety_ts})")
+    return safety_ts
+
+def _restore_in_background(uid, ts):
+    try:
+        safety_ts = restore_snapshot(uid, ts)
+        send(uid, f"♻️ Restored snapshot {ts}.\nYour data before the restore was saved as {safety_ts}.",
+             main_menu_kb())
+    except Exception as e:
+        log.error(f"Restore of {ts} failed for {uid}: {e}")
+        send(uid, f"❌ Restore failed: {e}", main_menu_kb())
+
+def migrate_legacy_snapshots():
+    """Fold old full-copy snapshot folders ({uid}_{ts}/) into the blob store."""
+    legacy = re.compile(r"^(\d+)_(\d{8}_\d{6})$")
+    for name in sorted(os.listdir(SNAPSHOT_DIR)):
+        m = legacy.match(name)
+        folder = os.path.join(SNAPSHOT_DIR, name)
+        if not m or not os.path.isdir(folder):
+            continue
+        uid, ts = m.groups()
+        files, state = {}, {}
+        for fname in os.listdir(folder):
+            src = os.path.join(folder, fname)
+            if fname == "state.json":
+                state = _read_json(src, {})
+                continue
+            with open(src, "rb") as f:
+                data = f.read()
+            st = os.stat(src)
+            files[fname] = {"sha": _store_blob(data), "size": st.st_size, "mtime_ns": 0}
+        path = _manifest_path(uid, ts)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        _apply_staged_files({path: codec.dumps({"ts": ts, "files": files, "state": state})})
+        shutil.rmtree(folder)
+        log.info(f"Migrated legacy snapshot {name}")
@@ -0,0 +1,433 @@
+"""
+On-disk state: per-user states.json, JSON/line file helpers, atomic
+writes and the ledger write-ahead transactions every ledger write goes
+through.
+"""
+import base64
+import itertools
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+
+import codec
+import locks
+import metrics
+from config import FSYNC_WRITES, log, PLANNER_DIR, REMINDER_FILE, STATE_FILE, STATE_START
+
+# ================= THREAD SAFETY (Enhancement 1) =================
+state_lock = metrics.timed_lock("state", threading.RLock())
+reminder_lock = metrics.timed_lock("reminder", threading.RLock())
+_ledger_lock_stats = metrics.lock_stats("ledger")
+_file_lock_stats = metrics.lock_stats("file")
+
+def ledger_lock(uid):
+    """RW lock over one user's expense/income ledgers, totals and cashflow."""
+    return locks.get(f"{uid}ledger", _ledger_lock_stats)
+
+def file_lock(path):
+    """RW lock over one line file such as a user's plan.txt (keyed by file name)."""
+    return locks.get(os.path.basename(path), _file_lock_stats)
+
+# ================= ATOMIC WRITES =================
+# Every rewrite goes to a temp file next to the target, is fsynced and then
+# renamed over it, so a reader sees the old file or the new one, never a
+# torn one. JSON stores also keep the previous generation as <file>.bak
+# (a hard link, not a copy); load_json() falls back to it when the file
+# itself does not parse.
+TEMP_SUFFIX = ".tmp"
+BACKUP_SUFFIX = ".bak"
+
+def _fsync_dir(folder):
+    try:
+        fd = os.open(folder, os.O_RDONLY)
+    except OSError:
+        return                  # e.g. Windows, where directories can't be opened
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+def _keep_backup(path):
+    """Point <path>.bak at the current contents of path, if there are any."""
+    bak = path + BACKUP_SUFFIX
+    tmp = f"{bak}.{threading.get_ident()}{TEMP_SUFFIX}"
+    try:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        try:
+            os.link(path, tmp)
+        except FileNotFoundError:
+            return
+        except OSError:
+            shutil.copyfile(path, tmp)      # no hard links on this filesystem
+        os.replace(tmp, bak)
+    except OSError as e:
+        log.warning(f"Could not keep a backup of {path}: {e}")
+
+def atomic_write(path, data, backup=False, fsync=FSYNC_WRITES, dir_fsync=False):
+    """
+    Replace path with data (str or bytes) in a single rename. backup keeps
+    the replaced version as <path>.bak; dir_fsync also makes the rename
+    itself durable, for commit points.
+    """
+    folder = os.path.dirname(path) or "."
+    tmp = f"{path}.{os.getpid()}-{threading.get_ident()}{TEMP_SUFFIX}"
+    try:
+        with open(tmp, "wb") as f:
+            f.write(data.encode("utf-8") if isinstance(data, str) else data)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        if backup:
+            _keep_backup(path)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+    if dir_fsync:
+        _fsync_dir(folder)
+    note_file_write(path)
+    metrics.file_written(path)
+
+def load_json(path):
+    """
+    Decode a JSON store. A torn or corrupt file is logged and its .bak copy
+    read instead; if that fails too, the error propagates.
+    """
+    try:
+        return codec.read(path)
+    except ValueError as e:
+        bak = path + BACKUP_SUFFIX
+        log.error(f"{path} is corrupt ({e}), reading the previous version from {bak}")
+        return codec.read(bak)
+
+def _quarantine(path):
+    """Move an unreadable store aside so the next write can't bury it."""
+    dest = f"{path}.corrupt-{int(time.time())}"
+    try:
+        os.replace(path, dest)
+        log.error(f"Moved unreadable {path} to {dest}")
+    except OSError as e:
+        log.error(f"Could not move unreadable {path} aside: {e}")
+
+def remove_temp_files(folders):
+    """Delete temp files left by writes that were interrupted; call before any writer starts."""
+    removed = 0
+    for folder in folders:
+        if not os.path.isdir(folder):
+            continue
+        for fname in os.listdir(folder):
+            if fname.endswith(TEMP_SUFFIX):
+                os.remove(os.path.join(folder, fname))
+                removed += 1
+    if removed:
+        log.warning(f"Removed {removed} temp file(s) from interrupted writes")
+    return removed
+
+# ================= STATE STORAGE =================
+def load_states():
+    """
+    states.json, or its .bak copy. Unlike the other stores this never falls
+    back to empty when the file exists: an empty dict would be saved over
+    every user's state on the next message.
+    """
+    if not os.path.exists(STATE_FILE):
+        return {}
+    return load_json(STATE_FILE)
+
+def ensure_states():
+    """Load STATE_FILE into `states` the first time anything needs it."""
+    global _states_loaded
+    if _states_loaded:
+        return
+    with state_lock:
+        if not _states_loaded:
+            for uid, entry in load_states().items():
+                states.setdefault(uid, entry)
+            _states_loaded = True
+
+def save_states():
+    ensure_states()
+    with state_lock:
+        atomic_write(STATE_FILE, codec.dumpb(states), backup=True)
+        metrics.count_dump()
+
+states = {}              # uid -> {"state", "data", ...}, loaded lazily by ensure_states()
+_states_loaded = False
+
+def user(uid):
+    uid = str(uid)
+    ensure_states()
+    with state_lock:
+        if uid not in states:
+            states[uid] = {"state": STATE_START, "data": {}, "next_uid": 1}
+            save_states()
+        return states[uid]
+
+def set_state(uid, s):
+    with state_lock:
+        user(uid)["state"] = s
+        save_states()
+
+def set_data(uid, k, v):
+    with state_lock:
+        user(uid)["data"][k] = v
+        save_states()
+
+def get_data(uid, k, default=None):
+    with state_lock:
+        return user(uid)["data"].get(k, default)
+
+def clear_data(uid):
+    with state_lock:
+        user(uid)["data"] = {}
+        save_states()
+
+def next_uid(uid):
+    with state_lock:
+        val = user(uid).get("next_uid", 1)
+        user(uid)["next_uid"] = val + 1
+        save_states()
+        return f"uid{val}"
+
+def _read_json(path, default):
+    txn = getattr(_txn_local, "txn", None)
+    if txn is not None and path in txn.staged:
+        staged = txn.staged[path]
+        return default if staged is None else codec.loads(staged)
+    if not os.path.exists(path):
+        return default
+    metrics.file_read(path)
+    try:
+        return load_json(path)
+    except Exception as e:
+        log.error(f"Unreadable {path} and no usable backup ({e}); using the default")
+        _quarantine(path)
+        return default
+
+def _read_json_list(path):
+    return _read_json(path, [])
+
+def _iter_json_list(path):
+    """Stream the entries of a JSON list file (or its staged copy) without loading it whole."""
+    txn = getattr(_txn_local, "txn", None)
+    if txn is not None and path in txn.staged:
+        yield from _read_json_list(path)
+        return
+    if not os.path.exists(path):
+        return
+    metrics.file_read(path)
+    yielded = 0
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            for item in codec.iter_array(f):
+                yielded += 1
+                yield item
+    except ValueError as e:
+        log.error(f"Failed reading {path}: {e}")
+        if yielded:
+            raise           # the caller already has part of the list; a silent stop would truncate it
+        # nothing handed out yet, so the last good copy can stand in whole
+        yield from _read_json_list(path)
+
+def _json_exists(path):
+    txn = getattr(_txn_local, "txn", None)
+    if txn is not None and path in txn.staged:
+        return txn.staged[path] is not None
+    return os.path.exists(path)
+
+def _write_json(path, data):
+    txn = getattr(_txn_local, "txn", None)
+    metrics.count_dump()
+    if txn is not None:
+        txn.stage(path, codec.dumps(data))
+        return
+    atomic_write(path, codec.dumpb(data), backup=True)
+
+
+# ================= LEDGER TRANSACTIONS =================
+_txn_local = threading.local()
+commit_hooks = []     # fn(uid) run after each commit, e.g. to drop per-user caches
+
+def ledger_wal_file(uid):
+    return os.path.join(PLANNER_DIR, f"{uid}ledger.wal")
+
+class LedgerTxn:
+    """
+    Staged writes to a user's ledger files, committed all-or-nothing.
+
+    commit() writes every staged file into one WAL record and fsyncs it
+    once; that record is the commit point. The targets are then replaced
+    via temp file + rename without fsyncs of their own (in-place writes,
+    which archive appends use, are fsynced), their folders are fsynced once
+    and the WAL is removed. replay_ledger_wals() finishes any commit
+    interrupted after the WAL fsync.
+    """
+
+    def __init__(self, uid):
+        self.uid = str(uid)
+        self.staged = {}
+
+    def stage(self, path, data):
+        """Stage text, bytes, or None (delete the file on commit)."""
+        self.staged[path] = data
+
+    def stage_write_at(self, path, offset, data):
+        """Stage an in-place write of bytes at `offset` that also truncates the file there."""
+        staged = self.staged.get(path)
+        if isinstance(staged, bytes):
+            self.staged[path] = staged[:offset] + data
+        elif isinstance(staged, dict) and "at" in staged and offset >= staged["at"]:
+            earlier = base64.b64decode(staged["b64"])[:offset - staged["at"]]
+            self.staged[path] = write_at_record(staged["at"], earlier + data)
+        else:
+            self.staged[path] = write_at_record(offset, data)
+
+    def commit(self):
+        if not self.staged:
+            return
+        wal = ledger_wal_file(self.uid)
+        record = {
+            path: {"b64": base64.b64encode(data).decode("ascii")} if isinstance(data, bytes) else data
+            for path, data in self.staged.items()
+        }
+        # the commit point: durable whatever BOT_FSYNC says
+        atomic_write(wal, codec.dumpb({"files": record}), fsync=True, dir_fsync=True)
+        metrics.count_dump()
+        _apply_staged_files(self.staged, fsync=False)
+        os.remove(wal)
+        for hook in commit_hooks:
+            hook(self.uid)
+
+def write_at_record(offset, data):
+    """A staged in-place write (see LedgerTxn.stage_write_at), in the form the WAL stores."""
+    return {"at": offset, "b64": base64.b64encode(data).decode("ascii")}
+
+def _write_at(path, offset, data):
+    """
+    Overwrite path from `offset` with data and cut it there. Re-running it
+    gives the same file, so a replayed WAL can repeat it. Always fsynced:
+    unlike a rename, an in-place write has no old copy to fall back to.
+    """
+    with open(path, "r+b") as f:
+        f.seek(offset)
+        f.write(data)
+        f.truncate()
+        f.flush()
+        os.fsync(f.fileno())
+    note_file_write(path)
+    metrics.file_written(path)
+
+def _apply_staged_files(files, fsync=FSYNC_WRITES):
+    """
+    Write or delete each file. fsync=False is for WAL commits: the WAL
+    already holds the data, so one fsync per folder at the end is enough.
+    """
+    for path, data in files.items():
+        if data is None:
+            for p in (path, path + BACKUP_SUFFIX):
+                if os.path.exists(p):
+                    os.remove(p)
+            note_file_write(path)
+            continue
+        if isinstance(data, dict) and "at" in data:
+            _write_at(path, data["at"], base64.b64decode(data["b64"]))
+            continue
+        if isinstance(data, dict):                 # bytes as stored in the WAL
+            data = base64.b64decode(data["b64"])
+        atomic_write(path, data, backup=path.endswith(".json"), fsync=fsync)
+    if not fsync:
+        for folder in {os.path.dirname(path) or "." for path in files}:
+            _fsync_dir(folder)
+
+@contextmanager
+def ledger_txn(uid):
+    """Group every _write_json in the block into one transaction; nested blocks join the outer one."""
+    outer = getattr(_txn_local, "txn", None)
+    if outer is not None:
+        if outer.uid != str(uid):
+            raise RuntimeError(f"ledger transaction for {uid} nested in one for {outer.uid}")
+        yield outer
+        return
+    txn = LedgerTxn(uid)
+    _txn_local.txn = txn
+    try:
+        yield txn
+    except BaseException:
+        _txn_local.txn = None
+        raise
+    _txn_local.txn = None
+    txn.commit()
+
+def replay_ledger_wals():
+    """Re-apply committed-but-unfinished transactions (remove_temp_files() has dropped uncommitted ones)."""
+    for fname in os.listdir(PLANNER_DIR):
+        path = os.path.join(PLANNER_DIR, fname)
+        if fname.endswith("ledger.wal"):
+            try:
+                files = codec.read(path)["files"]
+                _apply_staged_files(files, fsync=False)
+                log.warning(f"Replayed ledger WAL {fname} ({len(files)} files)")
+            except Exception as e:
+                log.error(f"Failed replaying ledger WAL {fname}: {e}")
+                continue
+            os.remove(path)
+
+def migrate_pretty_json():
+    """
+    Rewrite JSON stores still pretty-printed by older versions in the
+    compact encoding. Old files stay readable either way; this only reclaims
+    the space and the parse time. Each file is replaced atomically.
+    """
+    if codec.PRETTY:
+        return 0
+    paths = [STATE_FILE, REMINDER_FILE]
+    paths += [os.path.join(PLANNER_DIR, f) for f in os.listdir(PLANNER_DIR) if f.endswith(".json")]
+    migrated = 0
+    for path in paths:
+        try:
+            if not os.path.exists(path) or not codec.is_pretty(path):
+                continue
+            _apply_staged_files({path: codec.dumps(codec.read(path))})
+            migrated += 1
+        except Exception as e:
+            log.error(f"Compacting {path} failed: {e}")
+    if migrated:
+        log.info(f"Compacted {migrated} pretty-printed JSON file(s) ({codec.NAME} codec)")
+    return migrated
+
+# ================= LINE FILES =================
+def _read_lines(path):
+    if not os.path.exists(path):
+        return []
+    metrics.file_read(path)
+    with file_lock(path).reading(), open(path, "r", encoding="utf-8") as f:
+        return [l.rstrip() for l in f if l.strip()]
+
+def _write_lines(path, lines):
+    with file_lock(path).writing():
+        atomic_write(path, "".join(l + "\n" for l in lines))
+
+# mtime and size alone miss a same-size rewrite within the filesystem's
+# timestamp granularity, so every write in this process also stamps the path.
+_write_seq = itertools.count(1)
+_write_stamps = {}      # normalized path -> _write_seq value of its last write
+
+def note_file_write(path):
+    """Mark path as written; writers outside atomic_write (appends) call this themselves."""
+    _write_stamps[os.path.normpath(path)] = next(_write_seq)
+
+def _file_version(path):
+    stamp = _write_stamps.get(os.path.normpath(path), 0)
+    try:
+        st = os.stat(path)
+    except OSError:
+        return f"{stamp:x}:0"
+    return f"{stamp:x}:{st.st_mtime_ns:x}:{st.st_size:x}"
@@ -0,0 +1,39 @@
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import PLANNER_DIR
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    """Run the test in an empty data directory; the modules use relative paths."""
+    monkeypatch.chdir(tmp_path)
+    os.makedirs(PLANNER_DIR)
+    return tmp_path
+
+
+@pytest.fixture
+def sent(monkeypatch):
+    """Capture what handlers send instead of calling VK: a list of (uid, text, kb)."""
+    import handlers
+    messages = []
+    monkeypatch.setattr(handlers, "send", lambda uid, text, kb=None, attachment=None:
+                        messages.append((str(uid), text, kb)))
+    return messages
+
+
+@pytest.fixture
+def say(sent):
+    """Feed a text message from `uid` through handlers.handle_message."""
+    import handlers
+    from vk_api.longpoll import VkEventType
+
+    def say(uid, text):
+        handlers.handle_message(SimpleNamespace(type=VkEventType.MESSAGE_NEW, to_me=True, user_id=uid,
+                                                peer_id=uid, message_id=0, text=text, attachments=None))
+    return say
@@ -0,0 +1,99 @@
+import os
+
+import pytest
+
+pytest.importorskip("vk_api")
+
+import ledger
+from config import PLANNER_DIR
+from ledger import ARCHIVE_GROUP_ROWS, ArchiveReader, encode_archive, _totals_row_for, _month_key
+
+CATS = ["food", "transport", "notmy", "other"]
+
+
+def _entries(n):
+    entries = []
+    for i in range(n):
+        e = {"id": f"e{i}", "dt": f"2025-{i % 12 + 1:02d}-{i % 28 + 1:02d}T12:{i % 60:02d}",
+             "amount": i * 10 if i % 3 else i + 0.25, "category": CATS[i % len(CATS)],
+             "desc": f"item {i}" if i % 5 else ""}
+        if i % 2:
+            e["tool"] = "gp"
+        if i % 7 == 0:
+            e["note"] = {"split": i}         # unknown keys survive in the extra column
+        entries.append(e)
+    return entries
+
+
+def test_round_trip_across_row_groups():
+    entries = _entries(ARCHIVE_GROUP_ROWS * 2 + 17)
+    reader = ArchiveReader("mem.col", data=encode_archive(entries))
+
+    assert [g["rows"] for g in reader.groups()] == [ARCHIVE_GROUP_ROWS, ARCHIVE_GROUP_ROWS, 17]
+    assert reader.entries() == entries
+    assert [type(a) for a in reader.column("amount")] == [type(e["amount"]) for e in entries]
+    assert reader.column("category") == [e["category"] for e in entries]
+
+
+def test_footer_totals_carry_month_checksums():
+    entries = _entries(300)
+    footer = ArchiveReader("mem.col", data=encode_archive(entries)).footer
+    by_month = {}
+    for e in entries:
+        by_month.setdefault(_month_key(e["dt"]), []).append(e)
+
+    assert footer["rows"] == len(entries)
+    assert footer["months"] == {mk: _totals_row_for(rows) for mk, rows in by_month.items()}
+    changed = dict(entries[0], amount=entries[0]["amount"] + 1)
+    jan = by_month[_month_key(changed["dt"])]
+    assert _totals_row_for([changed] + jan[1:])["checksum"] != footer["months"]["2025-01"]["checksum"]
+
+
+def test_archive_on_disk_and_in_transaction(data_dir):
+    entries = _entries(40)
+    ledger.write_archive("7", 2025, entries)
+    assert ledger.read_archived_expenses("7", 2025) == entries
+    assert ledger.archive_month_summaries("7", 2025)["2025-03"]["count"] == 4
+
+    with ledger.ledger_txn("7"):
+        ledger.write_archive("7", 2025, entries[:10])
+        assert ledger.read_archived_expenses("7", 2025) == entries[:10]   # staged copy wins
+    assert ledger.read_archived_expenses("7", 2025) == entries[:10]
+
+
+def test_truncated_archive_is_rejected(data_dir):
+    path = os.path.join(PLANNER_DIR, "7expenses_2025.col")
+    with open(path, "wb") as f:
+        f.write(encode_archive(_entries(5))[:-3])
+    with pytest.raises(ValueError):
+        ArchiveReader(path)
+
+
+def test_append_adds_row_groups_without_rewriting(data_dir):
+    entries = _entries(60)
+    path = os.path.join(PLANNER_DIR, "7expenses_2025.col")
+    ledger.write_archive("7", 2025, entries[:40])
+    with open(path, "rb") as f:
+        before = f.read()
+    old_footer_offset = ArchiveReader(path).footer_offset
+
+    with ledger.ledger_lock("7").writing(), ledger.ledger_txn("7"):
+        assert ledger.append_archive("7", 2025, entries[30:]) == 20      # 30..39 are already archived
+    reader = ArchiveReader(path)
+    with open(path, "rb") as f:
+        assert f.read(old_footer_offset) == before[:old_footer_offset]    # old groups untouched
+    assert [g["rows"] for g in reader.groups()] == [40, 20]
+    assert reader.entries() == entries
+    assert reader.footer["months"] == ArchiveReader("mem.col", data=encode_archive(entries)).footer["months"]
+
+
+def test_archive_user_expenses_appends(data_dir):
+    from datetime import date, datetime
+    for month in (1, 2, 3, 9):
+        ledger.save_expense("7", 100, "food", f"m{month}", dt=datetime(2025, month, 10, 12))
+    assert ledger.archive_user_expenses("7", date(2025, 2, 1)) == 1
+    assert ledger.archive_user_expenses("7", date(2025, 4, 1)) == 2
+    reader = ArchiveReader(os.path.join(PLANNER_DIR, "7expenses_2025.col"))
+    assert [e["desc"] for e in reader.entries()] == ["m1", "m2", "m3"]
+    assert [g["rows"] for g in reader.groups()] == [1, 2]
+    assert [e["desc"] for e in ledger.read_expenses("7")] == ["m9"]
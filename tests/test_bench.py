@@ -0,0 +1,43 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+import bench
+
+SMALL = ["--users", "5", "--plan-lines", "5", "--heavy-plan-lines", "20", "--years", "1",
+         "--per-month", "5", "--custom-reminders", "5", "--repeat", "2"]
+
+
+def test_measure_reports_millisecond_stats():
+    calls = []
+    stats = bench.measure(lambda: calls.append("run"), 3, setup=lambda: calls.append("setup"))
+    assert calls == ["setup", "run"] * 3
+    assert stats["n"] == 3
+    assert stats["min_ms"] <= stats["median_ms"] <= stats["max_ms"]
+
+
+def test_small_run_emits_every_benchmark_and_cleans_up(tmp_path):
+    pytest.importorskip("vk_api")
+    scratch = tmp_path / "tmp"
+    scratch.mkdir()
+    env = dict(os.environ, TMPDIR=str(scratch), PYTHONPATH=os.pathsep.join(sys.path))
+    run = subprocess.run([sys.executable, bench.__file__, *SMALL, "--out", "run.json"],
+                         cwd=tmp_path, env=env, capture_output=True, text=True)
+    assert run.returncode == 0, run.stderr
+
+    result = json.loads((tmp_path / "run.json").read_text())
+    assert result == json.loads(run.stdout)
+    assert {"save_expense", "this_month_report", "day_groups_format", "pagination_two_pages",
+            "hourly_reminder_tick", "custom_reminder_tick", "import_and_init"} <= set(result["results"])
+    assert all(r["n"] == 2 for r in result["results"].values())
+    assert result["meta"]["args"]["users"] == 5
+    assert list(scratch.iterdir()) == []                    # the working directory is gone
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["run.json", "tmp"]
+
+    again = subprocess.run([sys.executable, bench.__file__, *SMALL, "--compare", "run.json"],
+                           cwd=tmp_path, env=env, capture_output=True, text=True)
+    assert again.returncode == 0
+    assert "median vs baseline:" in again.stderr and "save_expense" in again.stderr
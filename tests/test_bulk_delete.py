@@ -0,0 +1,60 @@
+from datetime import datetime
+
+import pytest
+
+pytest.importorskip("vk_api")
+
+import ledger
+from ledger import _totals_row_for
+
+
+def _count_writes(monkeypatch, *names):
+    calls = {name: 0 for name in names}
+    for name in names:
+        real = getattr(ledger, name)
+        def counted(*args, _name=name, _real=real, **kwargs):
+            calls[_name] += 1
+            return _real(*args, **kwargs)
+        monkeypatch.setattr(ledger, name, counted)
+    return calls
+
+
+def test_expenses_go_in_one_rewrite(data_dir, monkeypatch):
+    uid = "bd1"
+    saved = [ledger.save_expense(uid, 10 * i, "food", f"e{i}", dt=datetime(2026, 1 + i % 2, i, 9, 0))
+             for i in range(1, 7)]
+    calls = _count_writes(monkeypatch, "write_expenses", "_save_totals", "_save_cashflow")
+
+    removed = ledger.delete_expenses_by_ids(uid, [saved[4]["id"], saved[1]["id"], "e-missing", saved[0]["id"]])
+    assert [e["id"] for e in removed] == [saved[0]["id"], saved[1]["id"], saved[4]["id"]]
+    assert calls == {"write_expenses": 1, "_save_totals": 1, "_save_cashflow": 1}
+
+    kept = ledger.read_expenses(uid)
+    assert [e["desc"] for e in kept] == ["e3", "e4", "e6"]
+    totals = ledger.read_totals(uid)
+    assert totals["2026-02"] == _totals_row_for([kept[0]])
+    assert totals["2026-01"] == _totals_row_for(kept[1:])
+    assert ledger.read_cashflow(uid)["2026-01"]["expense"] == 100
+
+
+def test_nothing_matching_writes_nothing(data_dir, monkeypatch):
+    uid = "bd2"
+    ledger.save_expense(uid, 10, "food", "", dt=datetime(2026, 1, 1, 9, 0))
+    calls = _count_writes(monkeypatch, "write_expenses", "write_income")
+    assert ledger.delete_expenses_by_ids(uid, ["nope"]) == []
+    assert ledger.delete_income_by_ids(uid, ["nope"]) == []
+    assert calls == {"write_expenses": 0, "write_income": 0}
+
+
+def test_income_goes_in_one_rewrite(data_dir, monkeypatch):
+    uid = "bd3"
+    saved = [ledger.save_income(uid, 100 * i, f"i{i}", dt=datetime(2026, 3, i, 9, 0)) for i in range(1, 4)]
+    calls = _count_writes(monkeypatch, "write_income", "_save_inc_totals", "_save_cashflow")
+
+    removed = ledger.delete_income_by_ids(uid, [saved[2]["id"], saved[0]["id"]])
+    assert [e["desc"] for e in removed] == ["i1", "i3"]
+    assert calls == {"write_income": 1, "_save_inc_totals": 1, "_save_cashflow": 1}
+    assert ledger.read_inc_totals(uid)["2026-03"]["total"] == 200
+    assert ledger.read_cashflow(uid)["2026-03"]["income"] == 200
+    assert ledger.delete_income_by_id(uid, saved[1]["id"])["desc"] == "i2"
+    assert ledger.read_income(uid) == []
@@ -0,0 +1,51 @@
+import os
+from datetime import datetime
+
+import pytest
+
+pytest.importorskip("vk_api")
+
+import ledger
+
+
+def test_saves_and_deletes_keep_net_and_running_balance(data_dir):
+    uid = "cf1"
+    ledger.save_income(uid, 1000, "salary", dt=datetime(2026, 1, 5, 9, 0))
+    rent = ledger.save_expense(uid, 400, "home", "rent", dt=datetime(2026, 1, 6, 9, 0))
+    ledger.save_expense(uid, 150.5, "food", "", dt=datetime(2026, 2, 1, 9, 0))
+    ledger.save_income(uid, 200, "bonus", dt=datetime(2026, 3, 1, 9, 0))
+
+    table = ledger.read_cashflow(uid)
+    assert table == {
+        "2026-01": {"income": 1000, "expense": 400, "net": 600, "balance": 600},
+        "2026-02": {"income": 0.0, "expense": 150.5, "net": -150.5, "balance": 449.5},
+        "2026-03": {"income": 200, "expense": 0.0, "net": 200, "balance": 649.5},
+    }
+
+    ledger.delete_expenses_by_ids(uid, [rent["id"]])
+    table = ledger.read_cashflow(uid)
+    assert table["2026-01"]["expense"] == 0
+    assert [table[mk]["balance"] for mk in sorted(table)] == [1000, 849.5, 1049.5]
+
+
+def test_table_is_rebuilt_from_totals_when_missing(data_dir):
+    uid = "cf2"
+    ledger.save_income(uid, 500, "", dt=datetime(2026, 4, 1, 9, 0))
+    ledger.save_expense(uid, 120, "food", "", dt=datetime(2026, 5, 1, 9, 0))
+    incremental = ledger.read_cashflow(uid)
+
+    os.remove(ledger.cashflow_file(uid))
+    assert ledger.read_cashflow(uid) == incremental
+    assert os.path.exists(ledger.cashflow_file(uid))
+
+
+def test_report_is_cached_until_the_table_changes(data_dir):
+    uid = "cf3"
+    assert ledger.format_cashflow_report(uid) == "No income or expense history yet."
+    ledger.save_income(uid, 1000, "", dt=datetime(2026, 6, 1, 9, 0))
+    report = ledger.format_cashflow_report(uid)
+    assert "2026-06" in report and "+1,000" in report
+    assert ledger.format_cashflow_report(uid) is report
+
+    ledger.save_expense(uid, 300, "food", "", dt=datetime(2026, 6, 2, 9, 0))
+    assert "= +700" in ledger.format_cashflow_report(uid)
@@ -0,0 +1,87 @@
+import io
+import json
+
+import pytest
+
+import codec
+from codec import iter_array
+
+SAMPLES = [
+    [],
+    [0.5, 1],
+    [1e-07, -2.5E+3, 0, -0.0, 123456789012345678901234567890],
+    ["", "a,b]", "quote \" and \\ backslash", "unicode ✓ кириллица", "é\n"],
+    [True, False, None, 1.0],
+    [{"id": "e1", "dt": "2026-10-01T12:00", "amount": 450.25, "category": "food"}, {"nested": [1, [2, {"x": 3.75}]]}],
+]
+
+
+def _decode(text, chunk, monkeypatch):
+    monkeypatch.setattr(codec, "CHUNK_SIZE", chunk)
+    return list(iter_array(io.StringIO(text)))
+
+
+@pytest.mark.parametrize("sample", SAMPLES)
+@pytest.mark.parametrize("indent", [None, 2])
+def test_every_chunk_boundary(sample, indent, monkeypatch):
+    text = json.dumps(sample, indent=indent, ensure_ascii=False)
+    for chunk in range(1, len(text) + 2):
+        assert _decode(text, chunk, monkeypatch) == sample, f"chunk size {chunk}"
+
+
+def test_number_cut_after_point(monkeypatch):
+    assert _decode("[0.5, 1]", 3, monkeypatch) == [0.5, 1]
+    assert _decode("[12e3,4]", 4, monkeypatch) == [12000.0, 4]
+
+
+@pytest.mark.parametrize("text", ["{}", "[1, 2", "[0.]", '["a]'])
+def test_invalid_input_raises(text, monkeypatch):
+    with pytest.raises(ValueError):
+        _decode(text, 2, monkeypatch)
+
+
+def test_ledger_stream_fails_loudly_mid_file(data_dir, monkeypatch):
+    from storage import _iter_json_list
+    path = data_dir / "planners" / "7expenses.json"
+    path.write_text('[{"id": "e1"}, {"id": "e2"}, {"id": ')
+    monkeypatch.setattr(codec, "CHUNK_SIZE", 8)
+    seen = []
+    with pytest.raises(ValueError):
+        for e in _iter_json_list(str(path)):
+            seen.append(e["id"])
+    assert seen == ["e1", "e2"]
+
+
+def test_output_is_compact_utf8_and_round_trips():
+    obj = {"desc": "кофе ✓", "amounts": [1, 2.5], "big": 2 ** 70, "none": None}
+    text = codec.dumps(obj)
+    assert "\\u" not in text and ", " not in text and "\n" not in text
+    assert codec.dumpb(obj) == text.encode("utf-8")
+    assert codec.loads(text) == codec.loads(text.encode("utf-8")) == obj
+
+
+def test_files_from_older_versions_still_read(tmp_path):
+    old = tmp_path / "old.json"
+    old.write_text(json.dumps({"x": float("nan"), "y": "к"}, indent=2))
+    data = codec.read(str(old))
+    assert data["y"] == "к" and data["x"] != data["x"]
+    assert codec.is_pretty(str(old))
+    old.write_text(codec.dumps({"y": 1}))
+    assert not codec.is_pretty(str(old))
+
+
+def test_migrate_pretty_json_compacts_only_old_files(data_dir, monkeypatch):
+    from config import PLANNER_DIR
+    from storage import migrate_pretty_json
+    monkeypatch.setattr(codec, "PRETTY", False)
+    pretty = data_dir / PLANNER_DIR / "7expenses.json"
+    compact = data_dir / PLANNER_DIR / "7income.json"
+    entries = [{"id": "e1", "desc": "кофе"}]
+    pretty.write_text(json.dumps(entries, indent=2), encoding="utf-8")
+    compact.write_text(codec.dumps(entries), encoding="utf-8")
+    before = compact.stat().st_mtime_ns
+
+    assert migrate_pretty_json() == 1
+    assert pretty.read_text(encoding="utf-8") == codec.dumps(entries)
+    assert compact.stat().st_mtime_ns == before
+    assert migrate_pretty_json() == 0
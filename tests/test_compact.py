@@ -0,0 +1,58 @@
+from datetime import datetime
+
+import pytest
+
+pytest.importorskip("vk_api")
+
+from ledger import Entry
+from planner import (
+    append_event, minute_date, minute_text, parse_event_line, planner_events, to_minute, write_events,
+)
+
+
+@pytest.mark.parametrize("d", [
+    {"id": "e1", "dt": "2026-03-15T18:42", "amount": 450, "category": "food", "desc": "coffee", "tool": "gp"},
+    {"id": "e2", "dt": "2026-03-15T18:42", "amount": 0.3, "category": "fun"},
+    {"id": "e3", "dt": "2026-03-15T18:42:07", "amount": 12.34, "category": "other", "desc": ""},
+    {"id": "e4", "dt": "2026-03-15", "amount": 1, "category": "food", "desc": "bare date"},
+    {"id": "e5", "dt": "last tuesday", "amount": 1, "category": "food", "desc": "garbage date"},
+    {"id": "e6", "dt": "2026-03-15T18:42", "amount": 5, "category": "brand-new", "desc": "",
+     "tool": "newcard", "note": {"split": 2}},
+])
+def test_entry_round_trips(d):
+    e = Entry.from_dict(d)
+    assert e.to_dict() == d
+    assert e["dt"] == d["dt"] and e["amount"] == d["amount"]
+    assert e.get("tool") == d.get("tool")
+    assert ("tool" in e) == ("tool" in d)
+    assert not hasattr(e, "__dict__")
+
+
+def test_entry_lookup_matches_a_dict():
+    e = Entry.from_dict({"id": "e1", "dt": "2026-03-15T18:42", "amount": 450, "category": "food"})
+    assert e.minute == to_minute(datetime(2026, 3, 15, 18, 42))
+    assert e.kopecks == 45000
+    assert e.get("desc", "-") == "-" and e.get("nope") is None
+    with pytest.raises(KeyError):
+        e["nope"]
+
+
+def test_minutes_round_trip():
+    dt = datetime(2026, 10, 19, 23, 59)
+    assert minute_text(to_minute(dt)) == "2026-10-19T23:59"
+    assert minute_date(to_minute(dt)) == dt.date()
+
+
+def test_planner_events_parse_once_per_file_version(data_dir):
+    uid = "cp1"
+    lines = ["2026-05-01T10:00 dentist #health uid17", "not a date line", "2026-05-02T09:30 walk"]
+    write_events(uid, lines)
+    events = planner_events(uid)
+    assert [ev.line for ev in events] == [lines[0], lines[2]]
+    for ev in events:
+        dt, desc, hashtag, uid_event, _ = parse_event_line(ev.line)
+        assert (ev.dt, ev.desc, ev.hashtag, ev.uid_event) == (dt, desc, hashtag, uid_event)
+    assert planner_events(uid) is events
+
+    append_event(uid, "2026-05-03T08:00 gym")
+    assert len(planner_events(uid)) == 3
@@ -0,0 +1,89 @@
+import csv
+import io
+import json
+import os
+from datetime import datetime
+
+import pytest
+
+pytest.importorskip("vk_api")
+
+import ledger
+from planner import append_done, append_event
+
+
+def _seed(uid):
+    ledger.write_archive(uid, 2025, [
+        {"id": "e1", "dt": "2025-12-31T23:00", "amount": 12.5, "category": "food", "desc": "old"}])
+    ledger.save_expense(uid, 300, "fun", "cinema; 2D", dt=datetime(2026, 1, 10, 19, 0), tool="gp")
+    ledger.save_income(uid, 1000, "salary", dt=datetime(2026, 1, 11, 9, 0))
+    append_event(uid, "2026-01-20T10:00 dentist #health")
+    append_done(uid, "2026-01-05T10:00 gym")
+
+
+def _ics(uid):
+    out = io.StringIO(newline="")
+    count = ledger.export_ics(uid, out)
+    return count, out.getvalue()
+
+
+def test_ics_folds_long_lines_at_75_octets(data_dir):
+    desc = "встреча " * 30
+    append_event("7", f"2026-03-15T10:00 {desc.strip()} #work uid123")
+    count, text = _ics("7")
+    assert count == 1
+    lines = text.split("\r\n")
+    assert all(len(l.encode("utf-8")) <= 75 for l in lines)
+    assert any(l.startswith(" ") for l in lines)
+    unfolded = text.replace("\r\n ", "")
+    assert f"SUMMARY:{desc.strip()} #work\r\n" in unfolded
+    assert "CATEGORIES:work\r\n" in unfolded
+
+
+def test_csv_and_jsonl_cover_archive_live_and_planner(data_dir):
+    _seed("ex1")
+    path, rows = ledger.export_user("ex1", "csv")
+    assert rows == 3
+    with open(path, encoding="utf-8", newline="") as f:
+        table = list(csv.reader(f))
+    assert table[0] == ledger.EXPORT_CSV_COLUMNS
+    assert [r[0] for r in table[1:]] == ["expense", "expense", "income"]
+    assert table[2][2:] == ["2026-01-10T19:00", "300", "fun", "gp", "cinema; 2D"]
+
+    path, rows = ledger.export_user("ex1", "jsonl")
+    with open(path, encoding="utf-8") as f:
+        records = [json.loads(l) for l in f]
+    assert rows == len(records) == 5
+    assert [r["kind"] for r in records] == ["expense", "expense", "income", "event", "done"]
+    assert records[0]["desc"] == "old"
+    assert records[3]["line"] == "2026-01-20T10:00 dentist #health"
+
+
+def test_ics_has_one_vevent_per_planned_or_done_line(data_dir):
+    _seed("ex2")
+    count, text = _ics("ex2")
+    assert count == 2
+    assert text.startswith("BEGIN:VCALENDAR\r\n") and text.endswith("END:VCALENDAR\r\n")
+    assert "DTSTART:20260120T100000\r\nSUMMARY:dentist #health\r\nCATEGORIES:health\r\n" in text
+    assert "SUMMARY:gym\r\nCATEGORIES:done\r\n" in text
+
+
+def test_default_paths_are_unique_and_send_export_cleans_up(data_dir, monkeypatch):
+    _seed("3603")
+    first, _ = ledger.export_user("3603", "jsonl")
+    second, _ = ledger.export_user("3603", "jsonl")
+    assert first != second
+    assert os.path.basename(os.path.dirname(first)) == ledger.EXPORT_DIR
+    assert os.path.basename(first).startswith("3603_") and first.endswith(".jsonl")
+
+    uploads, messages = [], []
+    monkeypatch.setattr(ledger, "upload_document", lambda path, peer, title: uploads.append(path) or "doc1_2")
+    monkeypatch.setattr(ledger, "send", lambda uid, text, kb=None, attachment=None: messages.append((text, attachment)))
+    ledger._export_in_background("3603", "csv")
+    assert messages == [("📤 Export (csv, 3 rows)", "doc1_2")]
+    assert not os.path.exists(uploads[0])
+
+    monkeypatch.setattr(ledger, "upload_document", lambda *a, **k: 1 / 0)
+    ledger._export_in_background("3603", "csv")
+    assert messages[-1][0].startswith("❌ Export failed:")
+    assert len(os.listdir(ledger.EXPORT_DIR)) == 2              # only the two exports made above
@@ -0,0 +1,65 @@
+import json
+
+import pytest
+
+pytest.importorskip("vk_api")
+
+import fakevk
+import transport
+from vk_api.exceptions import ApiError
+
+
+@pytest.fixture
+def fake_vk(monkeypatch):
+    """Point transport at a fresh FakeVkServer; returns a function that installs one."""
+    monkeypatch.setattr(transport.time, "sleep", lambda s: None)
+
+    def install(**kw):
+        session = fakevk.FakeVkSession(fakevk.FakeVkServer(**kw))
+        monkeypatch.setattr(transport, "_session", session)
+        monkeypatch.setattr(transport.vk, "_api", session.get_api())
+        monkeypatch.setattr(transport, "BOT_TRANSPORT", "fake")
+        return session.server
+    return install
+
+
+def test_script_is_replayed_and_reported(tmp_path):
+    report = tmp_path / "report.json"
+    server = fakevk.FakeVkServer(script=[{"uid": 1, "text": "Budget"}, {"uid": "2", "text": "/today"}],
+                                 report_path=str(report))
+    session = fakevk.FakeVkSession(server)
+    api = session.get_api()
+    events = []
+    for ev in fakevk.FakeLongPoll(session).listen():
+        events.append((ev.user_id, ev.text, ev.message_id))
+        api.messages.send(user_id=ev.user_id, message="ok")
+
+    assert events == [(1, "Budget", 1), (2, "/today", 2)]
+    assert api.messages.getById(message_ids=2)["items"][0]["text"] == "/today"
+    data = json.loads(report.read_text())
+    assert (data["events"], data["sends"]) == (2, 2)
+    assert data["sends_per_uid"] == {"1": 1, "2": 1}
+
+
+def test_send_retries_flood_control(fake_vk):
+    server = fake_vk(flood_every=2)
+    transport.send(1, "first")
+    transport.send(1, "second")              # call 2 is refused, call 3 goes through
+    assert [kw["message"] for _, _, kw in server.sent] == ["first", "second"]
+    assert server.flood_errors == 1
+
+
+def test_send_gives_up_after_the_retry_budget(fake_vk):
+    server = fake_vk(flood_every=1)
+    with pytest.raises(ApiError):
+        transport.send(1, "never")
+    assert server.flood_errors == transport.SEND_RETRIES + 1
+    assert server.sent == []
+
+
+def test_uploads_go_to_the_fake_server(fake_vk, tmp_path):
+    server = fake_vk()
+    path = tmp_path / "export.csv"
+    path.write_text("kind\n")
+    assert transport.upload_document(str(path), 5, title="export.csv") == "doc-1_1"
+    assert server.uploads == [(5, "export.csv", 5)]
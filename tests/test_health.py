@@ -0,0 +1,63 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+import health
+
+
+@pytest.fixture
+def clock(data_dir, monkeypatch):
+    """A fake clock for health, with no workers seen yet; advance with clock.now += seconds."""
+    clock = SimpleNamespace(now=1_000_000.0)
+    monkeypatch.setattr(health, "time", SimpleNamespace(time=lambda: clock.now, perf_counter=lambda: clock.now))
+    monkeypatch.setattr(health, "_worker_health", {})
+    monkeypatch.setattr(health, "_health_written", clock.now)
+    return clock
+
+
+def test_tick_counts_and_schedule(clock):
+    with health.worker_tick("hourly", 60) as tick:
+        health.tick_count("users", 3)
+        health.tick_count("sent")
+        tick["backlog"] = 5
+        clock.now += 2
+    health.tick_count("users")                 # outside a pass: ignored
+    assert health.next_tick_delay("hourly") == 58
+    assert health.next_tick_delay("unknown") == 0
+
+    clock.now += 70                            # next pass starts 10 s late
+    with health.worker_tick("hourly", 60):
+        clock.now += 1
+    h = health.worker_health()["hourly"]
+    assert (h["ticks"], h["users"], h["sent"], h["backlog"]) == (2, 0, 0, 5)
+    assert (h["drift"], h["duration"], h["max_duration"]) == (12, 1, 2)
+    assert h["running"] is False and not h["overrun"]
+
+
+def test_failed_pass_is_recorded_and_reraised(clock):
+    with pytest.raises(RuntimeError):
+        with health.worker_tick("reconcile", 300):
+            raise RuntimeError("disk full")
+    h = health.worker_health()["reconcile"]
+    assert h["errors"] == 1 and h["last_error"].endswith(" disk full")
+    assert "last_ok" not in h
+    assert "⚠️ reconcile" in health.format_status()
+    assert "1 error(s), last:" in health.format_status()
+
+
+def test_lag_overrun_and_health_file(clock):
+    with health.worker_tick("digest", 10) as tick:
+        tick["users"] = 4
+        clock.now += 15                        # longer than its period
+    clock.now += 100
+    h = health.worker_health()["digest"]
+    assert h["overrun"] and h["lag"] == 105              # 115 s since it started, period 10
+    status = health.format_status()
+    assert "⚠️ digest:" in status and "lag 105 s" in status and "4 users" in status
+
+    health.write_health()
+    with open(health.HEALTH_FILE, encoding="utf-8") as f:
+        written = json.load(f)
+    assert written["workers"]["digest"]["ticks"] == 1
+    assert written["uptime_s"] == int(clock.now - health.BOOT_TIME)
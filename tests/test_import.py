@@ -0,0 +1,92 @@
+import io
+import os
+import subprocess
+import sys
+from datetime import datetime
+
+import pytest
+
+pytest.importorskip("vk_api")
+
+import ledger
+from ledger import iter_import_rows
+
+BOT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "bot.py")
+
+STATEMENT = (
+    "Дата операции;Сумма операции;Описание;Карта\n"
+    "03.02.2026 12:15;-1 250,50;Кафе Ромашка;Халва\n"
+    "04.02.2026;+5000;Зарплата;\n"
+    "05.02.2026 08:00;-320;Яндекс Такси;\n"
+    "not a date;-10;?;\n"
+)
+
+
+def _write(path, text, encoding="utf-8"):
+    with open(path, "w", encoding=encoding, newline="") as f:
+        f.write(text)
+    return str(path)
+
+
+def test_statement_rows_are_mapped(data_dir):
+    rows = list(iter_import_rows(io.StringIO(STATEMENT), signed=True))
+    assert rows == [
+        ({"dt": "2026-02-03T12:15", "amount": 1250.5, "category": "food", "desc": "Кафе Ромашка",
+          "tool": "hal"}, None),
+        (None, "amount"),                        # a credit, not an expense
+        ({"dt": "2026-02-05T08:00", "amount": 320, "category": "transport", "desc": "Яндекс Такси",
+          "tool": "ya"}, None),
+        (None, "date"),
+    ]
+    with pytest.raises(ValueError):
+        list(iter_import_rows(io.StringIO("when,what\n2026-01-01,x\n")))
+
+
+def test_import_dedupes_and_updates_aggregates(data_dir):
+    uid = "im1"
+    kept = ledger.save_expense(uid, 320, "transport", "Яндекс Такси", dt=datetime(2026, 2, 5, 8, 0))
+    path = _write(data_dir / "bank.csv", STATEMENT, encoding="cp1251")
+
+    summary = ledger.import_expenses(uid, path, signed=True)
+    assert summary == {"added": 1, "duplicates": 1, "skipped": 2, "months": ["2026-02"]}
+    entries = ledger.read_expenses(uid)
+    assert [e["amount"] for e in entries] == [1250.5, 320]
+    assert len({e["id"] for e in entries}) == 2 and kept in entries
+    assert ledger.read_totals(uid)["2026-02"]["count"] == 2
+    assert ledger.read_cashflow(uid)["2026-02"]["expense"] == 1570.5
+
+    again = ledger.import_expenses(uid, path, signed=True)
+    assert (again["added"], again["duplicates"]) == (0, 2)
+
+
+def test_own_csv_export_imports_back(data_dir):
+    ledger.save_expense("im2", 99.9, "fun", "cinema, late", dt=datetime(2026, 3, 1, 20, 30), tool="gp")
+    ledger.save_income("im2", 1000, "salary", dt=datetime(2026, 3, 2, 9, 0))
+    path, rows = ledger.export_user("im2", "csv")
+    assert rows == 2
+
+    assert ledger.import_expenses("im3", path)["added"] == 1       # the income row is skipped
+    (e,) = ledger.read_expenses("im3")
+    assert {k: e[k] for k in ("dt", "amount", "category", "desc", "tool")} == {
+        "dt": "2026-03-01T20:30", "amount": 99.9, "category": "fun", "desc": "cinema, late", "tool": "gp"}
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="needs fcntl")
+def test_cli_import_refuses_while_the_bot_holds_the_data_dir(data_dir):
+    import fcntl
+    from locks import LOCK_DIR, OWNER_LOCK
+
+    path = _write(data_dir / "bank.csv", STATEMENT)
+    os.makedirs(LOCK_DIR)
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    cmd = [sys.executable, BOT, "import", "5", path, "--signed"]
+    with open(OWNER_LOCK, "w") as held:
+        fcntl.flock(held, fcntl.LOCK_EX)
+        busy = subprocess.run(cmd, cwd=data_dir, env=env, capture_output=True, text=True)
+    assert busy.returncode == 1
+    assert "send the file to it with /import" in busy.stdout
+    assert not os.path.exists(ledger.exp_file("5"))
+
+    done = subprocess.run(cmd, cwd=data_dir, env=env, capture_output=True, text=True)
+    assert done.returncode == 0, done.stdout + done.stderr
+    assert "Imported 2 expense(s)" in done.stdout
@@ -0,0 +1,52 @@
+from datetime import datetime
+
+import pytest
+
+pytest.importorskip("vk_api")
+
+import ledger
+
+
+def _ids(entries):
+    return [e["id"] for e in entries]
+
+
+def test_large_expenses_span_archive_and_live_oldest_first(data_dir):
+    uid = "li1"
+    ledger.write_archive(uid, 2025, [
+        {"id": "a1", "dt": "2025-12-30T10:00", "amount": 9000, "category": "home", "desc": ""},
+        {"id": "a2", "dt": "2025-11-02T10:00", "amount": 50, "category": "food", "desc": ""},
+    ])
+    big = ledger.save_expense(uid, 7000, "home", "tv", dt=datetime(2026, 1, 2, 10, 0))
+    ledger.save_expense(uid, 5000, "food", "exact", dt=datetime(2026, 1, 1, 10, 0))
+    ledger.save_expense(uid, 5000.01, "food", "over", dt=datetime(2026, 1, 1, 9, 0))
+
+    hits = ledger.large_expenses(uid, 5000)
+    assert [e["desc"] for e in hits] == ["", "over", "tv"]          # strictly above, by date
+    assert _ids(ledger.large_expenses(uid, 5000, "2026-01"))[-1] == big["id"]
+    assert _ids(ledger.large_expenses(uid, 5000, "2025-12")) == ["a1"]
+    assert ledger.large_expenses(uid, 100000) == []
+
+
+def test_index_is_cached_until_the_ledger_changes(data_dir):
+    uid = "li2"
+    ledger.save_expense(uid, 6000, "home", "", dt=datetime(2026, 2, 1, 10, 0))
+    index = ledger.ledger_index(uid)
+    assert ledger.ledger_index(uid) is index
+
+    e = ledger.save_expense(uid, 8000, "home", "", dt=datetime(2026, 2, 2, 10, 0))
+    assert ledger.ledger_index(uid) is not index
+    assert e["id"] in _ids(ledger.large_expenses(uid, 5000))
+
+    ledger.delete_expenses_by_ids(uid, [e["id"]])
+    assert e["id"] not in _ids(ledger.large_expenses(uid, 5000))
+
+
+def test_threshold_is_a_per_user_setting(data_dir):
+    uid = "li3"
+    assert ledger.get_large_threshold(uid) == ledger.LARGE_EXPENSE_LIMIT
+    ledger.save_expense(uid, 1500, "food", "", dt=datetime(2026, 3, 1, 10, 0))
+    ledger.set_large_threshold(uid, 1000)
+    assert ledger.get_large_threshold(uid) == 1000
+    assert len(ledger.large_expenses(uid, ledger.get_large_threshold(uid))) == 1
+    assert "1,500" in ledger.format_large_expenses_for_month(uid, "2026-03")
@@ -0,0 +1,101 @@
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from locks import RWLock
+
+
+def _in_thread(fn):
+    """Run fn in another thread; returns (thread, event set once fn returned)."""
+    done = threading.Event()
+    t = threading.Thread(target=lambda: (fn(), done.set()), daemon=True)
+    t.start()
+    return t, done
+
+
+def test_reentrant_read_and_write():
+    lock = RWLock("t")
+    with lock.reading(), lock.reading():
+        pass
+    with lock.writing(), lock.writing(), lock.reading(), lock.writing():
+        pass
+    assert lock._writer is None and not lock._readers
+
+
+def test_read_to_write_upgrade_raises():
+    lock = RWLock("t")
+    with lock.reading():
+        with pytest.raises(RuntimeError):
+            lock.acquire_write()
+    with lock.writing():                 # the failed upgrade left no trace
+        pass
+
+
+def test_readers_share_writers_exclude():
+    lock = RWLock("t")
+    with lock.reading():
+        t, read = _in_thread(lambda: (lock.acquire_read(), lock.release_read()))
+        assert read.wait(1)
+
+    with lock.writing():
+        t, read = _in_thread(lambda: (lock.acquire_read(), lock.release_read()))
+        assert not read.wait(0.1)
+    t.join(1)
+    assert read.is_set()
+
+
+def test_waiting_writer_blocks_new_readers():
+    lock = RWLock("t")
+    order = []
+    lock.acquire_read()
+    writer, _ = _in_thread(lambda: (lock.acquire_write(), order.append("w"), lock.release_write()))
+    while not lock._waiting_writers:
+        time.sleep(0.001)
+    reader, _ = _in_thread(lambda: (lock.acquire_read(), order.append("r"), lock.release_read()))
+    time.sleep(0.05)
+    assert order == []
+    lock.release_read()
+    writer.join(1)
+    reader.join(1)
+    assert order == ["w", "r"]
+
+
+def test_release_by_other_thread_raises():
+    lock = RWLock("t")
+    errors = []
+
+    def release():
+        try:
+            lock.release_write()
+        except RuntimeError as e:
+            errors.append(e)
+
+    with lock.writing():
+        t, _ = _in_thread(release)
+        t.join(1)
+    assert len(errors) == 1
+
+
+def _other_process_can_read(path):
+    probe = ("import fcntl, os, sys; fd = os.open(sys.argv[1], os.O_RDWR)\n"
+             "try: fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)\n"
+             "except OSError: sys.exit(1)")
+    return subprocess.run([sys.executable, "-c", probe, path]).returncode == 0
+
+
+def test_flock_follows_holders_and_downgrades(tmp_path):
+    pytest.importorskip("fcntl")
+    path = str(tmp_path / "locks" / "t.lock")
+    lock = RWLock("t", path)
+    lock.acquire_write()
+    assert not _other_process_can_read(path)
+    lock.acquire_read()
+    lock.release_write()                 # write-then-read keeps a shared lock only
+    assert _other_process_can_read(path)
+    lock.release_read()
+    assert lock._fd is None
+    assert os.path.exists(path)
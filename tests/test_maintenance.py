@@ -0,0 +1,92 @@
+from datetime import date, datetime
+
+import pytest
+
+pytest.importorskip("vk_api")
+
+import ledger
+import reminders
+
+NIGHT = datetime(2026, 10, 19, 3, 30)
+
+
+@pytest.fixture
+def jobs_env(data_dir, monkeypatch):
+    """Three users and one job at 03:00 that records its calls; fail_for makes a user's runs raise."""
+    calls, finished, fail_for = [], [], set()
+
+    def job(uid, period):
+        if uid in fail_for:
+            raise RuntimeError(f"boom {uid}")
+        calls.append((uid, period))
+
+    monkeypatch.setattr(reminders, "states", {"1": {}, "2": {}, "3": {}})
+    monkeypatch.setattr(reminders, "MAINTENANCE_JOBS", [("nightly", 3, job, finished.append)])
+    return calls, finished, fail_for
+
+
+def test_job_period_is_the_latest_scheduled_day():
+    assert reminders.job_period(3, datetime(2026, 10, 19, 2, 59)) == date(2026, 10, 18)
+    assert reminders.job_period(3, datetime(2026, 10, 19, 3, 0)) == date(2026, 10, 19)
+
+
+def test_archive_job_moves_entries_before_the_cutoff(data_dir):
+    period = date(2026, 2, 19)
+    cutoff = ledger.archive_cutoff(period)
+    assert cutoff == date(2025, 11, 1)                  # EXPENSE_ARCHIVE_MONTHS back, across the year
+    old = ledger.save_expense("mj1", 10, "food", "old", dt=datetime(2025, 10, 31, 23, 59))
+    ledger.save_expense("mj1", 20, "food", "new", dt=datetime(2025, 11, 1, 0, 0))
+
+    reminders._job_expense_archive("mj1", period)
+    assert [e["desc"] for e in ledger.read_expenses("mj1")] == ["new"]
+    assert ledger.read_archived_expenses("mj1", 2025) == [old]
+
+
+def test_batch_size_spreads_users_over_the_target_window():
+    assert reminders.maintenance_batch(0) == reminders.MAINTENANCE_USERS_PER_TICK
+    ticks = reminders.MAINTENANCE_TARGET_SECONDS // reminders.MAINTENANCE_TICK
+    assert reminders.maintenance_batch(ticks * 20 + 1) == 21
+
+
+def test_ticks_resume_from_jobs_json_and_finish_once(jobs_env):
+    calls, finished, _ = jobs_env
+    assert reminders.run_maintenance_tick(reminders.load_jobs(), now=NIGHT, limit=2) == 2
+    assert reminders.maintenance_backlog(reminders.load_jobs()) == 1
+    assert finished == []
+
+    jobs = reminders.load_jobs()                  # as after a restart
+    assert reminders.run_maintenance_tick(jobs, now=NIGHT, limit=2) == 1
+    assert [uid for uid, _ in calls] == ["1", "2", "3"]
+    assert finished == [date(2026, 10, 19)]
+    assert reminders.run_maintenance_tick(jobs, now=NIGHT, limit=2) == 0
+    assert finished == [date(2026, 10, 19)]
+
+    next_night = datetime(2026, 10, 20, 4, 0)
+    assert reminders.run_maintenance_tick(jobs, now=next_night, limit=5) == 3
+    assert reminders.load_jobs()["nightly"]["period"] == "2026-10-20"
+
+
+def test_a_missed_run_is_picked_up_after_downtime(jobs_env):
+    calls, _, _ = jobs_env
+    jobs = {"nightly": {"period": "2026-10-17", "users": {"1": "2026-10-17"}}}
+    reminders.run_maintenance_tick(jobs, now=datetime(2026, 10, 19, 1, 0), limit=5)
+    assert calls == [(u, date(2026, 10, 18)) for u in ("1", "2", "3")]
+
+
+def test_failures_are_retried_then_skipped_until_next_period(jobs_env):
+    calls, finished, fail_for = jobs_env
+    fail_for.add("2")
+    jobs = {}
+    for attempt in range(1, reminders.MAINTENANCE_MAX_ATTEMPTS):
+        reminders.run_maintenance_tick(jobs, now=NIGHT, limit=5)
+        assert jobs["nightly"]["errors"]["2"]["attempts"] == attempt
+        assert reminders.maintenance_backlog(jobs) == 1
+    reminders.run_maintenance_tick(jobs, now=NIGHT, limit=5)
+    assert reminders.maintenance_backlog(jobs) == 0
+    assert finished == [date(2026, 10, 19)]
+    assert jobs["nightly"]["errors"]["2"]["error"] == "boom 2"
+
+    fail_for.clear()
+    reminders.run_maintenance_tick(jobs, now=datetime(2026, 10, 20, 3, 0), limit=5)
+    assert "2" not in jobs["nightly"]["errors"]
+    assert calls.count(("2", date(2026, 10, 20))) == 1
@@ -0,0 +1,101 @@
+import threading
+import urllib.error
+import urllib.request
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+import metrics
+
+
+@pytest.fixture
+def enabled(monkeypatch):
+    """Metrics on, with empty collections."""
+    monkeypatch.setattr(metrics, "ENABLED", True)
+    monkeypatch.setattr(metrics, "_handlers", {})
+    monkeypatch.setattr(metrics, "_locks", [])
+    monkeypatch.setattr(metrics, "_last_summary", {})
+
+
+def test_disabled_is_free(monkeypatch):
+    monkeypatch.setattr(metrics, "ENABLED", False)
+    lock = threading.Lock()
+    assert metrics.track("x") is metrics._NOOP
+    assert metrics.timed_lock("x", lock) is lock
+    assert metrics.lock_stats("x") is None
+    with metrics.track("x"):
+        metrics.count_send()             # nothing to count into, and no error
+
+
+def test_handler_records_io_and_errors(enabled, tmp_path):
+    path = tmp_path / "f.json"
+    path.write_bytes(b"x" * 100)
+    with metrics.track("STATE_A"):
+        metrics.count_send()
+        metrics.count_send()
+        metrics.file_read(str(path))
+        metrics.add_written(7)
+        metrics.count_dump()
+    with pytest.raises(ValueError):
+        with metrics.track("STATE_A"):
+            raise ValueError
+    metrics.count_send()                 # outside a handler: not attributed
+
+    s = metrics._handlers["STATE_A"]
+    assert (s.calls, s.errors, s.sends, s.bytes_read, s.bytes_written, s.json_dumps) == (2, 1, 2, 100, 7, 1)
+    assert sum(s.buckets) == 2
+
+
+def test_lock_waits_are_charged_to_the_waiting_handler(enabled):
+    lock = metrics.timed_lock("state_lock", threading.Lock())
+    held, release = threading.Event(), threading.Event()
+
+    def holder():
+        with lock:
+            held.set()
+            release.wait()
+    t = threading.Thread(target=holder)
+    t.start()
+    held.wait()
+    threading.Timer(0.05, release.set).start()
+    with metrics.track("/slow"):
+        with lock:
+            pass
+    t.join()
+
+    assert (lock.acquisitions, lock.contended) == (2, 1)
+    assert lock.wait_seconds >= 0.04
+    assert metrics._handlers["/slow"].lock_wait["state_lock"] == pytest.approx(lock.wait_seconds)
+
+
+def test_render_and_summary(enabled):
+    metrics.lock_stats("ledger").note(0.5)
+    with metrics.track('say "hi"'):
+        metrics.count_send()
+    text = metrics.render()
+    assert 'vkbot_handler_calls_total{handler="say \\"hi\\""} 1' in text
+    assert 'vkbot_handler_seconds_bucket{handler="say \\"hi\\"",le="+Inf"} 1' in text
+    assert 'vkbot_lock_wait_seconds_total{lock="ledger"} 0.500000' in text
+    assert "# TYPE vkbot_handler_seconds histogram" in text
+
+    (line,) = metrics.summary_lines()
+    assert line.startswith('say "hi": 1 msg,') and "1.0 sends/msg" in line
+    assert metrics.summary_lines() == []             # nothing new since the previous summary
+
+
+def test_endpoint_serves_prometheus_text(enabled):
+    with metrics.track("STATE_B"):
+        pass
+    server = ThreadingHTTPServer(("127.0.0.1", 0), metrics._MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    try:
+        with urllib.request.urlopen(base + "/metrics", timeout=5) as r:
+            assert r.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+            assert 'handler="STATE_B"' in r.read().decode()
+        with pytest.raises(urllib.error.HTTPError) as err:
+            urllib.request.urlopen(base + "/other", timeout=5)
+        assert err.value.code == 404
+    finally:
+        server.shutdown()
+        server.server_close()
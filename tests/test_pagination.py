@@ -0,0 +1,84 @@
+from datetime import datetime
+
+import pytest
+
+pytest.importorskip("vk_api")
+
+import handlers
+import ledger
+from config import DAYS_PER_BATCH, RECENT_ENTRIES_PER_PAGE, STATE_EXP_MENU
+from keyboards import exp_menu_kb
+from planner import append_event, line_key
+from storage import get_data, user
+
+
+def _expenses(uid, n):
+    return [ledger.save_expense(uid, 10 + i, "food", f"item {i}", dt=datetime(2026, 1, 1 + i, 9, 0))
+            for i in range(n)]
+
+
+def test_recent_pages_render_from_a_small_cursor(data_dir, sent):
+    uid = "pg1"
+    saved = _expenses(uid, RECENT_ENTRIES_PER_PAGE + 3)
+    handlers.open_cursor(uid, "exp_recent")
+    assert set(get_data(uid, "cursor")) == {"q", "arg", "offset", "ver"}
+
+    handlers.send_paginated_recent(uid, exp_menu_kb)
+    first = sent[-1][1]
+    assert first.startswith("📋 Recent (newest first):")
+    assert "1. " in first and saved[-1]["desc"] in first
+    assert f"{RECENT_ENTRIES_PER_PAGE}. " in first and f"{RECENT_ENTRIES_PER_PAGE + 1}. " not in first
+    assert "Next" in sent[-1][2]
+
+    handlers.send_paginated_recent(uid, exp_menu_kb)
+    assert sent[-1][1].startswith(f"{RECENT_ENTRIES_PER_PAGE + 1}. ")
+    assert saved[0]["desc"] in sent[-1][1]
+    assert "Next" not in sent[-1][2]
+
+    handlers.send_paginated_recent(uid, exp_menu_kb)
+    assert sent[-1][1] == "—— End of Expense history ——"
+    assert get_data(uid, "cursor") is None
+    assert user(uid)["state"] == STATE_EXP_MENU
+
+
+def test_month_cursor_filters_rows(data_dir, sent):
+    uid = "pg2"
+    _expenses(uid, 3)
+    ledger.save_expense(uid, 99, "food", "february", dt=datetime(2026, 2, 1, 9, 0))
+    handlers.open_cursor(uid, "exp_recent", "2026-02")
+    handlers.send_paginated_recent(uid, exp_menu_kb)
+    assert "february" in sent[-1][1] and "item" not in sent[-1][1]
+
+
+def test_selection_cursor_restarts_when_the_source_changes(data_dir, sent):
+    uid = "pg3"
+    saved = _expenses(uid, RECENT_ENTRIES_PER_PAGE + 2)
+    handlers.open_cursor(uid, "exp_delete", pick=True)
+    handlers._send_delete_page(uid)
+    handlers._send_delete_page(uid)
+    assert handlers.picked_ids(uid, "1 8 99") == {1: saved[-1]["id"], 8: saved[1]["id"], 99: None}
+
+    newest = ledger.save_expense(uid, 5, "food", "new", dt=datetime(2026, 3, 1, 9, 0))
+    handlers._send_delete_page(uid)
+    assert sent[-1][1].startswith("ℹ️ The list changed since it was shown, starting over.")
+    assert handlers.picked_ids(uid, "1 8") == {1: newest["id"], 8: None}
+
+
+def test_day_batches_bind_numbers_to_line_keys(data_dir, sent):
+    uid = "pg4"
+    lines = [f"2026-05-{d:02d}T10:00 event {d}" for d in range(1, DAYS_PER_BATCH + 2)]
+    for line in lines:
+        append_event(uid, line)
+    handlers.open_cursor(uid, "events", pick=True)
+
+    handlers.send_batch(uid)
+    assert sent[0][1].startswith("📅 Today:")
+    assert len(sent) == DAYS_PER_BATCH + 2                       # today, one per day, navigation
+    shown = handlers.picked_ids(uid, f"1 {DAYS_PER_BATCH} {DAYS_PER_BATCH + 1}")
+    assert shown == {1: line_key(lines[0]), DAYS_PER_BATCH: line_key(lines[DAYS_PER_BATCH - 1]),
+                     DAYS_PER_BATCH + 1: None}           # numbers are planner line numbers
+
+    handlers.send_batch(uid)
+    assert lines[-1].split(" ", 1)[1] in sent[-2][1]
+    handlers.send_batch(uid)
+    assert sent[-1][1] == "— End —"
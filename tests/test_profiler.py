@@ -0,0 +1,73 @@
+import threading
+import time
+
+import pytest
+
+import profiler
+
+
+def _spin(stop):
+    while not stop.is_set():
+        sum(range(200))
+
+
+def _sleep(stop):
+    while not stop.is_set():
+        time.sleep(0.001)
+
+
+@pytest.fixture
+def threads():
+    """Start named threads running a target until the test ends."""
+    stop, started = threading.Event(), []
+
+    def run(name, target):
+        t = threading.Thread(target=target, args=(stop,), name=name, daemon=True)
+        t.start()
+        started.append(t)
+    yield run
+    stop.set()
+    for t in started:
+        t.join()
+
+
+def test_samples_attribute_busy_and_idle_stacks(threads, tmp_path):
+    threads("busy-worker", _spin)
+    threads("sleepy-worker", _sleep)
+    prof = profiler.SamplingProfiler(interval=0.002)
+    prof.run(0.3)
+
+    assert prof.samples > 10
+    busy = [s for s in prof.busy_stacks() if s[0] == "busy-worker"]
+    assert busy and all(any(f.startswith("_spin (test_profiler.py:") for f in s) for s in busy)
+    if hasattr(time, "pthread_getcpuclockid"):
+        sleepy = [s for s in prof.stacks if s[0] == "sleepy-worker"]
+        assert sum(prof.stacks[s] for s in sleepy if s[-1] == profiler.IDLE_FRAME) > \
+            sum(prof.stacks[s] for s in sleepy if s[-1] != profiler.IDLE_FRAME)
+    assert any(frame.startswith("_spin (") for frame, _ in prof.top(5, inclusive=True))
+    assert prof.summary().startswith(f"{prof.samples} samples over ")
+
+    path = tmp_path / "p.collapsed"
+    prof.write_collapsed(str(path))
+    lines = path.read_text(encoding="utf-8").splitlines()
+    assert len(lines) == len(prof.stacks)
+    stack, count = lines[0].rsplit(" ", 1)
+    assert prof.stacks[tuple(stack.split(";"))] == int(count)
+
+
+def test_one_run_at_a_time_and_stop_still_writes(tmp_path):
+    done = threading.Event()
+    results = []
+    path = profiler.start(60, str(tmp_path), interval=0.002,
+                          on_done=lambda p, prof: (results.append((p, prof.samples)), done.set()))
+    try:
+        assert path and profiler.running()
+        assert profiler.start(60, str(tmp_path)) is None
+        time.sleep(0.05)
+    finally:
+        assert profiler.stop()
+    assert done.wait(5)
+    assert results[0][0] == path and results[0][1] > 0
+    assert not profiler.running() and not profiler.stop()
+    with open(path, encoding="utf-8") as f:
+        assert f.read().strip()
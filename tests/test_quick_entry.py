@@ -0,0 +1,78 @@
+from datetime import date, datetime
+
+import pytest
+
+pytest.importorskip("vk_api")
+
+from ledger import parse_quick_entry
+
+NOW = datetime(2026, 3, 15, 18, 42, 31)
+
+
+def _parse(text):
+    return parse_quick_entry(text, now=NOW)
+
+
+def test_expense_with_category_tool_and_description():
+    q = _parse("-450 food gp coffee with Anna")
+    assert q == {"kind": "expense", "amount": 450, "category": "food", "tool": "gp",
+                 "desc": "coffee with Anna", "dt": datetime(2026, 3, 15, 18, 42)}
+
+
+def test_income_keeps_category_words_in_description():
+    q = _parse("+12000,50 food bonus")
+    assert q["kind"] == "income"
+    assert q["amount"] == 12000.5
+    assert q["category"] == "other"
+    assert q["desc"] == "food bonus"
+
+
+def test_emoji_category_and_defaults():
+    q = _parse("-300 🍔")
+    assert (q["category"], q["tool"], q["desc"]) == ("food", None, "")
+    assert _parse("-300")["category"] == "other"
+
+
+@pytest.mark.parametrize("text, day", [
+    ("-100 taxi yesterday", date(2026, 3, 14)),
+    ("-100 вчера taxi", date(2026, 3, 14)),
+    ("-100 taxi 2026-02-01", date(2026, 2, 1)),
+    ("-100 2026-02-01 taxi", date(2026, 2, 1)),
+    ("-100 taxi 1.2.2025", date(2025, 2, 1)),
+    ("-100 taxi 1.3", date(2026, 3, 1)),
+    ("-100 @1.3 taxi", date(2026, 3, 1)),
+    ("-100 taxi 31.12", date(2025, 12, 31)),     # a future d.m means last year
+])
+def test_dates(text, day):
+    q = _parse(text)
+    assert q["dt"] == datetime.combine(day, NOW.time().replace(second=0))     # typed time, on that day
+    assert q["desc"] == "taxi"
+
+
+def test_leap_day():
+    assert _parse("-100 taxi 29.02")["dt"].date() == date(2024, 2, 29)
+    q = parse_quick_entry("-100 taxi @29.02", now=datetime(2028, 3, 1, 9, 5))
+    assert q["dt"] == datetime(2028, 2, 29, 9, 5)
+
+
+def test_impossible_short_date_stays_in_description():
+    q = _parse("-100 taxi 31.04")
+    assert q["desc"] == "taxi 31.04"
+    assert q["dt"].date() == NOW.date()
+
+
+def test_short_date_needs_marker_unless_last():
+    q = _parse("-200 coffee 1.5 kg")
+    assert q["desc"] == "coffee 1.5 kg"
+    assert q["dt"] == datetime(2026, 3, 15, 18, 42)
+
+
+def test_only_first_date_counts():
+    q = _parse("-100 yesterday taxi today")
+    assert q["dt"] == datetime(2026, 3, 14, 18, 42)
+    assert q["desc"] == "taxi today"
+
+
+@pytest.mark.parametrize("text", ["450 food", "-0", "- abc", "+", "hello -5", "-1.234"])
+def test_not_a_quick_entry(text):
+    assert _parse(text) is None
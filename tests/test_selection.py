@@ -0,0 +1,61 @@
+from datetime import datetime
+
+import pytest
+
+pytest.importorskip("vk_api")
+
+import ledger
+from config import STATE_EXP_MENU, STATE_START
+from planner import (
+    append_event, get_line_by_key, line_key, planner, read_done, read_events, remove_lines_by_keys,
+    replace_line_by_key, write_events,
+)
+from storage import set_state
+
+
+def test_line_key_helpers_follow_content_not_position(data_dir):
+    uid = "sl1"
+    for line in ("2026-05-01T10:00 a", "2026-05-02T10:00 b", "2026-05-03T10:00 c"):
+        append_event(uid, line)
+    key_b = line_key("2026-05-02T10:00 b")
+
+    write_events(uid, ["2026-04-30T10:00 new"] + read_events(uid))
+    assert get_line_by_key(planner(uid), key_b) == "2026-05-02T10:00 b"
+    assert replace_line_by_key(planner(uid), key_b, "2026-05-02T11:00 b2")
+    assert not replace_line_by_key(planner(uid), key_b, "x")
+    assert remove_lines_by_keys(planner(uid), [line_key("2026-05-03T10:00 c"), "missing"]) == ["2026-05-03T10:00 c"]
+    assert read_events(uid) == ["2026-04-30T10:00 new", "2026-05-01T10:00 a", "2026-05-02T11:00 b2"]
+
+
+def test_complete_acts_on_the_line_that_was_shown(data_dir, say, sent):
+    uid = 3201
+    for line in ("2026-05-01T10:00 a", "2026-05-02T10:00 b", "2026-05-03T10:00 c"):
+        append_event(uid, line)
+    set_state(uid, STATE_START)
+    say(uid, "Complete")
+
+    write_events(uid, read_events(uid)[1:])          # "a" goes away before the user answers
+    say(uid, "2")
+    assert sent[-1][1] == "✅ Completed:\n2026-05-02T10:00 b"
+    assert read_done(uid) == ["2026-05-02T10:00 b"]
+    assert read_events(uid) == ["2026-05-03T10:00 c"]
+
+
+def test_expense_delete_acts_on_the_entries_that_were_shown(data_dir, say, sent):
+    uid = 3202
+    old = [ledger.save_expense(uid, 10 * i, "food", f"e{i}", dt=datetime(2026, 1, i, 9, 0))
+           for i in range(1, 4)]
+    set_state(uid, STATE_EXP_MENU)
+    say(uid, "🗑 Delete expense")
+
+    ledger.save_expense(uid, 99, "food", "added meanwhile", dt=datetime(2026, 2, 1, 9, 0))
+    say(uid, "1 3")
+    assert sent[-3][1].startswith("🗑 Deleted 2 entries:")
+    assert [e["desc"] for e in ledger.read_expenses(str(uid))] == ["e2", "added meanwhile"]
+
+    set_state(uid, STATE_EXP_MENU)
+    say(uid, "🗑 Delete expense")
+    say(uid, "7")
+    assert sent[-1][1] == "Invalid number(s): 7. Try again:"
+    assert len(ledger.read_expenses(str(uid))) == 2
+    assert old[1]["id"] in {e["id"] for e in ledger.read_expenses(str(uid))}
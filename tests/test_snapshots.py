@@ -0,0 +1,151 @@
+import os
+from datetime import datetime
+
+import pytest
+
+pytest.importorskip("vk_api")
+
+import codec
+import ledger
+import snapshots
+from config import PLANNER_DIR, SNAPSHOT_DIR, STATE_START
+from planner import append_event, read_events, write_events
+from storage import set_data, set_state, user
+from snapshots import SNAPSHOT_BLOB_DIR
+
+
+def _blobs():
+    return sorted(name for _, _, names in os.walk(SNAPSHOT_BLOB_DIR) for name in names)
+
+
+def _put(fname, text):
+    with open(os.path.join(PLANNER_DIR, fname), "w", encoding="utf-8") as f:
+        f.write(text)
+
+
+def test_user_files_match_the_exact_uid(data_dir):
+    for fname in ("12plan.txt", "12expenses_2025.col", "123plan.txt", "12plan.txt.tmp", "12expenses.json.wal"):
+        _put(fname, "x")
+    assert sorted(os.path.basename(p) for p in snapshots.snapshot_files_for_user("12")) == [
+        "12expenses_2025.col", "12plan.txt"]
+
+
+def test_unchanged_and_identical_files_are_stored_once(data_dir, monkeypatch):
+    _put("3901plan.txt", "2026-01-01T10:00 a\n")
+    _put("3901done.txt", "same\n")
+    _put("3902done.txt", "same\n")
+    snapshots.create_snapshot("3901")
+    snapshots.create_snapshot("3902")
+    assert len(_blobs()) == 2
+
+    _put("3901plan.txt", "2026-01-01T10:00 b\n")
+    reads = []
+    real_open = open
+    with monkeypatch.context() as m:
+        m.setattr("builtins.open", lambda p, *a, **k: reads.append(p) or real_open(p, *a, **k))
+        ts, _, count = snapshots.create_snapshot("3901")
+
+    assert count == 2 and len(_blobs()) == 3
+    assert os.path.join(PLANNER_DIR, "3901plan.txt") in reads
+    assert os.path.join(PLANNER_DIR, "3901done.txt") not in reads     # size and mtime unchanged
+    files = snapshots.read_manifest("3901", ts)["files"]
+    assert snapshots.read_blob(files["3901plan.txt"]["sha"]) == b"2026-01-01T10:00 b\n"
+    assert len(snapshots.list_snapshots("3901")) == 2
+
+
+def test_prune_keeps_the_newest_and_collects_orphaned_blobs(data_dir, monkeypatch):
+    monkeypatch.setattr(snapshots, "MAX_SNAPSHOTS_PER_USER", 2)
+    stamps = []
+    for n in range(3):
+        _put("3903plan.txt", f"version {n}\n" * (n + 1))
+        stamps.append(snapshots.create_snapshot("3903")[0])
+    assert len(_blobs()) == 3
+
+    assert snapshots.prune_snapshots("3903") == 1
+    assert snapshots.list_snapshots("3903") == stamps[1:]
+    assert len(_blobs()) == 2
+    assert snapshots.gc_snapshot_blobs() == 0
+
+
+def test_legacy_snapshot_folders_are_migrated(data_dir):
+    folder = os.path.join(SNAPSHOT_DIR, "3904_20250101_020000")
+    os.makedirs(folder)
+    with open(os.path.join(folder, "3904plan.txt"), "w") as f:
+        f.write("old plan\n")
+    with open(os.path.join(folder, "state.json"), "w") as f:
+        f.write(codec.dumps({"next_uid": 7}))
+
+    snapshots.migrate_legacy_snapshots()
+    assert not os.path.exists(folder)
+    manifest = snapshots.read_manifest("3904", "20250101_020000")
+    assert manifest["state"] == {"next_uid": 7}
+    assert snapshots.read_blob(manifest["files"]["3904plan.txt"]["sha"]) == b"old plan\n"
+
+
+def _history(uid):
+    """A snapshot, then edits of every kind; returns (ts, expenses at snapshot time)."""
+    append_event(uid, "2026-01-01T10:00 a")
+    append_event(uid, "2026-01-02T10:00 b")
+    e1 = ledger.save_expense(uid, 100, "food", "one", dt=datetime(2026, 1, 1, 9, 0))
+    e2 = ledger.save_expense(uid, 200, "food", "two", dt=datetime(2026, 1, 2, 9, 0))
+    ledger.save_income(uid, 1000, "salary", dt=datetime(2026, 1, 3, 9, 0))
+    ts = snapshots.create_snapshot(uid)[0]
+
+    write_events(uid, ["2026-01-02T10:00 b", "2026-01-03T10:00 c"])
+    ledger.delete_expenses_by_ids(uid, [e1["id"]])
+    ledger.write_expenses(uid, [dict(e2, amount=250)])
+    ledger.save_expense(uid, 300, "fun", "three", dt=datetime(2026, 1, 4, 9, 0))
+    return ts, [e1, e2]
+
+
+def test_diff_decodes_only_changed_files(data_dir):
+    uid = "4001"
+    ts, (e1, e2) = _history(uid)
+    report = snapshots.diff_snapshots(uid, ts)
+    assert report["events"] == {"added": ["2026-01-03T10:00 c"], "removed": ["2026-01-01T10:00 a"]}
+    assert [e["desc"] for e in report["expenses"]["added"]] == ["three"]
+    assert report["expenses"]["removed"] == [e1]
+    assert report["expenses"]["changed"] == [(e2, dict(e2, amount=250))]
+    assert "income" not in report and "done" not in report
+
+    text = snapshots.format_snapshot_diff(uid, ts)
+    assert text.startswith(f"🔍 {ts} → now")
+    assert "📅 Events: +1 / -1" in text and "💸 Expenses: +1 / -1 / ~1" in text
+
+    now_ts = snapshots.create_snapshot(uid)[0]
+    assert snapshots.diff_snapshots(uid, ts, now_ts)["events"] == report["events"]
+    assert snapshots.format_snapshot_diff(uid, now_ts).endswith("No differences.")
+
+
+def test_restore_brings_back_files_and_keeps_id_counters(data_dir):
+    uid = "4002"
+    ts, before = _history(uid)
+    _put(f"{uid}photos.json", "[]")               # a file that did not exist at snapshot time
+    set_state(uid, "some_state")
+    set_data(uid, "cursor", {"q": "events"})
+    next_id = user(uid)["next_exp_id"]
+    assert len(ledger.large_expenses(uid, 150)) == 2
+
+    safety_ts = snapshots.restore_snapshot(uid, ts)
+    assert read_events(uid) == ["2026-01-01T10:00 a", "2026-01-02T10:00 b"]
+    assert ledger.read_expenses(uid) == before
+    assert not os.path.exists(os.path.join(PLANNER_DIR, f"{uid}photos.json"))
+    assert [e["amount"] for e in ledger.large_expenses(uid, 150)] == [200]     # caches dropped
+    assert ledger.read_totals(uid)["2026-01"]["total"] == 300
+    assert user(uid)["next_exp_id"] == next_id
+    assert (user(uid)["state"], user(uid)["data"]) == (STATE_START, {})
+
+    snapshots.restore_snapshot(uid, safety_ts)      # a restore can itself be undone
+    assert read_events(uid) == ["2026-01-02T10:00 b", "2026-01-03T10:00 c"]
+    assert os.path.exists(os.path.join(PLANNER_DIR, f"{uid}photos.json"))
+
+
+def test_restore_in_background_reports_back(data_dir, monkeypatch):
+    messages = []
+    monkeypatch.setattr(snapshots, "send", lambda uid, text, kb=None: messages.append(text))
+    append_event("4003", "2026-01-01T10:00 a")
+    ts = snapshots.create_snapshot("4003")[0]
+    snapshots._restore_in_background("4003", ts)
+    snapshots._restore_in_background("4003", "19990101_000000")
+    assert messages[0].startswith(f"♻️ Restored snapshot {ts}.")
+    assert messages[1] == "❌ Restore failed: no snapshot 19990101_000000"
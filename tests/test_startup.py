@@ -0,0 +1,47 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+pytest.importorskip("vk_api")
+
+MODULES = ["config", "storage", "health", "transport", "keyboards", "planner", "ledger",
+           "snapshots", "reminders", "handlers", "metrics", "profiler", "codec", "locks"]
+
+PROBE = """
+import json, os, sys
+for name in sys.argv[1:]:
+    __import__(name)
+no_bot = "bot" not in sys.modules
+import bot, config, storage, transport, reminders
+print(json.dumps({
+    "files": sorted(os.listdir(".")),
+    "no_bot": no_bot,
+    "log_handlers": len(config.log.handlers),
+    "session": transport._session is not None,
+    "states_loaded": storage._states_loaded,
+    "reminders_loaded": reminders._reminders_loaded,
+}))
+bot.init()
+print(json.dumps({"files": sorted(os.listdir(".")), "states": sorted(storage.states),
+                  "session": transport._session is not None}))
+"""
+
+
+def test_imports_touch_nothing_and_init_prepares_the_data_dir(tmp_path):
+    with open(tmp_path / "states.json", "w") as f:
+        json.dump({"7": {"state": "start", "data": {}}}, f)
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    env.pop("BOT_TRANSPORT", None)                  # the real transport, with no token.txt around
+    run = subprocess.run([sys.executable, "-c", PROBE, *MODULES], cwd=tmp_path, env=env,
+                         capture_output=True, text=True)
+    assert run.returncode == 0, run.stderr
+    imported, initialised = (json.loads(line) for line in run.stdout.splitlines())
+
+    assert imported == {"files": ["states.json"], "no_bot": True, "log_handlers": 0,
+                        "session": False, "states_loaded": False, "reminders_loaded": False}
+    assert {"planners", "snapshots", "states.json"} <= set(initialised["files"])
+    assert initialised["states"] == ["7"]
+    assert initialised["session"] is False
@@ -0,0 +1,113 @@
+import os
+
+import pytest
+
+import storage
+from config import PLANNER_DIR
+from storage import atomic_write, ledger_txn, ledger_wal_file, remove_temp_files, replay_ledger_wals
+
+
+def _read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def _crash(files, fsync=True):
+    raise OSError("power cut")
+
+
+def test_replay_finishes_commit_interrupted_after_wal(data_dir, monkeypatch):
+    ledger = os.path.join(PLANNER_DIR, "7expenses.json")
+    archive = os.path.join(PLANNER_DIR, "7expenses_2025.col")
+    dropped = os.path.join(PLANNER_DIR, "7expenses_2024.col")
+    atomic_write(ledger, "[]")
+    atomic_write(dropped, b"old")
+
+    # die after the WAL record is durable, before any target is written
+    with monkeypatch.context() as m, pytest.raises(OSError):
+        m.setattr(storage, "_apply_staged_files", _crash)
+        with ledger_txn("7") as txn:
+            txn.stage(ledger, '[{"id":"e1"}]')
+            txn.stage(archive, b"\x00\x01col")
+            txn.stage(dropped, None)
+
+    assert os.path.exists(ledger_wal_file("7"))
+    assert _read(ledger) == b"[]"
+    assert not os.path.exists(archive)
+
+    replay_ledger_wals()
+    assert _read(ledger) == b'[{"id":"e1"}]'
+    assert _read(archive) == b"\x00\x01col"
+    assert not os.path.exists(dropped)
+    assert not os.path.exists(ledger_wal_file("7"))
+
+
+def test_torn_wal_is_dropped_not_replayed(data_dir):
+    ledger = os.path.join(PLANNER_DIR, "7expenses.json")
+    atomic_write(ledger, "[]")
+    # a crash while writing the WAL leaves only its temp file: nothing was committed
+    with open(ledger_wal_file("7") + ".123-1" + storage.TEMP_SUFFIX, "wb") as f:
+        f.write(b'{"files": {"planners/7exp')
+
+    remove_temp_files([PLANNER_DIR])
+    replay_ledger_wals()
+    assert os.listdir(PLANNER_DIR) == ["7expenses.json"]
+    assert _read(ledger) == b"[]"
+
+
+def test_nested_transaction_for_another_user_raises(data_dir):
+    with ledger_txn("7"):
+        with ledger_txn("7") as inner:
+            inner.stage(os.path.join(PLANNER_DIR, "7expenses.json"), "[]")
+        with pytest.raises(RuntimeError):
+            with ledger_txn("8"):
+                pass
+    assert os.path.exists(os.path.join(PLANNER_DIR, "7expenses.json"))
+
+
+def test_atomic_write_leaves_the_old_file_on_failure(data_dir, monkeypatch):
+    path = os.path.join(PLANNER_DIR, "7plan.txt")
+    atomic_write(path, "old\n")
+
+    def boom(src, dst):
+        raise OSError("disk full")
+    with monkeypatch.context() as m:
+        m.setattr(storage.os, "replace", boom)
+        with pytest.raises(OSError):
+            storage._write_lines(path, ["new"])
+    assert _read(path) == b"old\n"
+    assert os.listdir(PLANNER_DIR) == ["7plan.txt"]         # no temp file left behind
+
+
+def test_json_stores_fall_back_to_the_previous_version(data_dir):
+    path = os.path.join(PLANNER_DIR, "7income.json")
+    storage._write_json(path, [{"id": "i1"}])
+    storage._write_json(path, [{"id": "i1"}, {"id": "i2"}])
+    assert storage.codec.read(path + storage.BACKUP_SUFFIX) == [{"id": "i1"}]
+
+    with open(path, "w") as f:
+        f.write('[{"id": "i1"}, {"id"')                   # torn
+    assert storage._read_json_list(path) == [{"id": "i1"}]
+    with pytest.raises(ValueError):                          # part of it was already handed out
+        list(storage._iter_json_list(path))
+
+    with open(path, "w") as f:
+        f.write('[{"id"')                                  # torn before the first entry
+    assert list(storage._iter_json_list(path)) == [{"id": "i1"}]
+
+
+def test_unreadable_store_is_quarantined_but_states_never_reset(data_dir, monkeypatch):
+    path = os.path.join(PLANNER_DIR, "7totals.json")
+    for name in (path, path + storage.BACKUP_SUFFIX):
+        with open(name, "w") as f:
+            f.write("{garbage")
+    assert storage._read_json(path, {}) == {}
+    assert not os.path.exists(path)
+    assert any(n.startswith("7totals.json.corrupt-") for n in os.listdir(PLANNER_DIR))
+
+    monkeypatch.setattr(storage, "STATE_FILE", "states.json")
+    for name in ("states.json", "states.json" + storage.BACKUP_SUFFIX):
+        with open(name, "w") as f:
+            f.write("{garbage")
+    with pytest.raises(ValueError):
+        storage.load_states()
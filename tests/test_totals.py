@@ -0,0 +1,61 @@
+from datetime import datetime
+
+import pytest
+
+pytest.importorskip("vk_api")
+
+import ledger
+from ledger import _totals_row_for
+
+
+def _seed(uid):
+    saved = [
+        ledger.save_expense(uid, 100, "food", "a", dt=datetime(2026, 1, 3, 9, 0)),
+        ledger.save_expense(uid, 250.5, "home", "b", dt=datetime(2026, 1, 9, 9, 0)),
+        ledger.save_expense(uid, 40, "food", "c", dt=datetime(2026, 2, 1, 9, 0)),
+    ]
+    return saved
+
+
+def test_rows_carry_count_and_checksum_and_survive_delete(data_dir):
+    uid = "tt1"
+    a, b, c = _seed(uid)
+    totals = ledger.read_totals(uid)
+    assert totals["2026-01"] == _totals_row_for([a, b])
+    assert totals["2026-01"]["count"] == 2
+    assert totals["2026-01"]["food"] == 100
+
+    ledger.delete_expenses_by_ids(uid, [a["id"]])
+    assert ledger.read_totals(uid)["2026-01"] == _totals_row_for([b])
+    assert ledger.recalc_all_totals(uid) == ledger.read_totals(uid)
+
+
+def test_reconcile_repairs_only_drifted_months(data_dir):
+    uid = "tt2"
+    _seed(uid)
+    assert ledger.reconcile_totals(uid, max_months=10) == []
+    good = ledger.read_totals(uid)
+
+    bad = dict(good)
+    bad["2026-01"] = dict(good["2026-01"], total=1.0)                 # drifted total
+    bad["2026-02"] = {"total": 40, "food": 40}                          # legacy row, no checksum
+    bad["2025-12"] = dict(good["2026-02"])                              # month with no entries
+    ledger._save_totals(uid, bad)
+    ledger._set_cashflow_month(uid, "2026-01", expense=1.0)
+
+    assert sorted(ledger.reconcile_totals(uid, max_months=10)) == ["2025-12", "2026-01", "2026-02"]
+    assert ledger.read_totals(uid) == good
+    assert ledger.read_cashflow(uid)["2026-01"]["expense"] == 350.5
+
+
+def test_reconcile_walks_months_a_batch_at_a_time(data_dir):
+    uid = "tt3"
+    for month in range(1, 6):
+        ledger.save_expense(uid, 10 * month, "food", "", dt=datetime(2026, month, 1, 9, 0))
+    good = ledger.read_totals(uid)
+    ledger._save_totals(uid, {mk: dict(row, total=0.0) for mk, row in good.items()})
+
+    assert ledger.reconcile_totals(uid, max_months=2) == ["2026-05", "2026-04"]
+    assert ledger.reconcile_totals(uid, max_months=2) == ["2026-03", "2026-02"]
+    assert ledger.reconcile_totals(uid, max_months=2) == ["2026-01"]
+    assert ledger.read_totals(uid) == good
@@ -0,0 +1,37 @@
+import os
+from datetime import datetime
+
+import pytest
+
+pytest.importorskip("vk_api")
+
+import ledger
+from config import PLANNER_DIR
+
+
+def test_notmy_is_a_category_view_of_the_ledger(data_dir):
+    uid = "vw1"
+    ledger.save_expense(uid, 300, "notmy", "for Anna", dt=datetime(2026, 4, 2, 10, 0))
+    ledger.save_expense(uid, 200, "food", "", dt=datetime(2026, 4, 3, 10, 0))
+    gone = ledger.save_expense(uid, 100, "notmy", "", dt=datetime(2026, 4, 4, 10, 0))
+    ledger.save_expense(uid, 50, "notmy", "", dt=datetime(2026, 5, 1, 10, 0))
+
+    assert [e["amount"] for e in ledger.notmy_expenses(uid, "2026-04")] == [300, 100]
+    assert len(ledger.notmy_expenses(uid)) == 3
+    assert [e["amount"] for e in ledger.ledger_index(uid).month("2026-04")] == [300, 200, 100]
+
+    ledger.delete_expenses_by_ids(uid, [gone["id"]])
+    report = ledger.format_notmy_for_month(uid, "2026-04")
+    assert report.startswith("🚫 Not-my expenses for 2026-04 — 300:")
+    assert "for Anna" in report
+    assert ledger.format_notmy_for_month(uid, "2026-06") == ""
+    assert not any(n.startswith(uid) and "notmy" in n for n in os.listdir(PLANNER_DIR))
+
+
+def test_remove_legacy_views_only_touches_old_journals(data_dir):
+    for name in ("42large_expenses.json", "42notmy.json", "42expenses.json", "notmy.json"):
+        open(os.path.join(PLANNER_DIR, name), "w").close()
+
+    assert ledger.remove_legacy_views() == 2
+    assert sorted(os.listdir(PLANNER_DIR)) == ["42expenses.json", "notmy.json"]
+    assert ledger.remove_legacy_views() == 0
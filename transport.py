@@ -0,0 +1,78 @@
+"""The VK connection: a lazily opened session, long-poll and send() with flood-control retries."""
+import random
+import threading
+import time
+
+import vk_api
+from vk_api.exceptions import ApiError
+from vk_api.longpoll import VkLongPoll
+
+import metrics
+from config import BOT_TRANSPORT, log, read_token
+from health import tick_count
+
+# ================= VK =================
+SEND_RETRIES = 3                  # retries on VK flood control / rate limit
+SEND_RETRY_CODES = (6, 9)         # 6: too many requests per second, 9: flood control
+
+_session = None
+_session_lock = threading.Lock()
+
+def vk_session():
+    """The VK session, opened on first use (BOT_TRANSPORT=fake gives fakevk's)."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            if BOT_TRANSPORT == "fake":
+                import fakevk
+                _session = fakevk.FakeVkSession()
+            else:
+                _session = vk_api.VkApi(token=read_token())
+        return _session
+
+class _LazyApi:
+    """Stands in for vk_session().get_api() so importing never touches the token or network."""
+    _api = None
+
+    def __getattr__(self, name):
+        if self._api is None:
+            self._api = vk_session().get_api()
+        return getattr(self._api, name)
+
+vk = _LazyApi()
+
+def open_longpoll():
+    if BOT_TRANSPORT == "fake":
+        import fakevk
+        return fakevk.FakeLongPoll(vk_session())
+    return VkLongPoll(vk_session(), mode=2)
+
+def upload_document(path, peer_id, title=None):
+    """Upload a file as a message document for peer_id; returns the attachment string."""
+    if BOT_TRANSPORT == "fake":
+        doc = vk_session().upload_document(path, peer_id, title)
+    else:
+        doc = vk_api.VkUpload(vk_session()).document_message(path, title=title, peer_id=peer_id)
+        doc = doc.get("doc", doc)
+    return f"doc{doc['owner_id']}_{doc['id']}"
+
+def send(uid, text, kb=None, attachment=None):
+    if not text:
+        text = "."
+    for attempt in range(SEND_RETRIES + 1):
+        try:
+            vk.messages.send(
+                user_id=uid,
+                random_id=random.randint(1, 2**31 - 1),   # ── FIX
+                message=text,
+                keyboard=kb,
+                attachment=attachment
+            )
+            metrics.count_send()
+            tick_count("sent")
+            return
+        except ApiError as e:
+            if getattr(e, "code", None) not in SEND_RETRY_CODES or attempt == SEND_RETRIES:
+                raise
+            log.warning(f"VK rate limit sending to {uid} (code {e.code}), retry {attempt + 1}")
+            time.sleep(0.5 * 2 ** attempt)